@@ -56,6 +56,7 @@ from api.v1.views.core import (
     CreateMLAProfiles,
     CSVUploadView,
     FBPageViewSet,
+    FBRateLimitsStatus,
     KPIViewSet,
     PageCategoriesViewSet,
     ProxiesStatus,
@@ -163,6 +164,7 @@ urlpatterns += [
     path('tools/ads/stop/', StopAllAds.as_view()),
     path('tools/csv/import/<str:type>/', CSVUploadView.as_view()),
     path('tools/proxies/', ProxiesStatus.as_view()),
+    path('tools/fb_limits/', FBRateLimitsStatus.as_view()),
     path('tools/cards/', CreateXCards.as_view()),
 ]
 
@@ -41,7 +41,14 @@ class AccountCreateSerializer(serializers.ModelSerializer):
 
 class SimpleStatusSerializer(serializers.ModelSerializer):
     title = serializers.CharField(source='get_status_display', read_only=True)
-    status_duration = serializers.DurationField(read_only=True)
+    status_duration = serializers.SerializerMethodField()
+
+    def get_status_duration(self, obj):
+        # Для списков время в статусе заранее считается пачкой, см. Account.get_status_durations
+        status_durations = self.context.get('status_durations', {})
+        if obj.id in status_durations:
+            return duration_string(status_durations[obj.id])
+        return duration_string(obj.status_duration)
 
     class Meta:
         model = Account
@@ -53,7 +60,7 @@ class AccountSimpleSerializer(serializers.ModelSerializer):
     status = serializers.SerializerMethodField()
 
     def get_status(self, obj):
-        return SimpleStatusSerializer(obj).data
+        return SimpleStatusSerializer(obj, context=self.context).data
 
     def get_is_banned(self, obj):
         return True if obj.status == Account.BANNED else False
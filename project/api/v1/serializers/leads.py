@@ -31,6 +31,7 @@ class LinkGroupListSerializer(FlexFieldsModelSerializer):
             'created_at',
             'csv',
             'total_links',
+            'exported_links',
             'total_clicks',
             'unique_clicks',
             'click_rate',
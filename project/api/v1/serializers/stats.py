@@ -1,3 +1,5 @@
+from typing import Any, Dict
+
 from rest_framework import serializers
 
 from api.v1.serializers.accounts import AccountSimpleSerializer
@@ -15,6 +17,30 @@ class StatsCalcsMetricsMixin(serializers.Serializer):
     ctr = serializers.DecimalField(max_digits=10, decimal_places=2, default=0)
 
 
+def hydrate_stats(rows) -> Dict[str, Any]:
+    """
+    Подтягивает связанные объекты для страницы статы одним in_bulk на модель.
+    Результат передается в контекст сериализатора, иначе get_* делают запрос на каждую строку
+    """
+    models = {
+        'campaign_id': Campaign.objects.all(),
+        'account_id': Account.objects.all(),
+        'adaccount_id': AdAccount.objects.select_related('business', 'account'),
+        'user_id': User.objects.select_related('team'),
+        'flow_id': Flow.objects.all(),
+    }
+    stats_objects: Dict[str, Dict[int, Any]] = {}
+    for key, queryset in models.items():
+        ids = {row[key] for row in rows if row.get(key) is not None}
+        if ids:
+            stats_objects[key] = queryset.in_bulk(ids)
+
+    accounts = list(stats_objects.get('account_id', {}).values())
+    accounts += [adaccount.account for adaccount in stats_objects.get('adaccount_id', {}).values()]
+    status_durations = Account.get_status_durations(accounts) if accounts else {}
+    return {'stats_objects': stats_objects, 'status_durations': status_durations}
+
+
 class BaseStatsSerializerMixin(serializers.Serializer):
     visits = serializers.IntegerField()
     clicks = serializers.IntegerField()
@@ -25,37 +51,43 @@ class BaseStatsSerializerMixin(serializers.Serializer):
     profit = serializers.DecimalField(max_digits=10, decimal_places=2, default=0)
     payment = serializers.DecimalField(max_digits=10, decimal_places=2, default=0)
 
+    def get_stats_object(self, model, key, obj_id):
+        stats_objects = self.context.get('stats_objects', {})
+        if key in stats_objects:
+            return stats_objects[key].get(obj_id)
+        return model.objects.filter(id=obj_id).first()
+
     def get_campaign(self, obj):
         campaign_id = obj.pop('campaign_id')
-        campaign = Campaign.objects.filter(id=campaign_id).first()
+        campaign = self.get_stats_object(Campaign, 'campaign_id', campaign_id)
         if campaign:
             return {'id': campaign.id, 'name': campaign.name, 'country_code': campaign.country_code}
         return None
 
     def get_account(self, obj):
         account_id = obj.pop('account_id')
-        account = Account.objects.filter(id=account_id).first()
+        account = self.get_stats_object(Account, 'account_id', account_id)
         if account:
-            return AccountSimpleSerializer(account).data
+            return AccountSimpleSerializer(account, context=self.context).data
         return None
 
     def get_adaccount(self, obj):
         adaccount_id = obj.pop('adaccount_id')
-        adaccount = AdAccount.objects.filter(id=adaccount_id).first()
+        adaccount = self.get_stats_object(AdAccount, 'adaccount_id', adaccount_id)
         if adaccount:
-            return AdAccountSimpleSerializer(adaccount).data
+            return AdAccountSimpleSerializer(adaccount, context=self.context).data
         return None
 
     def get_user(self, obj):
         user_id = obj.pop('user_id')
-        user = User.objects.filter(id=user_id).first()
+        user = self.get_stats_object(User, 'user_id', user_id)
         if user:
             return AccountUserSerializer(user).data
         return None
 
     def get_flow(self, obj):
         flow_id = obj.pop('flow_id')
-        flow = Flow.objects.filter(id=flow_id).first()
+        flow = self.get_stats_object(Flow, 'flow_id', flow_id)
         if flow:
             return FlowSerializer(flow).data
         return None
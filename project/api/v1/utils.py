@@ -1,8 +1,10 @@
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Optional
 
-from django.db.models import Aggregate, Case, F, FloatField, Func, When
+from django.db.models import Aggregate, Case, F, FloatField, Func, IntegerField, Q, QuerySet, When
 from django.db.models.functions import Cast, Round
 
+from dateutil.relativedelta import relativedelta
 from dateutil.rrule import MONTHLY, rrule
 
 from core.models.core import User
@@ -51,6 +53,37 @@ PROFIT = F('revenue') - F('spend')  # - F('payment')
 PROFIT_V2 = F('revenue') - Case(When(spend=0, then=F('cost')), default=F('spend'))
 
 
+def parse_stat_date(value: Optional[str]) -> Optional[date]:
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        return None
+
+
+def period_stat_filter(date_from: date, date_to: Optional[date], today: date) -> Q:
+    """
+    Фильтр для UserAccountPeriodStat/UserPeriodStat: полные закрытые месяцы периода берем из месячных роллапов,
+    остальные дни (открытый месяц и неполные месяцы по краям) - из дневной статы
+    """
+    start = date_from.replace(day=1)
+    if start < date_from:
+        start += relativedelta(months=1)
+
+    end = today.replace(day=1)
+    if date_to is not None:
+        end = min(end, (date_to + timedelta(days=1)).replace(day=1))
+
+    if start >= end:
+        return Q(is_month=False)
+    return (
+        Q(is_month=True, date__gte=start, date__lt=end)
+        | Q(is_month=False, date__lt=start)
+        | Q(is_month=False, date__gte=end)
+    )
+
+
 class Median(Aggregate):
     function = 'PERCENTILE_CONT'
     name = 'median'
@@ -58,6 +91,57 @@ class Median(Aggregate):
     template = '%(function)s(0.5) WITHIN GROUP (ORDER BY %(expressions)s)'
 
 
+class TotalOver(Func):
+    """
+    Итог по всем сгруппированным строкам в том же запросе: SUM(SUM(x)) OVER ().
+    Считается до LIMIT/OFFSET, поэтому на странице лежит тотал по всей выборке
+    """
+
+    function = 'SUM'
+    template = '%(function)s(%(expressions)s) OVER ()'
+    contains_over_clause = True
+    window_compatible = True
+
+    def get_group_by_cols(self, alias=None):
+        return []
+
+
+class CountOver(Func):
+    """
+    Количество сгруппированных строк в том же запросе: COUNT(*) OVER ()
+    """
+
+    template = 'COUNT(*) OVER ()'
+    contains_over_clause = True
+    window_compatible = True
+    output_field = IntegerField()
+
+    def get_group_by_cols(self, alias=None):
+        return []
+
+
+TOTALS_PREFIX = 'grand_'
+TOTALS_COUNT = f'{TOTALS_PREFIX}count'
+
+
+def with_totals(queryset: QuerySet, **totals: str) -> QuerySet:
+    """
+    Добавляет к сгруппированному queryset тоталы (total_name='annotation') и количество строк окнами,
+    строки, тотал и count приходят одним запросом. TotalStatsPagination забирает их из строк страницы
+    """
+    annotations = {f'{TOTALS_PREFIX}{name}': TotalOver(field) for name, field in totals.items()}
+    annotations[TOTALS_COUNT] = CountOver()
+    return queryset.annotate(**annotations)
+
+
+def pop_totals(row: Dict[str, Any]) -> Dict[str, Any]:
+    totals = {}
+    for key in list(row):
+        if key.startswith(TOTALS_PREFIX):
+            totals[key[len(TOTALS_PREFIX) :]] = row.pop(key)
+    return totals
+
+
 #  SERIALIZER FIELDS
 ACCOUNT_FIELDS_BY_ROLE = {
     User.ADMIN: {
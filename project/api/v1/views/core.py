@@ -2,6 +2,7 @@ import csv
 import json
 import logging
 from collections import OrderedDict
+from typing import Any, Dict
 
 from django.core.cache import cache
 from django.db.models import Q, QuerySet
@@ -42,6 +43,8 @@ from api.v1.serializers.core import (
     ShortifyDomainSerializer,
     CountSerializer,
 )
+from api.v1.utils import TOTALS_COUNT, pop_totals
+from core import fb_governor
 from core.admin import PseudoBuffer
 from core.models.core import (
     Account,
@@ -65,6 +68,37 @@ logger = logging.getLogger(__name__)
 
 
 class TotalStatsPagination(LimitOffsetPagination):
+    totals: Dict[str, Any] = {}
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Для queryset из with_totals count и тоталы берутся из строк страницы, без отдельных COUNT и aggregate
+        """
+        if not isinstance(queryset, QuerySet) or TOTALS_COUNT not in queryset.query.annotations:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        self.offset = self.get_offset(request)
+        self.request = request
+        page = list(queryset[self.offset : self.offset + self.limit])
+        # Страница за пределами выборки - тоталы берем из первой строки
+        first_row = page[0] if page else next(iter(queryset[:1]), None)
+
+        self.totals = pop_totals(first_row) if first_row else {}
+        for row in page:
+            pop_totals(row)
+        self.count = self.totals.pop('count', 0)
+
+        if self.count > self.limit and self.template is not None:
+            self.display_page_controls = True
+
+        if self.count == 0 or self.offset > self.count:
+            return []
+        return page
+
     def get_paginated_response(self, data, total=None):
         return Response(
             OrderedDict(
@@ -303,6 +337,20 @@ class ProxiesStatus(APIView):
         return Response(json.loads(haproxy.to_json()))
 
 
+class FBRateLimitsStatus(APIView):
+    """
+    Состояние ограничителя запросов к FB по акками и рекламным аккаунтам, самые загруженные первыми
+    """
+
+    allowed_roles = (User.ADMIN,)
+
+    def get(self, request, *args, **kwargs):
+        state = fb_governor.get_state()
+        if request.query_params.get('type'):
+            state = [item for item in state if item['type'] == request.query_params['type']]
+        return Response({'results': state[:500], 'count': len(state)})
+
+
 class CSVUploadView(APIView):
     """
     Api endpoint for upload products csv-file
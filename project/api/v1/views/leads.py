@@ -29,7 +29,7 @@ from api.v1.views.core import DinamicFieldsListAPIView
 from core.models import User
 from core.models.core import Campaign, LeadgenLead, LeadgenLeadConversion, LinkGroup
 from core.pagination import CachedCountLimitOffsetPagination
-from core.tasks.links import create_links, process_click_stats, process_lander_data
+from core.tasks.links import buffer_click_stats, create_links, process_lander_data
 
 # from django.db import transaction
 # from django.http import StreamingHttpResponse
@@ -122,7 +122,7 @@ class LeadgenClickPostbackView(APIView):
         # print(request.data)
         if request.headers.get('X-API-Key') != settings.SHORTIFY_API_KEY:
             return Response(status=status.HTTP_403_FORBIDDEN)
-        process_click_stats.delay(request.data)
+        buffer_click_stats(request.data)
         return Response(status=status.HTTP_200_OK)
 
 
@@ -161,6 +161,7 @@ class LeadgenBroadcastRecreateView(APIView):
             elif request.user.role == User.TEAMLEAD and group.user.team and group.user.team != request.user.team:
                 raise PermissionError()
 
+        group.reset_links_progress()
         create_links.delay(group.id)
 
         return Response(status=status.HTTP_200_OK)
@@ -1,8 +1,7 @@
 import datetime
 from decimal import Decimal
 
-# from typing import Any, Dict
-from typing import Any
+from typing import Any, Dict
 
 from django.conf import settings
 from django.db.models import Case, Count, ExpressionWrapper, F, Q, QuerySet, Sum, When
@@ -36,8 +35,23 @@ from api.v1.serializers.stats import (
     LeadgenLeadStatsSerializer,
     TotalStatsSerializerMixin,
     UsersStatSerializer,
+    hydrate_stats,
+)
+from api.v1.utils import (
+    CR,
+    CTR,
+    CV,
+    EPC,
+    PROFIT,
+    PROFIT_V2,
+    ROI,
+    SPEND,
+    Median,
+    months_list,
+    parse_stat_date,
+    period_stat_filter,
+    with_totals,
 )
-from api.v1.utils import CR, CTR, CV, EPC, PROFIT, PROFIT_V2, ROI, SPEND, Median, months_list
 from api.v1.views.core import TotalStatsPagination
 from core.models import User
 from core.models.core import (
@@ -47,8 +61,9 @@ from core.models.core import (
     FlowDayStat,
     LeadgenLead,
     UserAccountDayStat,
+    UserAccountPeriodStat,
     UserCampaignDayStat,
-    UserDayStat,
+    UserPeriodStat,
 )
 
 
@@ -195,21 +210,70 @@ class UserBaseStats(APIView):
         return Response(data=data, status=status.HTTP_200_OK)
 
 
-class BaseStatViewMixin(GenericAPIView):
+# Тоталы статы: имя в ответе -> аннотация строки
+STATS_TOTALS = {
+    'total_leads': 'leads',
+    'total_visits': 'visits',
+    'total_clicks': 'clicks',
+    'total_revenue': 'revenue',
+    'total_spend': 'spend',
+    'total_profit': 'profit',
+    'total_payment': 'payment',
+}
+
+
+class PeriodStatMixin:
+    """
+    Для вьюх на UserAccountPeriodStat/UserPeriodStat: закрытые месяцы читаются из месячных роллапов
+    """
+
+    stats_start_date = datetime.date(2020, 3, 1)
+
+    def filter_period(self, queryset: QuerySet) -> QuerySet:
+        date_from_param = self.request.query_params.get('date_from')
+        date_to_param = self.request.query_params.get('date_to')
+        date_from = parse_stat_date(date_from_param)
+        date_to = parse_stat_date(date_to_param)
+        if (date_from_param and date_from is None) or (date_to_param and date_to is None):
+            # Непонятный формат даты - считаем по дням
+            return queryset.filter(is_month=False)
+
+        date_from = max(date_from or self.stats_start_date, self.stats_start_date)
+        return queryset.filter(period_stat_filter(date_from, date_to, timezone.now().date()))
+
+
+class StatsContextMixin:
+    """
+    Объекты для строк статы грузятся пачкой в list (hydrate_stats) и уходят в контекст сериализатора
+    """
+
+    stats_context: Dict[str, Any] = {}
+
+    def get_serializer_context(self) -> Dict[str, Any]:
+        context = super().get_serializer_context()
+        context.update(self.stats_context)
+        return context
+
+
+class BaseStatViewMixin(StatsContextMixin, PeriodStatMixin, GenericAPIView):
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_class = StatDateFilter
     pagination_class = TotalStatsPagination
+    # queryset на UserAccountPeriodStat
+    period_stats = False
 
     def list(self, request: Request, *args: Any, **kwargs: Any) -> Response:
         stats = self.get_stats()
-        total_stats = self.get_total_stats(stats)
-
-        page = self.paginate_queryset(stats)
+        page = self.paginate_queryset(with_totals(stats, **STATS_TOTALS))
 
         if page is not None:
+            total_stats = self.get_total_stats(self.paginator.totals)
+            self.stats_context = hydrate_stats(page)
             serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response_with_total(serializer.data, total_stats)
 
+        stats = list(stats)
+        self.stats_context = hydrate_stats(stats)
         serializer = self.get_serializer(stats, many=True)
         return Response(serializer.data)
 
@@ -227,6 +291,8 @@ class BaseStatViewMixin(GenericAPIView):
             else:
                 queryset = queryset.filter(user=self.request.user)
 
+        if self.period_stats:
+            queryset = self.filter_period(queryset)
         return queryset
 
     def get_stats(self):
@@ -236,23 +302,17 @@ class BaseStatViewMixin(GenericAPIView):
             visits=Sum('visits'),
             clicks=Sum('clicks'),
             revenue=Sum('revenue'),
-            spend=Sum(SPEND),
+            spend=Sum('total_spend') if self.period_stats else Sum(SPEND),
             payment=Sum('payment'),
         ).annotate(epc=EPC, cv=CV, cr=CR, ctr=CTR, roi=ROI, profit=PROFIT)
         ordering = OrderingFilter()
         return ordering.filter_queryset(request=self.request, queryset=queryset, view=self)
 
-    def get_total_stats(self, stats: QuerySet):
-        # TODO: придумать красивее
-        total_stats = stats.aggregate(
-            total_leads=Sum('leads'),
-            total_visits=Sum('visits'),
-            total_clicks=Sum('clicks'),
-            total_revenue=Sum('revenue'),
-            total_spend=Sum('spend'),
-            total_profit=Sum('profit'),
-            total_payment=Sum('payment'),
-        )
+    def get_total_stats(self, total_stats: Dict[str, Any]):
+        """
+        total_stats - тоталы из with_totals, которые пагинатор забрал из строк страницы
+        """
+        total_stats = {name: total_stats.get(name) for name in STATS_TOTALS}
         total_stats.update(
             {
                 'epc': Decimal('0.00'),
@@ -301,40 +361,44 @@ class DateStatView(BaseStatViewMixin, ListAPIView):
 class CampaignStatView(BaseStatViewMixin, ListAPIView):
     allowed_roles = (User.ADMIN, User.FINANCIER, User.MEDIABUYER, User.TEAMLEAD, User.JUNIOR)
     queryset = (
-        UserAccountDayStat.objects.filter(campaign__isnull=False)
+        UserAccountPeriodStat.objects.filter(campaign__isnull=False)
         .exclude(campaign__name__icontains='youtube')
         .values('campaign_id')
     )
     serializer_class = CampaignStatSerializer
+    period_stats = True
 
 
 class AccountsStatView(BaseStatViewMixin, ListAPIView):
     allowed_roles = (User.ADMIN, User.FINANCIER, User.MEDIABUYER, User.TEAMLEAD, User.JUNIOR)
     queryset = (
-        UserAccountDayStat.objects.filter(account__isnull=False)
+        UserAccountPeriodStat.objects.filter(account__isnull=False)
         .exclude(campaign__name__icontains='youtube')
         .values('account_id')
     )
     serializer_class = AccountStatSerializer
+    period_stats = True
 
 
-class AdAccountsStatView(ListAPIView):
+class AdAccountsStatView(StatsContextMixin, PeriodStatMixin, ListAPIView):
     allowed_roles = (User.ADMIN, User.FINANCIER, User.MEDIABUYER, User.TEAMLEAD, User.JUNIOR)
-    queryset = UserDayStat.objects.filter(account__isnull=False).values('account_id')
+    queryset = UserPeriodStat.objects.filter(account__isnull=False).values('account_id')
     serializer_class = AccountStatSerializer
     pagination_class = TotalStatsPagination
     filterset_class = StatDateFilter2
 
     def list(self, request: Request, *args: Any, **kwargs: Any) -> Response:
         stats = self.get_stats()
-        total_stats = self.get_total_stats(stats)
-
-        page = self.paginate_queryset(stats)
+        page = self.paginate_queryset(with_totals(stats, **STATS_TOTALS))
 
         if page is not None:
+            total_stats = self.get_total_stats(self.paginator.totals)
+            self.stats_context = hydrate_stats(page)
             serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response_with_total(serializer.data, total_stats)
 
+        stats = list(stats)
+        self.stats_context = hydrate_stats(stats)
         serializer = self.get_serializer(stats, many=True)
         return Response(serializer.data)
 
@@ -352,7 +416,7 @@ class AdAccountsStatView(ListAPIView):
             else:
                 queryset = queryset.filter(user=self.request.user)
 
-        return queryset
+        return self.filter_period(queryset)
 
     def get_stats(self):
         queryset = self.get_queryset()
@@ -368,17 +432,11 @@ class AdAccountsStatView(ListAPIView):
         ordering = OrderingFilter()
         return ordering.filter_queryset(request=self.request, queryset=queryset, view=self)
 
-    def get_total_stats(self, stats: QuerySet):
-        # TODO: придумать красивее
-        total_stats = stats.aggregate(
-            total_leads=Sum('leads'),
-            total_visits=Sum('visits'),
-            total_clicks=Sum('clicks'),
-            total_revenue=Sum('revenue'),
-            total_spend=Sum('spend'),
-            total_profit=Sum('profit'),
-            total_payment=Sum('payment'),
-        )
+    def get_total_stats(self, total_stats: Dict[str, Any]):
+        """
+        total_stats - тоталы из with_totals, которые пагинатор забрал из строк страницы
+        """
+        total_stats = {name: total_stats.get(name) for name in STATS_TOTALS}
         total_stats.update(
             {
                 'epc': Decimal('0.00'),
@@ -442,11 +500,12 @@ class AccountStatusStatsView(APIView):
 class UsersStatView(BaseStatViewMixin, ListAPIView):
     allowed_roles = (User.ADMIN, User.FINANCIER, User.MEDIABUYER, User.TEAMLEAD)
     queryset = (
-        UserAccountDayStat.objects.filter(user__isnull=False)
+        UserAccountPeriodStat.objects.filter(user__isnull=False)
         .exclude(campaign__name__icontains='youtube')
         .values('user_id')
     )
     serializer_class = UsersStatSerializer
+    period_stats = True
 
     def get_queryset(self) -> QuerySet:
         queryset = self.filter_queryset(self.queryset)
@@ -457,7 +516,7 @@ class UsersStatView(BaseStatViewMixin, ListAPIView):
         # if self.request.user.role in [User.MEDIABUYER, User.TEAMLEAD]:
         #     queryset = queryset.filter(user__team=self.request.user.team)
 
-        return queryset
+        return self.filter_period(queryset)
 
 
 class FlowsStatView(BaseStatViewMixin, ListAPIView):
@@ -470,7 +529,12 @@ class FlowsStatView(BaseStatViewMixin, ListAPIView):
         queryset = self.get_queryset()
 
         return queryset.annotate(
-            leads=Sum('leads'), visits=Sum('visits'), clicks=Sum('clicks'), revenue=Sum('revenue'), spend=Sum('cost')
+            leads=Sum('leads'),
+            visits=Sum('visits'),
+            clicks=Sum('clicks'),
+            revenue=Sum('revenue'),
+            spend=Sum('cost'),
+            payment=Sum('payment'),
         ).annotate(epc=EPC, cv=CV, cr=CR, ctr=CTR, roi=ROI, profit=PROFIT)
 
 
@@ -77,6 +77,8 @@ from core.pagination import LargeTablePaginator
 from core.tasks import (
     clear_account_stats_task,
     load_fb_leads,
+    preview_rebuild_account_stats_task,
+    rebuild_account_stats_task,
     reload_account_fb_stats_task,
     reload_tracker_campaign_stats,
     update_tracker_costs,
@@ -292,7 +294,14 @@ class AccountAdmin(FSMTransitionMixin, admin.ModelAdmin):
     )
     list_editable = ('total_spends', 'paid_till')
     date_hierarchy = 'created_at'
-    actions = ['reload_fb_stats', 'clear_account_stats', 'reload_tracker_stats', 'update_full_costs']
+    actions = [
+        'reload_fb_stats',
+        'clear_account_stats',
+        'reload_tracker_stats',
+        'update_full_costs',
+        'rebuild_stats',
+        'preview_rebuild_stats',
+    ]
     actions_on_bottom = True
     actions_on_top = True
 
@@ -327,6 +336,20 @@ class AccountAdmin(FSMTransitionMixin, admin.ModelAdmin):
 
     clear_account_stats.short_description = "Clear Account Stats"
 
+    def rebuild_stats(modeladmin, request, queryset):
+        for account in queryset:
+            rebuild_account_stats_task.delay(account.id)
+        modeladmin.message_user(request, "Account Stats Rebuilding!", level=messages.SUCCESS)
+
+    rebuild_stats.short_description = "Rebuild Stats from raw data"
+
+    def preview_rebuild_stats(modeladmin, request, queryset):
+        for account in queryset:
+            preview_rebuild_account_stats_task.delay(account.id, request.user.id)
+        modeladmin.message_user(request, "Stats rebuild preview will be sent to notifications", level=messages.SUCCESS)
+
+    preview_rebuild_stats.short_description = "Preview Stats rebuild (dry run)"
+
     def get_queryset(self, request):
         return (
             super(AccountAdmin, self).get_queryset(request).prefetch_related('manager').prefetch_related('created_by')
@@ -528,7 +551,7 @@ class ShortifyDomainAdmin(admin.ModelAdmin):
 
 
 class CountryAdmin(admin.ModelAdmin):
-    list_display = ('name', 'code', 'is_public', 'sort')
+    list_display = ('name', 'code', 'phone_prefix', 'is_public', 'sort')
     list_editable = ('is_public', 'sort')
     list_filter = ('is_public',)
 
@@ -1082,7 +1105,7 @@ class AdAccountCreditCardAdmin(admin.ModelAdmin):
 
 
 class ProcessCSVTaskAdmin(admin.ModelAdmin):
-    list_display = ('user', 'status', 'file', 'created')
+    list_display = ('user', 'status', 'file', 'processed_rows', 'rejected_rows', 'imported_rows', 'created')
     list_filter = ('status',)
 
 
@@ -0,0 +1,144 @@
+import json
+import logging
+import time
+import uuid
+from typing import Any, Iterable, Optional, Sequence
+
+from celery import group, signature
+from celery.canvas import Signature
+from redis import Redis
+
+from core.metrics import record_metrics
+from project.celery_app import app
+
+redis = Redis(host='redis', db=0, decode_responses=True)
+logger = logging.getLogger(__name__)
+
+FANOUT_PREFIX = 'fanout'
+FANOUT_DONE_TASK = 'core.tasks.core.fanout_item_done_task'
+# Сколько задач ставим на один шаг сдвига
+FANOUT_CHUNK_SIZE = 5
+# Пауза между шагами, итого запуск растягивается на len(items) / chunk_size * stagger секунд
+FANOUT_STAGGER = 2.0
+# Сколько после последнего шага ждем завершения задач (с ретраями), прежде чем считать запуск брошенным
+FANOUT_GRACE = 60 * 60
+
+
+def lock_key(name: str) -> str:
+    return f'{FANOUT_PREFIX}:{name}:lock'
+
+
+def run_key(run_id: str) -> str:
+    return f'{FANOUT_PREFIX}:run:{run_id}'
+
+
+def task_queue(task_name: str) -> str:
+    """
+    Очередь задачи по task_routes: отметка о завершении идет туда же, где выполнялась сама задача
+    """
+    return app.amqp.router.route({}, task_name)['queue'].name
+
+
+def fan_out(
+    name: str,
+    task_name: str,
+    items: Iterable[Sequence[Any]],
+    chunk_size: int = FANOUT_CHUNK_SIZE,
+    stagger: float = FANOUT_STAGGER,
+    callback: Optional[Signature] = None,
+) -> Optional[str]:
+    """
+    Ставит task_name по каждому из items (аргументы) одним group, по chunk_size задач на каждые stagger секунд.
+    Каждая задача отмечает завершение через link/link_error, ретраи идут через брокер со своим countdown.
+    callback ставится один раз, когда завершатся все задачи.
+    Пока предыдущий запуск с тем же name не закончился, новый не ставится - возвращает None.
+    """
+    started = time.monotonic()
+    items = [list(item) for item in items]
+    spread = (len(items) - 1) // chunk_size * stagger if items else 0
+    run_id = uuid.uuid4().hex
+    ttl = int(spread) + FANOUT_GRACE
+    if not redis.set(lock_key(name), run_id, nx=True, ex=ttl):
+        logger.warning(f'Fan-out {name} skipped: previous run {redis.get(lock_key(name))} is not finished')
+        return None
+
+    if not items:
+        redis.delete(lock_key(name))
+        if callback is not None:
+            callback.delay()
+        return run_id
+
+    pipe = redis.pipeline(transaction=False)
+    pipe.hset(
+        run_key(run_id),
+        mapping={
+            'name': name,
+            'pending': len(items),
+            'tasks': len(items),
+            'failed': 0,
+            'started_at': time.time(),
+            'callback': json.dumps(dict(callback)) if callback is not None else '',
+        },
+    )
+    pipe.expire(run_key(run_id), ttl)
+    pipe.execute()
+
+    queue = task_queue(task_name)
+    done = signature(FANOUT_DONE_TASK, kwargs={'run_id': run_id}, queue=queue)
+    failed = signature(FANOUT_DONE_TASK, kwargs={'run_id': run_id, 'failed': True}, queue=queue)
+    try:
+        group(
+            signature(
+                task_name,
+                args=args,
+                countdown=i // chunk_size * stagger,
+                link=done,
+                link_error=failed,
+            )
+            for i, args in enumerate(items)
+        ).apply_async()
+    except Exception:
+        # Не поставили - не держим блокировку до следующего запуска
+        redis.delete(lock_key(name), run_key(run_id))
+        raise
+
+    record_metrics(
+        f'fanout_{name}',
+        tasks=len(items),
+        chunks=(len(items) - 1) // chunk_size + 1,
+        spread=spread,
+        dispatch_duration=round(time.monotonic() - started, 3),
+    )
+    return run_id
+
+
+def item_done(run_id: str, failed: bool = False) -> None:
+    """
+    Задача запуска завершилась (failed - после всех ретраев), последняя ставит callback и снимает блокировку
+    """
+    pipe = redis.pipeline(transaction=False)
+    pipe.hincrby(run_key(run_id), 'failed', int(failed))
+    pipe.hincrby(run_key(run_id), 'pending', -1)
+    _, pending = pipe.execute()
+    if pending <= 0:
+        finish_run(run_id)
+
+
+def finish_run(run_id: str) -> None:
+    run = redis.hgetall(run_key(run_id))
+    redis.delete(run_key(run_id))
+    if not run.get('name'):
+        return
+    if run['callback']:
+        signature(json.loads(run['callback'])).delay()
+
+    # Снимаем только свою блокировку: если запуск протух, под ней уже может быть следующий
+    if redis.get(lock_key(run['name'])) == run_id:
+        redis.delete(lock_key(run['name']))
+
+    record_metrics(
+        f'fanout_{run["name"]}_done',
+        tasks=int(run['tasks']),
+        failed=int(run['failed']),
+        duration=round(time.time() - float(run['started_at']), 1),
+    )
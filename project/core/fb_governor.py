@@ -0,0 +1,238 @@
+import json
+import logging
+import re
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from facebook_business import FacebookAdsApi
+from facebook_business.exceptions import FacebookRequestError
+from redis import Redis
+
+redis = Redis(host='redis', db=0, decode_responses=True)
+logger = logging.getLogger(__name__)
+
+GOVERNOR_PREFIX = 'fb_governor'
+GOVERNOR_TTL = 24 * 60 * 60
+
+# Ведро на ключ: при низком использовании запросы идут без ожидания
+BUCKET_CAPACITY = 20
+BUCKET_RATE = 5.0
+# Выше этого процента использования скорость пополнения падает линейно до BUCKET_MIN_RATE на 100%
+HIGH_USAGE_PCT = 75.0
+BUCKET_MIN_RATE = 0.05
+# Дольше в воркере не ждем - задача уходит в ретрай
+MAX_WAIT = 60.0
+
+ADACCOUNT_PATH_RE = re.compile(r'act_(\d+)')
+
+# Пополнение и списание атомарно, иначе параллельные воркеры одного акка расходуют одни и те же токены
+ACQUIRE_SCRIPT = redis.register_script(
+    """
+local now = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'rate', 'blocked_until')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+local rate = tonumber(state[3]) or tonumber(ARGV[4])
+local blocked_until = tonumber(state[4]) or 0
+if blocked_until > now then
+    return tostring(blocked_until - now)
+end
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[5]))
+return tostring(wait)
+"""
+)
+
+
+class FBRateLimitExceeded(Exception):
+    def __init__(self, key: str, wait: float):
+        super().__init__(f'{key} is rate limited for {wait:.0f}s')
+        self.key = key
+        self.wait = wait
+
+
+def account_key(account_id: int) -> str:
+    return f'{GOVERNOR_PREFIX}:account:{account_id}'
+
+
+def adaccount_key(adaccount_id: int) -> str:
+    return f'{GOVERNOR_PREFIX}:adaccount:{adaccount_id}'
+
+
+def usage_rate(usage: float) -> float:
+    if usage <= HIGH_USAGE_PCT:
+        return BUCKET_RATE
+    factor = max(0.0, (100.0 - usage) / (100.0 - HIGH_USAGE_PCT))
+    return max(BUCKET_MIN_RATE, BUCKET_RATE * factor)
+
+
+def parse_json_header(headers: Dict[str, str], name: str) -> Any:
+    for header, value in headers.items():
+        if header.lower() == name:
+            try:
+                return json.loads(value)
+            except ValueError:
+                return None
+    return None
+
+
+def parse_usage_headers(headers: Dict[str, str]) -> Tuple[Optional[Dict], Optional[Dict]]:
+    """
+    Использование по токену (x-business-use-case-usage, x-app-usage) и по рекламному аккаунту
+    (x-ad-account-usage): {'usage': процент, 'regain_in': секунд до снятия блокировки}
+    """
+    account_usage = None
+    business_usage = parse_json_header(headers, 'x-business-use-case-usage') or {}
+    app_usage = parse_json_header(headers, 'x-app-usage')
+    usages = [usage for usages in business_usage.values() for usage in usages]
+    if app_usage:
+        usages.append(app_usage)
+    if usages:
+        account_usage = {
+            'usage': max(
+                max(usage.get('call_count', 0), usage.get('total_cputime', 0), usage.get('total_time', 0))
+                for usage in usages
+            ),
+            'regain_in': max(usage.get('estimated_time_to_regain_access', 0) for usage in usages) * 60,
+        }
+
+    adaccount_usage = None
+    ad_account_usage = parse_json_header(headers, 'x-ad-account-usage')
+    if ad_account_usage:
+        usage = float(ad_account_usage.get('acc_id_util_pct', 0))
+        adaccount_usage = {
+            'usage': usage,
+            'regain_in': ad_account_usage.get('reset_time_duration', 0) if usage >= 100 else 0,
+        }
+    return account_usage, adaccount_usage
+
+
+def record_usage(key: str, usage: Dict[str, float]) -> None:
+    now = time.time()
+    state = {
+        'usage': usage['usage'],
+        'rate': usage_rate(usage['usage']),
+        'blocked_until': now + usage['regain_in'] if usage['regain_in'] else 0,
+        'updated_at': now,
+    }
+    pipe = redis.pipeline(transaction=False)
+    pipe.hset(key, mapping=state)
+    pipe.expire(key, GOVERNOR_TTL)
+    pipe.execute()
+    if usage['usage'] > HIGH_USAGE_PCT or usage['regain_in']:
+        logger.info(f'{key}: usage {usage["usage"]}%, regain in {usage["regain_in"]}s')
+
+
+def acquire(key: str, cost: int = 1) -> None:
+    """
+    Ждет, пока в ведре ключа наберется cost токенов. Если ждать дольше MAX_WAIT - FBRateLimitExceeded
+    """
+    cost = min(cost, BUCKET_CAPACITY)
+    waited = 0.0
+    while True:
+        wait = float(ACQUIRE_SCRIPT(keys=[key], args=[time.time(), BUCKET_CAPACITY, cost, BUCKET_RATE, GOVERNOR_TTL]))
+        if not wait:
+            return
+        if waited + wait > MAX_WAIT:
+            raise FBRateLimitExceeded(key, wait)
+        time.sleep(wait)
+        waited += wait
+
+
+def get_state() -> List[Dict[str, Any]]:
+    """
+    Состояние всех ведер, самые загруженные первыми
+    """
+    keys = list(redis.scan_iter(f'{GOVERNOR_PREFIX}:*', count=1000))
+    pipe = redis.pipeline(transaction=False)
+    for key in keys:
+        pipe.hgetall(key)
+    now = time.time()
+    state = []
+    for key, values in zip(keys, pipe.execute()):
+        _, kind, object_id = key.split(':', 2)
+        blocked_until = float(values.get('blocked_until') or 0)
+        state.append(
+            {
+                'key': key,
+                'type': kind,
+                'id': object_id,
+                'usage': float(values.get('usage') or 0),
+                'tokens': float(values.get('tokens') or BUCKET_CAPACITY),
+                'rate': float(values.get('rate') or BUCKET_RATE),
+                'blocked_for': max(0.0, blocked_until - now),
+                'updated_at': float(values['updated_at']) if values.get('updated_at') else None,
+            }
+        )
+    return sorted(state, key=lambda item: (item['blocked_for'], item['usage']), reverse=True)
+
+
+class GovernedFacebookAdsApi(FacebookAdsApi):
+    """
+    FacebookAdsApi, который перед каждым запросом берет токены в ведрах акка и рекламного аккаунта из пути,
+    а после - обновляет их по заголовкам использования из ответа (и из ответа с ошибкой)
+    """
+
+    crm_account_id: Optional[int] = None
+
+    def get_keys(self, path, params: Optional[Dict[str, Any]] = None) -> List[str]:
+        """
+        Ключи ведер запроса: акк и рекламный аккаунт из пути. У batch - рекламные аккаунты всех запросов в нем,
+        каждый запрос батча - отдельный токен
+        """
+        keys = []
+        if self.crm_account_id is not None:
+            keys.append(account_key(self.crm_account_id))
+        batch = (params or {}).get('batch')
+        if isinstance(batch, list):
+            keys = keys * len(batch)
+            paths = [request.get('relative_url', '') for request in batch]
+        else:
+            paths = [path if isinstance(path, str) else '/'.join(map(str, path))]
+        for request_path in paths:
+            match = ADACCOUNT_PATH_RE.search(request_path)
+            if match:
+                keys.append(adaccount_key(int(match.group(1))))
+        return keys
+
+    def update_usage(self, keys: List[str], headers: Dict[str, str]) -> None:
+        account_usage, adaccount_usage = parse_usage_headers(headers or {})
+        for key in set(keys):
+            usage = adaccount_usage if ':adaccount:' in key else account_usage
+            if usage is not None:
+                record_usage(key, usage)
+
+    def call(self, method, path, params=None, headers=None, files=None, url_override=None, api_version=None):
+        keys = self.get_keys(path, params)
+        for key, cost in Counter(keys).items():
+            acquire(key, cost)
+        # У batch заголовки использования рекламного аккаунта не относятся к конкретному, обновляем только акк
+        usage_keys = [key for key in keys if ':adaccount:' not in key] if 'batch' in (params or {}) else keys
+        try:
+            response = super().call(method, path, params, headers, files, url_override, api_version)
+        except FacebookRequestError as e:
+            self.update_usage(usage_keys, dict(e.http_headers() or {}))
+            raise
+        self.update_usage(usage_keys, dict(response.headers() or {}))
+        return response
+
+
+def init_fb_api(account, **kwargs) -> GovernedFacebookAdsApi:
+    """
+    FacebookAdsApi.init для токена акка с учетом лимитов по акку и рекламным аккаунтам
+    """
+    api = GovernedFacebookAdsApi.init(access_token=account.fb_access_token, proxies=account.proxy_config, **kwargs)
+    api.crm_account_id = account.id
+    # init пишет _default_api только в подкласс, а объекты SDK без api= берут FacebookAdsApi.get_default_api()
+    FacebookAdsApi.set_default_api(api)
+    return api
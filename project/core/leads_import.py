@@ -0,0 +1,240 @@
+import csv
+import io
+import json
+import logging
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from dateutil.parser import parse
+from rest_framework.exceptions import ValidationError
+
+from api.v1.serializers.leads import LeadgenLeadValidateSerializer
+from core.models.core import Country, ProcessCSVTask
+from core.phone_normalizer import CSV, normalize_phones
+
+logger = logging.getLogger(__name__)
+
+LEADS_IMPORT_CHUNK_SIZE = 10000
+
+# Колонки csv, которые валидируются полями LeadgenLeadValidateSerializer
+TEXT_COLUMNS = ('email', 'first_name', 'last_name', 'name', 'city', 'zip', 'address', 'offer', 'phone')
+STAGING_COLUMNS = ('row_num', 'uuid') + TEXT_COLUMNS + ('country_id', 'country_code', 'created_at', 'raw_data')
+
+# Дубли отсекаются по паре (phone, email) внутри файла и против уже существующих лидов,
+# строки без телефона и email не дедуплицируются
+INSERT_LEADS_SQL = """
+INSERT INTO core_leadgenlead (
+    uuid, email, first_name, last_name, name, city, zip, address, offer, phone,
+    country_id, country_code, created_at, raw_data
+)
+SELECT
+    s.uuid, s.email, s.first_name, s.last_name, s.name, s.city, s.zip, s.address, s.offer, s.phone,
+    s.country_id, s.country_code, s.created_at, s.raw_data
+FROM (
+    SELECT DISTINCT ON (
+        COALESCE(phone, ''), COALESCE(email, ''), CASE WHEN phone IS NULL AND email IS NULL THEN row_num END
+    ) *
+    FROM {staging}
+    ORDER BY
+        COALESCE(phone, ''), COALESCE(email, ''), CASE WHEN phone IS NULL AND email IS NULL THEN row_num END, row_num
+) s
+WHERE NOT EXISTS (
+    SELECT 1 FROM core_leadgenlead lead WHERE lead.phone = s.phone AND lead.email IS NOT DISTINCT FROM s.email
+)
+AND NOT EXISTS (
+    SELECT 1 FROM core_leadgenlead lead
+    WHERE s.phone IS NULL AND lead.phone IS NULL AND lead.email = s.email
+)
+ORDER BY s.row_num
+"""
+
+
+class CountryMap:
+    """
+    Страны по коду в памяти процесса, неизвестные коды создаются как и раньше через get_or_create
+    """
+
+    def __init__(self):
+        self.countries = dict(Country.objects.values_list('code', 'id'))
+
+    def get(self, code: str) -> int:
+        code = code.upper()
+        if code not in self.countries:
+            country, _ = Country.objects.get_or_create(code=code, defaults={'name': code})
+            self.countries[code] = country.id
+        return self.countries[code]
+
+
+class LeadColumnValidator:
+    """
+    Валидирует пачку строк по колонкам правилами полей LeadgenLeadValidateSerializer.
+    Повторяющиеся в пачке значения (offer, city, zip) валидируются один раз.
+    """
+
+    def __init__(self):
+        fields = LeadgenLeadValidateSerializer().fields
+        self.fields = {column: fields[column] for column in TEXT_COLUMNS}
+
+    def validate(self, columns: Dict[str, List[Optional[str]]], errors: Dict[int, Dict[str, Any]]) -> None:
+        for column, values in columns.items():
+            field = self.fields[column]
+            validated: Dict[str, Any] = {}
+            for i, value in enumerate(values):
+                if value is None or i in errors:
+                    continue
+                if value not in validated:
+                    try:
+                        validated[value] = field.run_validation(value)
+                    except ValidationError as e:
+                        validated[value] = e
+                result = validated[value]
+                if isinstance(result, ValidationError):
+                    errors[i] = {column: result.detail}
+                else:
+                    values[i] = result
+
+
+class LeadsImporter:
+    """
+    Импорт лидов из csv: пачки строк валидируются по колонкам и через COPY пишутся в staging таблицу,
+    в конце один INSERT ... SELECT в core_leadgenlead с отсечением дублей.
+    Прогресс и количество отклоненных строк пишутся в ProcessCSVTask после каждой пачки.
+    """
+
+    def __init__(self, import_task: ProcessCSVTask, chunk_size: int = LEADS_IMPORT_CHUNK_SIZE):
+        self.import_task = import_task
+        self.chunk_size = chunk_size
+        self.staging = f'core_leadimport_{import_task.id}'
+        self.countries = CountryMap()
+        self.validator = LeadColumnValidator()
+        self.processed_rows = 0
+        self.rejected_rows = 0
+        self.imported_rows = 0
+        self.duplicate_rows = 0
+
+    def read_chunks(self, f) -> Iterator[List[Dict[str, str]]]:
+        chunk = []
+        for line in csv.DictReader(f, delimiter=','):
+            chunk.append(line)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def prepare_chunk(self, lines: List[Dict[str, str]]) -> List[List[Any]]:
+        errors: Dict[int, Dict[str, Any]] = {}
+        columns = {column: [line.get(column) for line in lines] for column in TEXT_COLUMNS}
+        for i, line in enumerate(lines):
+            if not columns['name'][i] and line.get('first_name') and line.get('last_name'):
+                columns['name'][i] = f'{line["first_name"]} {line["last_name"]}'
+
+        country_ids: List[Optional[int]] = [None] * len(lines)
+        country_codes: List[Optional[str]] = [None] * len(lines)
+        for i, line in enumerate(lines):
+            code = (line.get('country') or '').strip().upper()
+            if code:
+                if len(code) != 2 or not code.isalpha():
+                    errors[i] = {'country': f'Invalid country code {code}'}
+                    continue
+                country_ids[i] = self.countries.get(code)
+                country_codes[i] = code
+
+        columns['phone'] = [phone or None for phone in normalize_phones(columns['phone'], country_codes, CSV)]
+        columns['email'] = [email.strip() or None if email is not None else None for email in columns['email']]
+
+        self.validator.validate(columns, errors)
+
+        rows = []
+        for i, line in enumerate(lines):
+            row_num = self.processed_rows + i + 1
+            if i not in errors and not any(columns[column][i] for column in TEXT_COLUMNS):
+                errors[i] = {'non_field_errors': 'Empty row'}
+            if i in errors:
+                logger.error('Invalid lead data', extra={'row': row_num, 'errors': errors[i]})
+                continue
+
+            created_at = timezone.now()
+            if line.get('date'):
+                try:
+                    created_at = parse(line['date'])
+                except Exception as e:
+                    logger.error(e, exc_info=True)
+
+            rows.append(
+                [row_num, uuid.uuid4()]
+                + [columns[column][i] for column in TEXT_COLUMNS]
+                + [country_ids[i], country_codes[i], created_at, json.dumps(line)]
+            )
+        self.rejected_rows += len(errors)
+        return rows
+
+    def copy_rows(self, cursor, rows: List[List[Any]]) -> None:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows(rows)
+        buffer.seek(0)
+        cursor.copy_expert(f'COPY {self.staging} ({", ".join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+    def save_progress(self) -> None:
+        ProcessCSVTask.objects.filter(pk=self.import_task.id).update(
+            processed_rows=self.processed_rows,
+            rejected_rows=self.rejected_rows,
+            imported_rows=self.imported_rows,
+            duplicate_rows=self.duplicate_rows,
+        )
+
+    def run(self) -> None:
+        started = time.monotonic()
+        with connection.cursor() as cursor:
+            # UNLOGGED таблица вместо временной - переживает транзакции pgbouncer между пачками
+            cursor.execute(f'DROP TABLE IF EXISTS {self.staging}')
+            cursor.execute(
+                f"""
+                CREATE UNLOGGED TABLE {self.staging} (
+                    row_num bigint NOT NULL,
+                    uuid uuid NOT NULL,
+                    email varchar(254),
+                    first_name varchar(255),
+                    last_name varchar(255),
+                    name varchar(255),
+                    city varchar(128),
+                    zip varchar(32),
+                    address varchar(255),
+                    offer varchar(32),
+                    phone varchar(32),
+                    country_id integer,
+                    country_code varchar(2),
+                    created_at timestamp with time zone NOT NULL,
+                    raw_data jsonb
+                )
+                """
+            )
+            try:
+                valid_rows = 0
+                with open(self.import_task.file.path) as f:
+                    for lines in self.read_chunks(f):
+                        rows = self.prepare_chunk(lines)
+                        if rows:
+                            self.copy_rows(cursor, rows)
+                        valid_rows += len(rows)
+                        self.processed_rows += len(lines)
+                        self.save_progress()
+
+                with transaction.atomic():
+                    cursor.execute(INSERT_LEADS_SQL.format(staging=self.staging))
+                    self.imported_rows = cursor.rowcount
+                self.duplicate_rows = valid_rows - self.imported_rows
+                self.save_progress()
+            finally:
+                cursor.execute(f'DROP TABLE IF EXISTS {self.staging}')
+
+        elapsed = time.monotonic() - started
+        logger.info(
+            f'Leads import {self.import_task.id}: {self.processed_rows} rows in {elapsed:.1f}s, '
+            f'imported {self.imported_rows}, rejected {self.rejected_rows}, duplicates {self.duplicate_rows}'
+        )
@@ -0,0 +1,102 @@
+import json
+import os
+import resource
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import override_settings
+
+from core.models import User
+from core.models.core import LeadgenLead, Link, LinkGroup, ShortifyDomain
+from core.tasks.helpers import create_broadcast_file
+
+
+class StubShortifyHandler(BaseHTTPRequestHandler):
+    latency = 0.05
+    received = 0
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        data = json.loads(self.rfile.read(length))
+        with self.lock:
+            StubShortifyHandler.received += len(data)
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгрузка бродкаста на синтетической группе ссылок с заглушкой SHORTIFY: время и пиковая память. '
+        'Все создаваемые данные откатываются'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--links', action='store', dest='links', type=int, default=500000)
+        parser.add_argument('-l', '--latency', action='store', dest='latency', type=int, default=50, help='ms')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(is_superuser=True).first()
+        if not user:
+            raise CommandError('No superuser to own the group')
+
+        StubShortifyHandler.latency = options['latency'] / 1000
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubShortifyHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        csv_path = None
+        try:
+            with transaction.atomic(), override_settings(SHORTIFY_URL=f'http://127.0.0.1:{server.server_port}'):
+                if not ShortifyDomain.objects.filter(is_public=True, is_banned=False).exists():
+                    ShortifyDomain.objects.create(domain='bench.local', is_public=True)
+                group = LinkGroup.objects.create(user=user, name='bench', base_url='https://example.com')
+
+                started = time.monotonic()
+                batch_size = 10000
+                for offset in range(0, options['links'], batch_size):
+                    size = min(batch_size, options['links'] - offset)
+                    leads = LeadgenLead.objects.bulk_create(
+                        LeadgenLead(
+                            first_name=f'Name{offset + i}',
+                            email=f'bench{offset + i}@example.com',
+                            phone=f'+48{500000000 + offset + i}',
+                        )
+                        for i in range(size)
+                    )
+                    Link.objects.bulk_create(
+                        Link(user=user, group=group, leadgen_lead=lead, url=f'https://example.com/?l={lead.id}')
+                        for lead in leads
+                    )
+                self.stdout.write(f'Created {options["links"]} links in {time.monotonic() - started:.1f}s')
+
+                rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                started = time.monotonic()
+                create_broadcast_file(group)
+                elapsed = time.monotonic() - started
+                rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+                group.refresh_from_db()
+                if group.csv:
+                    csv_path = os.path.join(settings.MEDIA_ROOT, group.csv.name)
+                exported = group.exported_links
+                transaction.set_rollback(True)
+        finally:
+            server.shutdown()
+            if csv_path and os.path.exists(csv_path):
+                os.remove(csv_path)
+
+        self.stdout.write(f'Export: {elapsed:.1f}s ({exported / elapsed:.0f} links/s)')
+        growth = (rss_after - rss_before) / 1024
+        self.stdout.write(f'Peak RSS: {rss_after / 1024:.0f} MB, +{growth:.0f} MB during export')
+        if exported != options['links'] or StubShortifyHandler.received != options['links']:
+            raise CommandError(f'Exported {exported}, cached {StubShortifyHandler.received} of {options["links"]}')
+        self.stdout.write(self.style.SUCCESS('All links exported and cached'))
@@ -0,0 +1,76 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+
+from rest_framework.test import APIRequestFactory
+
+from api.v1.views.leads import LeadgenClickPostbackView
+from core.models.core import Link, LinkGroup
+from core.tasks.links import LINK_CLICKS_FLUSHING_KEY, LINK_CLICKS_KEY, flush_click_stats, redis
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест приема постбеков кликов: пачка параллельных запросов во вьюху, потом flush. '
+        'Запись в базу откатывается, но счетчики в redis общие - не запускать на проде'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('-g', '--group', action='store', dest='group_id', type=int, required=True)
+        parser.add_argument('-r', '--requests', action='store', dest='requests', type=int, default=1000)
+        parser.add_argument('-s', '--size', action='store', dest='size', type=int, default=20, help='Stats per request')
+        parser.add_argument('-c', '--concurrency', action='store', dest='concurrency', type=int, default=20)
+
+    def handle(self, *args, **options):
+        if redis.exists(LINK_CLICKS_KEY) or redis.exists(LINK_CLICKS_FLUSHING_KEY):
+            raise CommandError('There are unflushed clicks, run flush_click_stats first')
+
+        links = list(Link.objects.filter(group_id=options['group_id']))
+        if not links:
+            raise CommandError('Group has no links')
+
+        payloads = [
+            [{'key': link.key, 'clicks': random.randint(1, 3)} for link in random.choices(links, k=options['size'])]
+            for _ in range(options['requests'])
+        ]
+        expected = sum(stat['clicks'] for payload in payloads for stat in payload)
+
+        factory = APIRequestFactory()
+        view = LeadgenClickPostbackView.as_view()
+
+        def post(payload):
+            request = factory.post('/', payload, format='json', HTTP_X_API_KEY=settings.SHORTIFY_API_KEY)
+            return view(request).status_code
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            statuses = list(executor.map(post, payloads))
+        elapsed = time.monotonic() - started
+        if any(code != 200 for code in statuses):
+            raise CommandError(f'Failed requests: {sum(code != 200 for code in statuses)}')
+        self.stdout.write(f'Ingest: {len(payloads)} requests in {elapsed:.2f}s ({len(payloads) / elapsed:.0f} req/s)')
+
+        with transaction.atomic():
+            clicks_before = Link.objects.filter(group_id=options['group_id']).aggregate(clicks=Sum('clicks'))['clicks']
+            total_before = LinkGroup.objects.get(id=options['group_id']).total_clicks
+
+            started = time.monotonic()
+            flushed = flush_click_stats()
+            elapsed = time.monotonic() - started
+            self.stdout.write(f'Flush: {flushed} links in {elapsed:.3f}s')
+
+            clicks_after = Link.objects.filter(group_id=options['group_id']).aggregate(clicks=Sum('clicks'))['clicks']
+            total_after = LinkGroup.objects.get(id=options['group_id']).total_clicks
+            transaction.set_rollback(True)
+
+        if clicks_after - clicks_before != expected or total_after - total_before != expected:
+            raise CommandError(
+                f'Clicks mismatch: expected {expected}, links +{clicks_after - clicks_before}, '
+                f'group +{total_after - total_before}'
+            )
+        self.stdout.write(self.style.SUCCESS(f'Clicks match: {expected}'))
@@ -0,0 +1,130 @@
+import datetime
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from django.core.management.base import BaseCommand, CommandError
+
+from facebook_business import FacebookAdsApi
+from facebook_business.adobjects.adaccount import AdAccount as FBAdAccount
+from facebook_business.session import FacebookSession
+
+from core.tasks.helpers import load_adaccounts_insights
+
+INSIGHTS_PATH = re.compile(r'act_(\d+)/insights')
+
+
+class StubGraphHandler(BaseHTTPRequestHandler):
+    """
+    Отдает фейковые инсайты по дням, latency имитирует поход через прокси
+    """
+
+    latency = 0.2
+    days = 3
+
+    def log_message(self, *args):
+        pass
+
+    def insights_page(self, url):
+        parsed = urlparse(url)
+        query = parse_qs(parsed.query)
+        adaccount_id = INSIGHTS_PATH.search(parsed.path).group(1)
+        limit = int(query.get('limit', ['100'])[0])
+        offset = int(query.get('after', ['0'])[0])
+        start = datetime.date(2021, 1, 1)
+        data = [
+            {
+                'account_id': adaccount_id,
+                'date_start': (start + datetime.timedelta(days=day)).isoformat(),
+                'date_stop': (start + datetime.timedelta(days=day)).isoformat(),
+                'spend': '1.00',
+                'clicks': '1',
+            }
+            for day in range(offset, min(offset + limit, self.days))
+        ]
+        page = {'data': data, 'paging': {'cursors': {'before': str(offset), 'after': str(offset + limit)}}}
+        if offset + limit < self.days:
+            page['paging']['next'] = f'https://graph.facebook.com/act_{adaccount_id}/insights?after={offset + limit}'
+        return page
+
+    def respond(self, body):
+        time.sleep(self.latency)
+        content = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self.respond(self.insights_page(self.path))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode())
+        batch = json.loads(form['batch'][0])
+        self.respond(
+            [
+                {
+                    'code': 200,
+                    'headers': [{'name': 'Content-Type', 'value': 'application/json'}],
+                    'body': json.dumps(self.insights_page(item['relative_url'])),
+                }
+                for item in batch
+            ]
+        )
+
+
+class Command(BaseCommand):
+    help = 'Сравнение загрузки инсайтов по одному рекламному аккаунту и batch запросами на локальной заглушке Graph API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--adaccounts', action='store', dest='adaccounts', type=int, default=100)
+        parser.add_argument('-d', '--days', action='store', dest='days', type=int, default=3)
+        parser.add_argument('-l', '--latency', action='store', dest='latency', type=int, default=200, help='ms')
+        parser.add_argument('--limit', action='store', dest='limit', type=int, default=100, help='Page size')
+
+    def handle(self, *args, **options):
+        StubGraphHandler.latency = options['latency'] / 1000
+        StubGraphHandler.days = options['days']
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubGraphHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        FacebookSession.GRAPH = f'http://127.0.0.1:{server.server_port}'
+
+        adaccount_ids = [str(1000000 + i) for i in range(options['adaccounts'])]
+        params = {
+            'time_range': {'since': '2021-01-01', 'until': '2021-01-31'},
+            'limit': options['limit'],
+            'level': 'account',
+            'fields': ['spend', 'clicks'],
+            'time_increment': 1,
+        }
+        api = FacebookAdsApi.init(access_token='bench')
+        try:
+            started = time.monotonic()
+            sequential = {
+                adaccount_id: list(FBAdAccount(fbid=f'act_{adaccount_id}').get_insights(params=params))
+                for adaccount_id in adaccount_ids
+            }
+            sequential_time = time.monotonic() - started
+            self.stdout.write(f'Per adaccount: {sequential_time:.2f}s')
+
+            started = time.monotonic()
+            batched, errors = load_adaccounts_insights(api, adaccount_ids, params)
+            batched_time = time.monotonic() - started
+            self.stdout.write(f'Batch: {batched_time:.2f}s')
+        finally:
+            server.shutdown()
+
+        if errors:
+            raise CommandError(f'Batch errors: {errors}')
+        sequential_rows = sum(len(stats) for stats in sequential.values())
+        batched_rows = sum(len(stats) for stats in batched.values())
+        if sequential_rows != batched_rows:
+            raise CommandError(f'Rows mismatch: {sequential_rows} != {batched_rows}')
+        self.stdout.write(
+            self.style.SUCCESS(f'Rows: {batched_rows}, x{sequential_time / batched_time:.1f} per account wall time')
+        )
@@ -0,0 +1,91 @@
+import csv
+import os
+import random
+import resource
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.leads_import import LEADS_IMPORT_CHUNK_SIZE, LeadsImporter
+from core.models import User
+from core.models.core import ProcessCSVTask
+
+
+class Command(BaseCommand):
+    help = (
+        'Импорт синтетического csv с лидами: строк в секунду и пиковая память. '
+        'Часть строк невалидна, часть дублируется. Все создаваемые данные откатываются'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--rows', action='store', dest='rows', type=int, default=1000000)
+        parser.add_argument('-c', '--chunk', action='store', dest='chunk', type=int, default=LEADS_IMPORT_CHUNK_SIZE)
+
+    def write_csv(self, path, rows):
+        invalid, duplicates = 0, 0
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['first_name', 'last_name', 'email', 'phone', 'country', 'city', 'offer', 'date'])
+            for i in range(rows):
+                number = i
+                email = f'bench{i}@example.com'
+                dice = random.random()
+                if dice < 0.01:
+                    email = 'not-an-email'
+                    invalid += 1
+                elif dice < 0.05 and i:
+                    number = random.randrange(i)
+                    email = f'bench{number}@example.com'
+                    duplicates += 1
+                writer.writerow(
+                    [
+                        f'Name{i}',
+                        f'Last{i}',
+                        email,
+                        f'0{600000000 + number}',
+                        ['FR', 'IT', 'ES', 'GB'][number % 4],
+                        'City',
+                        'bench',
+                        '2021-05-01 12:00',
+                    ]
+                )
+        return invalid, duplicates
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(is_superuser=True).first()
+        if not user:
+            raise CommandError('No superuser to own the import task')
+
+        name = os.path.join('csv', 'bench', 'leads.csv')
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Дубли могут попасть на невалидную строку, поэтому сверяем только верхнюю границу
+        invalid, duplicates = self.write_csv(path, options['rows'])
+
+        try:
+            with transaction.atomic():
+                import_task = ProcessCSVTask.objects.create(user=user, file=name, type=ProcessCSVTask.LEADS)
+                importer = LeadsImporter(import_task, chunk_size=options['chunk'])
+
+                rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                started = time.monotonic()
+                importer.run()
+                elapsed = time.monotonic() - started
+                rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                transaction.set_rollback(True)
+        finally:
+            os.remove(path)
+
+        self.stdout.write(
+            f'Imported {importer.imported_rows} of {importer.processed_rows} rows in {elapsed:.1f}s '
+            f'({importer.processed_rows / elapsed:.0f} rows/s)'
+        )
+        self.stdout.write(f'Rejected: {importer.rejected_rows} (generated {invalid} invalid)')
+        self.stdout.write(f'Duplicates: {importer.duplicate_rows} (generated up to {duplicates})')
+        growth = (rss_after - rss_before) / 1024
+        self.stdout.write(f'Peak RSS: {rss_after / 1024:.0f} MB, +{growth:.0f} MB during import')
+        if importer.processed_rows != options['rows'] or importer.rejected_rows != invalid:
+            raise CommandError('Row counts mismatch')
+        self.stdout.write(self.style.SUCCESS('Row counts match'))
@@ -0,0 +1,76 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.phone_normalizer import CSV, PHONE_PREFIXES, normalize, normalize_phone, normalize_phones
+
+
+def legacy_normalize(phone, prefix):
+    # Построчная чистка из старого import_leads_csv
+    phone = phone.replace(' ', '')
+    phone = phone.replace('-', '')
+    if not phone.startswith(prefix):
+        if phone.startswith(f'00{prefix[1:]}') or phone.startswith(f'0{prefix[1:]}0'):
+            phone = phone[4:]
+            phone = f"{prefix}{phone}"
+        elif phone.startswith('+0'):
+            phone = phone[2:]
+            phone = f"{prefix}{phone}"
+        elif phone.startswith('0') or phone.startswith('1'):
+            phone = phone[1:]
+            phone = f"{prefix}{phone}"
+        elif phone.startswith(prefix[1:]):
+            phone = f"+{phone}"
+        elif phone.startswith('+'):
+            pass
+        else:
+            phone = f"{prefix}{phone}"
+    elif phone.startswith(f'{prefix}0'):
+        phone = phone.replace(f'{prefix}0', f'{prefix}')
+    return phone
+
+
+class Command(BaseCommand):
+    help = 'Микробенчмарк нормализации телефонов: старая построчная чистка против phone_normalizer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--phones', action='store', dest='phones', type=int, default=1000000)
+        parser.add_argument(
+            '-u', '--unique', action='store', dest='unique', type=float, default=0.3, help='Доля уникальных номеров'
+        )
+        parser.add_argument('-c', '--country', action='store', dest='country', type=str, default='FR')
+
+    def measure(self, name, func, count):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{name}: {elapsed:.3f}s ({count / elapsed:.0f} phones/s)')
+        return result
+
+    def handle(self, *args, **options):
+        country_code = options['country'].upper()
+        prefix = PHONE_PREFIXES.get(country_code)
+        if not prefix:
+            raise CommandError(f'No phone prefix for {country_code}')
+
+        formats = ['0{}', '00{code}{}', '{code}{}', '{prefix}0{}', '{}', '0{} ', '{prefix}-{}']
+        unique = [
+            random.choice(formats).format(f'6{random.randrange(10 ** 8):08d}', code=prefix[1:], prefix=prefix)
+            for _ in range(max(int(options['phones'] * options['unique']), 1))
+        ]
+        phones = [random.choice(unique) for _ in range(options['phones'])]
+        count = len(phones)
+
+        expected = self.measure('legacy', lambda: [legacy_normalize(phone, prefix) for phone in phones], count)
+        normalize.cache_clear()
+        single = self.measure(
+            'normalize_phone', lambda: [normalize_phone(phone, country_code) for phone in phones], count
+        )
+        normalize.cache_clear()
+        batch = self.measure('normalize_phones', lambda: normalize_phones(phones, country_code, CSV), count)
+        self.stdout.write(f'Cache: {normalize.cache_info()}')
+
+        if single != expected or batch != expected:
+            raise CommandError('Normalized phones differ from legacy implementation')
+        self.stdout.write(self.style.SUCCESS('Output identical to legacy implementation'))
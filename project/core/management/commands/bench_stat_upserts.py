@@ -0,0 +1,96 @@
+import datetime
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+
+from core.models.core import AdAccount, UserAccountDayStat, UserAdAccountDayStat, UserDayStat
+
+
+class Command(BaseCommand):
+    help = 'Сравнение построчного upsert и bulk_upsert для дневной статы (все изменения откатываются)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--adaccounts', action='store', dest='adaccounts', type=int, default=200)
+        parser.add_argument('-d', '--days', action='store', dest='days', type=int, default=3)
+        parser.add_argument('-r', '--repeats', action='store', dest='repeats', type=int, default=2)
+
+    def make_rows(self, adaccounts, days, repeats):
+        # Даты в прошлом, чтобы не пересекаться с живыми данными, все равно все откатывается
+        base_date = datetime.date(2000, 1, 1)
+        rows = []
+        for _ in range(repeats):
+            for adaccount in adaccounts:
+                for day in range(days):
+                    spend = Decimal(random.randint(0, 10000)) / 100
+                    rows.append(
+                        {
+                            'date': base_date + datetime.timedelta(days=day),
+                            'account_id': adaccount.account_id,
+                            'adaccount_id': adaccount.id,
+                            'user_id': adaccount.manager_id,
+                            'campaign_id': None,
+                            'spend': spend,
+                            'profit': -spend,
+                            'clicks': random.randint(0, 100),
+                        }
+                    )
+        return rows
+
+    def run(self, rows, batched):
+        user_adaccount_rows = [
+            {k: row[k] for k in ('date', 'account_id', 'adaccount_id', 'user_id', 'spend', 'clicks')} for row in rows
+        ]
+        user_account_rows = [
+            {k: row[k] for k in ('date', 'account_id', 'user_id', 'campaign_id', 'spend', 'profit')} for row in rows
+        ]
+        started = time.monotonic()
+        with transaction.atomic():
+            if batched:
+                UserAdAccountDayStat.bulk_upsert(user_adaccount_rows)
+                UserAccountDayStat.bulk_upsert(user_account_rows)
+                UserDayStat.bulk_upsert(rows)
+            else:
+                zeros = {
+                    'funds': Decimal('0.00'),
+                    'visits': 0,
+                    'revenue': Decimal('0.00'),
+                    'leads': 0,
+                    'cost': Decimal('0.00'),
+                    'payment': Decimal('0.00'),
+                }
+                for row in user_adaccount_rows:
+                    UserAdAccountDayStat.upsert(**row)
+                for row in user_account_rows:
+                    UserAccountDayStat.upsert(clicks=0, **row, **zeros)
+                for row in rows:
+                    UserDayStat.upsert(**row, **zeros)
+            elapsed = time.monotonic() - started
+
+            dates = {row['date'] for row in rows}
+            totals = UserDayStat.objects.filter(date__in=dates).aggregate(
+                spend=Sum('spend'), clicks=Sum('clicks'), profit=Sum('profit')
+            )
+            transaction.set_rollback(True)
+        return elapsed, totals
+
+    def handle(self, *args, **options):
+        adaccounts = list(AdAccount.objects.filter(manager__isnull=False)[: options['adaccounts']])
+        if not adaccounts:
+            raise CommandError('No adaccounts to benchmark')
+
+        rows = self.make_rows(adaccounts, options['days'], options['repeats'])
+        self.stdout.write(f'Rows per table: {len(rows)}')
+
+        per_row_time, per_row_totals = self.run(rows, batched=False)
+        self.stdout.write(f'Per-row upsert: {per_row_time:.3f}s ({len(rows) / per_row_time:.0f} rows/s)')
+
+        batched_time, batched_totals = self.run(rows, batched=True)
+        self.stdout.write(f'Bulk upsert: {batched_time:.3f}s ({len(rows) / batched_time:.0f} rows/s)')
+
+        if per_row_totals != batched_totals:
+            raise CommandError(f'Totals mismatch: {per_row_totals} != {batched_totals}')
+        self.stdout.write(self.style.SUCCESS(f'Totals match: {batched_totals}, x{per_row_time / batched_time:.1f}'))
@@ -0,0 +1,45 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.partitions import PARTITIONED_STAT_TABLES, create_month_partitions, detach_month_partition, get_partitions
+
+
+class Command(BaseCommand):
+    help = 'Создает месячные партиции дневной статы наперед и отключает старые для архивации'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-m', '--months', action='store', dest='months', type=int, default=3, help='Months ahead')
+        parser.add_argument(
+            '--detach-before',
+            action='store',
+            dest='detach_before',
+            help='Detach partitions of months before YYYY-MM',
+        )
+        parser.add_argument('-l', '--list', action='store_true', dest='list', help='Show partitions')
+
+    def handle(self, *args, **options):
+        detach_before = None
+        if options['detach_before']:
+            try:
+                detach_before = datetime.datetime.strptime(options['detach_before'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError('--detach-before must be YYYY-MM')
+
+        today = timezone.now().date()
+        for table in PARTITIONED_STAT_TABLES:
+            for name in create_month_partitions(table, today, months_ahead=options['months'], today=today):
+                self.stdout.write(f'Created {name}')
+
+            if detach_before:
+                for name, bounds in get_partitions(table):
+                    if name.endswith('_default'):
+                        continue
+                    month = datetime.datetime.strptime(name[-7:], 'y%Ym%m').date()
+                    if month < detach_before and detach_month_partition(table, month):
+                        self.stdout.write(f'Detached {name}')
+
+            if options['list']:
+                for name, bounds in get_partitions(table):
+                    self.stdout.write(f'{name}: {bounds}')
@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from core.snapshots import SNAPSHOT_STORES, redis
+
+
+class Command(BaseCommand):
+    help = 'Переносит снапшоты статы из старых JSON ключей {namespace}_day_stats_{id}_{date} в hash по датам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-b', '--batch', action='store', dest='batch', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run')
+
+    def migrate(self, store, items, dry_run):
+        values = redis.mget([key for key, _, _ in items])
+        pipe = redis.pipeline(transaction=False)
+        migrated = 0
+        for (key, obj_id, date), value in zip(items, values):
+            if value is None:
+                continue
+            data = json.loads(value)
+            # Снапшот, уже записанный новым кодом, свежее старого ключа
+            pipe.hsetnx(store.key(date), obj_id, store.pack(data))
+            pipe.expire(store.key(date), store.retention)
+            pipe.delete(key)
+            migrated += 1
+        if not dry_run:
+            pipe.execute()
+        return migrated
+
+    def handle(self, *args, **options):
+        for store in SNAPSHOT_STORES:
+            migrated = 0
+            items = []
+            for item in store.scan_legacy():
+                items.append(item)
+                if len(items) >= options['batch']:
+                    migrated += self.migrate(store, items, options['dry_run'])
+                    items = []
+            if items:
+                migrated += self.migrate(store, items, options['dry_run'])
+            self.stdout.write(f'{store.namespace}: {migrated} snapshots migrated')
@@ -0,0 +1,37 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.stats_rebuild import rebuild_user_stats
+
+
+class Command(BaseCommand):
+    help = 'Пересчет User*DayStat из сырой статы и логов менеджеров без запросов в ФБ и трекер'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-s', '--start', action='store', dest='start', help='Date from, YYYY-MM-DD')
+        parser.add_argument('-e', '--end', action='store', dest='end', help='Date to, YYYY-MM-DD, default today')
+        parser.add_argument('-a', '--account', action='store', dest='account_id', type=int)
+        parser.add_argument('-u', '--user', action='store', dest='user_id', type=int)
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run', help='Only show diff')
+
+    def handle(self, *args, **options):
+        if not options['start']:
+            raise CommandError('--start is required')
+        try:
+            start = datetime.date.fromisoformat(options['start'])
+            end = datetime.date.fromisoformat(options['end']) if options['end'] else timezone.now().date()
+        except ValueError:
+            raise CommandError('Dates must be YYYY-MM-DD')
+
+        results = rebuild_user_stats(
+            start, end, account_id=options['account_id'], user_id=options['user_id'], dry_run=options['dry_run']
+        )
+        for table, result in results.items():
+            diff = ', '.join(f'{name}: {value}' for name, value in result['diff'].items() if value)
+            self.stdout.write(
+                f'{table}: +{result["added"]} -{result["removed"]} ~{result["changed"]} rows; {diff or "no diff"}'
+            )
+            if 'inserted' in result:
+                self.stdout.write(f'  deleted {result["deleted"]}, inserted {result["inserted"]}')
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+
+from core.snapshots import SNAPSHOT_STORES, redis
+
+
+class Command(BaseCommand):
+    help = 'Количество ключей и занятая память снапшотов статы в redis по неймспейсам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-b', '--batch', action='store', dest='batch', type=int, default=1000)
+
+    def measure(self, pattern, batch):
+        keys, fields, memory = 0, 0, 0
+        chunk = []
+
+        def flush(chunk):
+            pipe = redis.pipeline(transaction=False)
+            for key in chunk:
+                pipe.memory_usage(key)
+                pipe.type(key)
+            results = pipe.execute()
+            hashes = [key for key, key_type in zip(chunk, results[1::2]) if key_type == 'hash']
+            pipe = redis.pipeline(transaction=False)
+            for key in hashes:
+                pipe.hlen(key)
+            return sum(usage or 0 for usage in results[::2]), sum(pipe.execute()) if hashes else 0
+
+        for key in redis.scan_iter(match=pattern, count=batch):
+            chunk.append(key)
+            keys += 1
+            if len(chunk) >= batch:
+                chunk_memory, chunk_fields = flush(chunk)
+                memory += chunk_memory
+                fields += chunk_fields
+                chunk = []
+        if chunk:
+            chunk_memory, chunk_fields = flush(chunk)
+            memory += chunk_memory
+            fields += chunk_fields
+        return keys, fields, memory
+
+    def handle(self, *args, **options):
+        for store in SNAPSHOT_STORES:
+            for name, pattern in (('legacy', store.legacy_pattern), ('hash', store.pattern)):
+                keys, fields, memory = self.measure(pattern, options['batch'])
+                snapshots = fields if name == 'hash' else keys
+                self.stdout.write(
+                    f'{store.namespace} {name}: {keys} keys, {snapshots} snapshots, {memory / 1024 / 1024:.2f} MB'
+                )
+        info = redis.info('memory')
+        self.stdout.write(f'Redis used memory: {info["used_memory_human"]}')
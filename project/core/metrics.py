@@ -0,0 +1,35 @@
+import datetime
+import logging
+from typing import Dict, Union
+
+from django.utils import timezone
+
+from redis import Redis
+
+redis = Redis(host='redis', db=0, decode_responses=True)
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = 'metrics'
+METRICS_TTL = datetime.timedelta(days=7)
+
+Number = Union[int, float]
+
+
+def metrics_key(name: str) -> str:
+    return f'{METRICS_PREFIX}:{name}'
+
+
+def record_metrics(name: str, **values: Number) -> None:
+    """
+    Значения последнего запуска задачи в hash metrics:{name}, плюс строка в лог для алертов по логам
+    """
+    key = metrics_key(name)
+    pipe = redis.pipeline(transaction=False)
+    pipe.hset(key, mapping={**values, 'updated_at': timezone.now().isoformat()})
+    pipe.expire(key, METRICS_TTL)
+    pipe.execute()
+    logger.info(f'{name}: ' + ', '.join(f'{field}={value}' for field, value in values.items()))
+
+
+def get_metrics(name: str) -> Dict[str, str]:
+    return redis.hgetall(metrics_key(name))
@@ -0,0 +1,228 @@
+# Generated by Django 3.1.8 on 2021-05-17 10:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+USER_ACCOUNT_MONTH_STAT_SQL = """
+LOCK TABLE core_useraccountdaystat IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE UNIQUE INDEX month_acc_camp_user_id ON core_useraccountmonthstat
+(month, COALESCE(account_id, -1), COALESCE(campaign_id, -1), COALESCE(user_id, -1));
+
+CREATE OR REPLACE FUNCTION core_useraccountmonthstat_apply(
+    stat core_useraccountdaystat, sign integer
+) RETURNS void AS $$
+BEGIN
+    INSERT INTO core_useraccountmonthstat (
+        month, account_id, campaign_id, user_id, spend, total_spend, payment, visits, leads, clicks, revenue, cost
+    ) VALUES (
+        date_trunc('month', stat.date)::date, stat.account_id, stat.campaign_id, stat.user_id,
+        sign * stat.spend,
+        sign * (CASE WHEN stat.spend = 0 THEN stat.cost ELSE stat.spend END),
+        sign * stat.payment, sign * stat.visits, sign * stat.leads, sign * stat.clicks,
+        sign * stat.revenue, sign * stat.cost
+    )
+    ON CONFLICT (month, COALESCE(account_id, -1), COALESCE(campaign_id, -1), COALESCE(user_id, -1))
+    DO UPDATE SET
+        spend = core_useraccountmonthstat.spend + EXCLUDED.spend,
+        total_spend = core_useraccountmonthstat.total_spend + EXCLUDED.total_spend,
+        payment = core_useraccountmonthstat.payment + EXCLUDED.payment,
+        visits = core_useraccountmonthstat.visits + EXCLUDED.visits,
+        leads = core_useraccountmonthstat.leads + EXCLUDED.leads,
+        clicks = core_useraccountmonthstat.clicks + EXCLUDED.clicks,
+        revenue = core_useraccountmonthstat.revenue + EXCLUDED.revenue,
+        cost = core_useraccountmonthstat.cost + EXCLUDED.cost;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION core_useraccountdaystat_rollup() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM core_useraccountmonthstat_apply(OLD, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM core_useraccountmonthstat_apply(NEW, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER core_useraccountdaystat_rollup
+AFTER INSERT OR UPDATE OR DELETE ON core_useraccountdaystat
+FOR EACH ROW EXECUTE PROCEDURE core_useraccountdaystat_rollup();
+
+INSERT INTO core_useraccountmonthstat (
+    month, account_id, campaign_id, user_id, spend, total_spend, payment, visits, leads, clicks, revenue, cost
+)
+SELECT
+    date_trunc('month', date)::date, account_id, campaign_id, user_id,
+    SUM(spend), SUM(CASE WHEN spend = 0 THEN cost ELSE spend END), SUM(payment),
+    SUM(visits), SUM(leads), SUM(clicks), SUM(revenue), SUM(cost)
+FROM core_useraccountdaystat
+GROUP BY 1, 2, 3, 4;
+
+CREATE VIEW core_useraccountperiodstat AS
+    SELECT
+        id::bigint AS id, FALSE AS is_month, date, account_id, campaign_id, user_id,
+        spend, CASE WHEN spend = 0 THEN cost ELSE spend END AS total_spend, payment,
+        visits, leads, clicks, revenue, cost
+    FROM core_useraccountdaystat
+    UNION ALL
+    SELECT
+        -id::bigint AS id, TRUE AS is_month, month AS date, account_id, campaign_id, user_id,
+        spend, total_spend, payment,
+        visits, leads, clicks, revenue, cost
+    FROM core_useraccountmonthstat;
+"""
+
+USER_ACCOUNT_MONTH_STAT_REVERSE_SQL = """
+DROP VIEW IF EXISTS core_useraccountperiodstat;
+DROP TRIGGER IF EXISTS core_useraccountdaystat_rollup ON core_useraccountdaystat;
+DROP FUNCTION IF EXISTS core_useraccountdaystat_rollup();
+DROP FUNCTION IF EXISTS core_useraccountmonthstat_apply(core_useraccountdaystat, integer);
+"""
+
+USER_MONTH_STAT_SQL = """
+LOCK TABLE core_userdaystat IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE UNIQUE INDEX month_acc_camp_user_id_v2 ON core_usermonthstat
+(month, COALESCE(account_id, -1), COALESCE(campaign_id, -1), COALESCE(user_id, -1));
+
+CREATE OR REPLACE FUNCTION core_usermonthstat_apply(stat core_userdaystat, sign integer) RETURNS void AS $$
+BEGIN
+    INSERT INTO core_usermonthstat (
+        month, account_id, campaign_id, user_id, spend, payment, visits, leads, clicks, revenue, cost
+    ) VALUES (
+        date_trunc('month', stat.date)::date, stat.account_id, stat.campaign_id, stat.user_id,
+        sign * stat.spend, sign * stat.payment, sign * stat.visits, sign * stat.leads, sign * stat.clicks,
+        sign * stat.revenue, sign * stat.cost
+    )
+    ON CONFLICT (month, COALESCE(account_id, -1), COALESCE(campaign_id, -1), COALESCE(user_id, -1))
+    DO UPDATE SET
+        spend = core_usermonthstat.spend + EXCLUDED.spend,
+        payment = core_usermonthstat.payment + EXCLUDED.payment,
+        visits = core_usermonthstat.visits + EXCLUDED.visits,
+        leads = core_usermonthstat.leads + EXCLUDED.leads,
+        clicks = core_usermonthstat.clicks + EXCLUDED.clicks,
+        revenue = core_usermonthstat.revenue + EXCLUDED.revenue,
+        cost = core_usermonthstat.cost + EXCLUDED.cost;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION core_userdaystat_rollup() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM core_usermonthstat_apply(OLD, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM core_usermonthstat_apply(NEW, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER core_userdaystat_rollup
+AFTER INSERT OR UPDATE OR DELETE ON core_userdaystat
+FOR EACH ROW EXECUTE PROCEDURE core_userdaystat_rollup();
+
+INSERT INTO core_usermonthstat (
+    month, account_id, campaign_id, user_id, spend, payment, visits, leads, clicks, revenue, cost
+)
+SELECT
+    date_trunc('month', date)::date, account_id, campaign_id, user_id,
+    SUM(spend), SUM(payment), SUM(visits), SUM(leads), SUM(clicks), SUM(revenue), SUM(cost)
+FROM core_userdaystat
+GROUP BY 1, 2, 3, 4;
+
+CREATE VIEW core_userperiodstat AS
+    SELECT
+        id::bigint AS id, FALSE AS is_month, date, account_id, campaign_id, user_id,
+        spend, payment, visits, leads, clicks, revenue, cost
+    FROM core_userdaystat
+    UNION ALL
+    SELECT
+        -id::bigint AS id, TRUE AS is_month, month AS date, account_id, campaign_id, user_id,
+        spend, payment, visits, leads, clicks, revenue, cost
+    FROM core_usermonthstat;
+"""
+
+USER_MONTH_STAT_REVERSE_SQL = """
+DROP VIEW IF EXISTS core_userperiodstat;
+DROP TRIGGER IF EXISTS core_userdaystat_rollup ON core_userdaystat;
+DROP FUNCTION IF EXISTS core_userdaystat_rollup();
+DROP FUNCTION IF EXISTS core_usermonthstat_apply(core_userdaystat, integer);
+"""
+
+
+def month_stat_fields():
+    return [
+        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+        ('month', models.DateField(db_index=True)),
+        ('spend', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Spend')),
+        ('payment', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Payment')),
+        ('visits', models.IntegerField(default=0, verbose_name='Visits')),
+        ('leads', models.IntegerField(default=0, verbose_name='Leads')),
+        ('clicks', models.IntegerField(default=0, verbose_name='Clicks')),
+        ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Revenue')),
+        ('cost', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Cost')),
+        ('account', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='core.account')),
+        ('campaign', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='core.campaign')),
+        ('user', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+    ]
+
+
+def period_stat_fields():
+    return [
+        ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+        ('is_month', models.BooleanField()),
+        ('date', models.DateField()),
+        ('spend', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Spend')),
+        ('payment', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Payment')),
+        ('visits', models.IntegerField(default=0, verbose_name='Visits')),
+        ('leads', models.IntegerField(default=0, verbose_name='Leads')),
+        ('clicks', models.IntegerField(default=0, verbose_name='Clicks')),
+        ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Revenue')),
+        ('cost', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Cost')),
+        ('account', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='core.account')),
+        ('campaign', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='core.campaign')),
+        ('user', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0482_leadgenlead_ipaddress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAccountMonthStat',
+            fields=month_stat_fields()
+            + [('total_spend', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Total spend'))],
+        ),
+        migrations.CreateModel(
+            name='UserMonthStat',
+            fields=month_stat_fields(),
+        ),
+        migrations.CreateModel(
+            name='UserAccountPeriodStat',
+            fields=period_stat_fields()
+            + [('total_spend', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Total spend'))],
+            options={
+                'db_table': 'core_useraccountperiodstat',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='UserPeriodStat',
+            fields=period_stat_fields(),
+            options={
+                'db_table': 'core_userperiodstat',
+                'managed': False,
+            },
+        ),
+        migrations.RunSQL(USER_ACCOUNT_MONTH_STAT_SQL, USER_ACCOUNT_MONTH_STAT_REVERSE_SQL),
+        migrations.RunSQL(USER_MONTH_STAT_SQL, USER_MONTH_STAT_REVERSE_SQL),
+    ]
@@ -0,0 +1,258 @@
+# Generated by Django 3.1.8 on 2021-05-24 09:40
+
+import datetime
+
+from django.db import migrations
+
+from dateutil.relativedelta import relativedelta
+
+# Копия на момент миграции: core.partitions может меняться, а миграция - нет
+PARTITIONED_STAT_TABLES = (
+    'core_userdaystat',
+    'core_useraccountdaystat',
+    'core_useradaccountdaystat',
+    'core_adaccountdaystat',
+    'core_campaigndaystat',
+)
+PARTITIONS_MONTHS_AHEAD = 3
+
+# Роллапы и вьюхи из 0483_month_stats
+USER_ACCOUNT_ROLLUP_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION core_useraccountmonthstat_apply(
+    stat core_useraccountdaystat, sign integer
+) RETURNS void AS $$
+BEGIN
+    INSERT INTO core_useraccountmonthstat (
+        month, account_id, campaign_id, user_id, spend, total_spend, payment, visits, leads, clicks, revenue, cost
+    ) VALUES (
+        date_trunc('month', stat.date)::date, stat.account_id, stat.campaign_id, stat.user_id,
+        sign * stat.spend,
+        sign * (CASE WHEN stat.spend = 0 THEN stat.cost ELSE stat.spend END),
+        sign * stat.payment, sign * stat.visits, sign * stat.leads, sign * stat.clicks,
+        sign * stat.revenue, sign * stat.cost
+    )
+    ON CONFLICT (month, COALESCE(account_id, -1), COALESCE(campaign_id, -1), COALESCE(user_id, -1))
+    DO UPDATE SET
+        spend = core_useraccountmonthstat.spend + EXCLUDED.spend,
+        total_spend = core_useraccountmonthstat.total_spend + EXCLUDED.total_spend,
+        payment = core_useraccountmonthstat.payment + EXCLUDED.payment,
+        visits = core_useraccountmonthstat.visits + EXCLUDED.visits,
+        leads = core_useraccountmonthstat.leads + EXCLUDED.leads,
+        clicks = core_useraccountmonthstat.clicks + EXCLUDED.clicks,
+        revenue = core_useraccountmonthstat.revenue + EXCLUDED.revenue,
+        cost = core_useraccountmonthstat.cost + EXCLUDED.cost;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION core_useraccountdaystat_rollup() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM core_useraccountmonthstat_apply(OLD, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM core_useraccountmonthstat_apply(NEW, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER core_useraccountdaystat_rollup
+AFTER INSERT OR UPDATE OR DELETE ON core_useraccountdaystat
+FOR EACH ROW EXECUTE PROCEDURE core_useraccountdaystat_rollup();
+
+"""
+
+USER_ACCOUNT_PERIOD_VIEW_SQL = """
+CREATE VIEW core_useraccountperiodstat AS
+    SELECT
+        id::bigint AS id, FALSE AS is_month, date, account_id, campaign_id, user_id,
+        spend, CASE WHEN spend = 0 THEN cost ELSE spend END AS total_spend, payment,
+        visits, leads, clicks, revenue, cost
+    FROM core_useraccountdaystat
+    UNION ALL
+    SELECT
+        -id::bigint AS id, TRUE AS is_month, month AS date, account_id, campaign_id, user_id,
+        spend, total_spend, payment,
+        visits, leads, clicks, revenue, cost
+    FROM core_useraccountmonthstat;
+"""
+
+USER_ACCOUNT_MONTH_STAT_REVERSE_SQL = """
+DROP VIEW IF EXISTS core_useraccountperiodstat;
+DROP TRIGGER IF EXISTS core_useraccountdaystat_rollup ON core_useraccountdaystat;
+DROP FUNCTION IF EXISTS core_useraccountdaystat_rollup();
+DROP FUNCTION IF EXISTS core_useraccountmonthstat_apply(core_useraccountdaystat, integer);
+"""
+
+USER_ROLLUP_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION core_usermonthstat_apply(stat core_userdaystat, sign integer) RETURNS void AS $$
+BEGIN
+    INSERT INTO core_usermonthstat (
+        month, account_id, campaign_id, user_id, spend, payment, visits, leads, clicks, revenue, cost
+    ) VALUES (
+        date_trunc('month', stat.date)::date, stat.account_id, stat.campaign_id, stat.user_id,
+        sign * stat.spend, sign * stat.payment, sign * stat.visits, sign * stat.leads, sign * stat.clicks,
+        sign * stat.revenue, sign * stat.cost
+    )
+    ON CONFLICT (month, COALESCE(account_id, -1), COALESCE(campaign_id, -1), COALESCE(user_id, -1))
+    DO UPDATE SET
+        spend = core_usermonthstat.spend + EXCLUDED.spend,
+        payment = core_usermonthstat.payment + EXCLUDED.payment,
+        visits = core_usermonthstat.visits + EXCLUDED.visits,
+        leads = core_usermonthstat.leads + EXCLUDED.leads,
+        clicks = core_usermonthstat.clicks + EXCLUDED.clicks,
+        revenue = core_usermonthstat.revenue + EXCLUDED.revenue,
+        cost = core_usermonthstat.cost + EXCLUDED.cost;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION core_userdaystat_rollup() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM core_usermonthstat_apply(OLD, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM core_usermonthstat_apply(NEW, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER core_userdaystat_rollup
+AFTER INSERT OR UPDATE OR DELETE ON core_userdaystat
+FOR EACH ROW EXECUTE PROCEDURE core_userdaystat_rollup();
+
+"""
+
+USER_PERIOD_VIEW_SQL = """
+CREATE VIEW core_userperiodstat AS
+    SELECT
+        id::bigint AS id, FALSE AS is_month, date, account_id, campaign_id, user_id,
+        spend, payment, visits, leads, clicks, revenue, cost
+    FROM core_userdaystat
+    UNION ALL
+    SELECT
+        -id::bigint AS id, TRUE AS is_month, month AS date, account_id, campaign_id, user_id,
+        spend, payment, visits, leads, clicks, revenue, cost
+    FROM core_usermonthstat;
+"""
+
+USER_MONTH_STAT_REVERSE_SQL = """
+DROP VIEW IF EXISTS core_userperiodstat;
+DROP TRIGGER IF EXISTS core_userdaystat_rollup ON core_userdaystat;
+DROP FUNCTION IF EXISTS core_userdaystat_rollup();
+DROP FUNCTION IF EXISTS core_usermonthstat_apply(core_userdaystat, integer);
+"""
+
+# Триггер на партиционированной таблице срабатывает на партиции, и NEW имеет тип строки партиции,
+# поэтому приводим его к типу родительской таблицы
+ROLLUP_TRIGGER_FUNCTIONS_SQL = """
+CREATE OR REPLACE FUNCTION core_useraccountdaystat_rollup() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM core_useraccountmonthstat_apply(ROW(OLD.*)::core_useraccountdaystat, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM core_useraccountmonthstat_apply(ROW(NEW.*)::core_useraccountdaystat, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION core_userdaystat_rollup() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM core_usermonthstat_apply(ROW(OLD.*)::core_userdaystat, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM core_usermonthstat_apply(ROW(NEW.*)::core_userdaystat, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def create_partitions(cursor, table, start):
+    month = start.replace(day=1)
+    end = datetime.date.today().replace(day=1) + relativedelta(months=PARTITIONS_MONTHS_AHEAD)
+    while month <= end:
+        next_month = month + relativedelta(months=1)
+        cursor.execute(
+            f"CREATE TABLE {table}_y{month.year}m{month.month:02d} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}')"
+        )
+        month = next_month
+    cursor.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+
+
+def partition_table(cursor, table):
+    cursor.execute(
+        "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')",
+        [table],
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s "
+        "AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass)",
+        [table, table],
+    )
+    indexes = cursor.fetchall()
+    cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [table, 'id'])
+    sequence = cursor.fetchone()[0]
+    cursor.execute(f'SELECT MIN(date) FROM {table}')
+    min_date = cursor.fetchone()[0]
+
+    # Старую таблицу переименовываем и освобождаем имена констрейнтов и индексов
+    cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY NONE')
+    cursor.execute(f'ALTER TABLE {table} RENAME TO {table}_old')
+    for name, contype, _ in sorted(constraints, key=lambda constraint: constraint[1] == 'p'):
+        cursor.execute(f'ALTER TABLE {table}_old DROP CONSTRAINT {name}')
+    for name, _ in indexes:
+        cursor.execute(f'DROP INDEX {name}')
+
+    cursor.execute(
+        f'CREATE TABLE {table} (LIKE {table}_old INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE (date)'
+    )
+    # Первичный ключ партиционированной таблицы обязан включать ключ партиционирования
+    cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, date)')
+    create_partitions(cursor, table, min_date or datetime.date.today())
+
+    cursor.execute(f'INSERT INTO {table} SELECT * FROM {table}_old')
+    cursor.execute(f'DROP TABLE {table}_old')
+    cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {table}.id')
+
+    for name, contype, definition in constraints:
+        if contype != 'p':
+            cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition}')
+    for _, definition in indexes:
+        cursor.execute(definition)
+
+
+def partition_day_stats(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        # Вьюхи и роллап функции завязаны на тип строки старых таблиц
+        cursor.execute(USER_ACCOUNT_MONTH_STAT_REVERSE_SQL)
+        cursor.execute(USER_MONTH_STAT_REVERSE_SQL)
+
+        for table in PARTITIONED_STAT_TABLES:
+            partition_table(cursor, table)
+
+        # Роллапы уже посчитаны в 0483, триггеры создаем после переноса данных
+        cursor.execute(USER_ACCOUNT_ROLLUP_TRIGGER_SQL)
+        cursor.execute(USER_ROLLUP_TRIGGER_SQL)
+        cursor.execute(ROLLUP_TRIGGER_FUNCTIONS_SQL)
+        cursor.execute(USER_ACCOUNT_PERIOD_VIEW_SQL)
+        cursor.execute(USER_PERIOD_VIEW_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0483_month_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_day_stats),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.8 on 2021-05-27 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0484_partition_day_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='linkgroup',
+            name='exported_links',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.1.8 on 2021-05-28 10:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0485_linkgroup_exported_links'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='linkgroup',
+            name='last_lead_id',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='linkgroup',
+            name='parent',
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name='parts',
+                to='core.linkgroup',
+            ),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.1.8 on 2021-05-31 09:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0486_linkgroup_links_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processcsvtask',
+            name='processed_rows',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='processcsvtask',
+            name='rejected_rows',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='processcsvtask',
+            name='imported_rows',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='processcsvtask',
+            name='duplicate_rows',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
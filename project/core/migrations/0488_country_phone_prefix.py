@@ -0,0 +1,39 @@
+# Generated by Django 3.1.8 on 2021-06-01 13:26
+
+from django.db import migrations, models
+
+COUNTRY_PHONE = {
+    'FR': '+33',
+    'IT': '+39',
+    'DK': '+45',
+    'BE': '+32',
+    'ES': '+34',
+    'GB': '+44',
+    'SE': '+46',
+    'FI': '+358',
+    'CZ': '+420',
+    'US': '+1',
+    'PT': '+351',
+}
+
+
+def fill_phone_prefixes(apps, schema_editor):
+    Country = apps.get_model('core', 'Country')
+    for code, prefix in COUNTRY_PHONE.items():
+        Country.objects.filter(code=code).update(phone_prefix=prefix)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0487_processcsvtask_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='country',
+            name='phone_prefix',
+            field=models.CharField(blank=True, max_length=8, null=True),
+        ),
+        migrations.RunPython(fill_phone_prefixes, migrations.RunPython.noop),
+    ]
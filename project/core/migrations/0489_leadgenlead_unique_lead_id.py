@@ -0,0 +1,44 @@
+# Generated by Django 3.1.8 on 2021-06-02 08:51
+
+from django.db import migrations, models
+
+# Старая загрузка искала лид по lead_id вместе с менеджером, поэтому после смены менеджера
+# появлялись дубли. Оставляем самый ранний лид, ссылки и конверсии переносим на него.
+MERGE_DUPLICATE_LEADS_SQL = """
+CREATE TEMP TABLE leadgenlead_duplicates ON COMMIT DROP AS
+SELECT lead.id, keep.id AS keep_id
+FROM core_leadgenlead lead
+JOIN (
+    SELECT lead_id, MIN(id) AS id FROM core_leadgenlead
+    WHERE lead_id IS NOT NULL
+    GROUP BY lead_id
+    HAVING COUNT(*) > 1
+) keep ON keep.lead_id = lead.lead_id AND keep.id <> lead.id;
+
+UPDATE core_link SET leadgen_lead_id = duplicates.keep_id
+FROM leadgenlead_duplicates duplicates
+WHERE core_link.leadgen_lead_id = duplicates.id;
+
+UPDATE core_leadgenleadconversion SET lead_id = duplicates.keep_id
+FROM leadgenlead_duplicates duplicates
+WHERE core_leadgenleadconversion.lead_id = duplicates.id;
+
+DELETE FROM core_leadgenlead USING leadgenlead_duplicates duplicates
+WHERE core_leadgenlead.id = duplicates.id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0488_country_phone_prefix'),
+    ]
+
+    operations = [
+        migrations.RunSQL(MERGE_DUPLICATE_LEADS_SQL, migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name='leadgenlead',
+            name='lead_id',
+            field=models.BigIntegerField(blank=True, null=True, unique=True),
+        ),
+    ]
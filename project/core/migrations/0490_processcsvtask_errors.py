@@ -0,0 +1,18 @@
+# Generated by Django 3.1.8 on 2021-06-03 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0489_leadgenlead_unique_lead_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processcsvtask',
+            name='errors',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.1.8 on 2021-06-07 11:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0490_processcsvtask_errors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='adaccount',
+            name='transactions_synced_ts',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        # Транзакции из Graph (с data), созданные вручную пополнения не в счет
+        migrations.RunSQL(
+            """
+            UPDATE core_adaccount SET transactions_synced_ts = synced.ts
+            FROM (
+                SELECT adaccount_id, MAX(EXTRACT(EPOCH FROM billed_at))::integer AS ts
+                FROM core_adaccounttransaction
+                WHERE adaccount_id IS NOT NULL AND data IS NOT NULL
+                GROUP BY adaccount_id
+            ) synced
+            WHERE core_adaccount.id = synced.adaccount_id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
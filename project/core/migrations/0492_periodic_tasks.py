@@ -0,0 +1,69 @@
+# Generated by Django 3.1.8 on 2021-06-08 10:15
+
+from django.db import migrations
+from django.utils import timezone
+
+# Задачи, без которых данные перестают доезжать в базу, не должны зависеть от ручной настройки beat
+PERIODIC_TASKS = [
+    {
+        'name': 'Flush link clicks',
+        'task': 'core.tasks.links.flush_click_stats',
+        'interval': {'every': 1, 'period': 'minutes'},
+    },
+    {
+        'name': 'Create stat partitions',
+        'task': 'core.tasks.stats.create_stat_partitions_task',
+        'crontab': {'minute': '0', 'hour': '3', 'day_of_week': '*', 'day_of_month': '*', 'month_of_year': '*'},
+    },
+    {
+        'name': 'Reconcile account spends',
+        'task': 'core.tasks.stats.reconcile_account_spends_task',
+        'crontab': {'minute': '30', 'hour': '4', 'day_of_week': '*', 'day_of_month': '*', 'month_of_year': '*'},
+    },
+]
+
+
+def get_schedule(apps, periodic_task):
+    if 'interval' in periodic_task:
+        field, model, values = 'interval', 'IntervalSchedule', periodic_task['interval']
+    else:
+        field, model, values = 'crontab', 'CrontabSchedule', {'timezone': 'UTC', **periodic_task['crontab']}
+    Schedule = apps.get_model('django_celery_beat', model)
+    # Одинаковых расписаний может быть несколько, get_or_create на них падает
+    return {field: Schedule.objects.filter(**values).first() or Schedule.objects.create(**values)}
+
+
+def schedules_changed(apps):
+    # Иначе запущенный beat не перечитает расписание
+    PeriodicTasks = apps.get_model('django_celery_beat', 'PeriodicTasks')
+    PeriodicTasks.objects.update_or_create(ident=1, defaults={'last_update': timezone.now()})
+
+
+def create_periodic_tasks(apps, schema_editor):
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    for periodic_task in PERIODIC_TASKS:
+        # Если задачу уже завели руками - не трогаем
+        if PeriodicTask.objects.filter(task=periodic_task['task']).exists():
+            continue
+        PeriodicTask.objects.create(
+            name=periodic_task['name'], task=periodic_task['task'], **get_schedule(apps, periodic_task)
+        )
+    schedules_changed(apps)
+
+
+def delete_periodic_tasks(apps, schema_editor):
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    PeriodicTask.objects.filter(name__in=[periodic_task['name'] for periodic_task in PERIODIC_TASKS]).delete()
+    schedules_changed(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0491_adaccount_transactions_synced_ts'),
+        ('django_celery_beat', '0014_remove_clockedschedule_enabled'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_periodic_tasks, delete_periodic_tasks),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.1.8 on 2021-06-09 12:04
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0492_periodic_tasks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LinkClicksFlush',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('flush_id', models.CharField(max_length=32, unique=True)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
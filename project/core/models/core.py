@@ -1,12 +1,18 @@
 import builtins
+import csv
 import datetime
+import io
 import json
 import logging
 import re
+import time
 import uuid
+from bisect import bisect_right
+from collections import defaultdict
 from copy import copy
 from decimal import Decimal
-from random import choice
+from itertools import cycle
+from random import randrange
 from typing import Any, Dict, List, Optional, Tuple, Type
 from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
 
@@ -21,9 +27,11 @@ from django.core.cache import cache
 from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import RegexValidator
 from django.db import connection, models, transaction
-from django.db.models import Case, ExpressionWrapper, F, Q, QuerySet, When
+from django.db.models import Case, ExpressionWrapper, F, OuterRef, Q, QuerySet, Subquery, When
 from django.db.models.aggregates import Sum
 from django.db.models.fields import DateTimeField, DurationField
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
 from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.encoding import force_text
@@ -83,6 +91,17 @@ class LogChangedMixin(models.Model):
             )
         return changed_data
 
+    @classmethod
+    def bulk_save_changed(cls, changed: List[Tuple[models.Model, List[str]]]) -> None:
+        """
+        bulk_update объектов с их изменившимися полями, по запросу на каждый набор полей
+        """
+        by_fields: Dict[Tuple[str, ...], List[models.Model]] = defaultdict(list)
+        for obj, update_fields in changed:
+            by_fields[tuple(sorted(update_fields))].append(obj)
+        for update_fields, objs in by_fields.items():
+            cls.objects.bulk_update(objs, update_fields)
+
     class Meta:
         abstract = True
 
@@ -90,6 +109,8 @@ class LogChangedMixin(models.Model):
 class Country(models.Model):
     name = models.CharField(max_length=64)
     code = models.CharField(max_length=2)
+    # Телефонный код, по нему нормализуются номера лидов
+    phone_prefix = models.CharField(max_length=8, null=True, blank=True)
     is_public = models.BooleanField(default=False)
     sort = models.PositiveSmallIntegerField(default=0)
 
@@ -116,6 +137,69 @@ class ShortifyDomain(models.Model):
     def __str__(self):
         return self.domain
 
+    @classmethod
+    def invalidate_pool(cls):
+        """
+        Вызывать после queryset.update(), который не шлет сигналы
+        """
+        transaction.on_commit(SHORTIFY_DOMAIN_POOL.invalidate)
+
+
+class ShortifyDomainPool:
+    """
+    Процессный кеш публичных незабаненных доменов для коротких ссылок, домены выдаются по кругу.
+    Раз в CHECK_INTERVAL сверяет версию в redis (ее поднимают сигналы ShortifyDomain в любом процессе),
+    из базы перечитывает при смене версии или раз в MAX_AGE.
+    """
+
+    VERSION_KEY = 'shortify_domains_version'
+    CHECK_INTERVAL = 5
+    MAX_AGE = 300
+
+    def __init__(self):
+        self.version = None
+        self.prefixes: Tuple[str, ...] = ()
+        self.cycle = iter(())
+        self.checked_at = 0.0
+        self.loaded_at = 0.0
+
+    def invalidate(self):
+        self.checked_at = self.loaded_at = 0.0
+        redis.incr(self.VERSION_KEY)
+
+    def load(self, version):
+        domains = ShortifyDomain.objects.filter(is_banned=False, is_public=True).values_list('domain', flat=True)
+        prefixes = [f'https://{domain}/' for domain in domains]
+        # Разные процессы начинают с разных доменов, чтобы распределение было ровным
+        offset = randrange(len(prefixes)) if prefixes else 0
+        self.prefixes = tuple(prefixes[offset:] + prefixes[:offset])
+        self.cycle = cycle(self.prefixes)
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+    def next_prefix(self) -> str:
+        now = time.monotonic()
+        if now - self.checked_at >= self.CHECK_INTERVAL:
+            version = redis.get(self.VERSION_KEY)
+            if version != self.version or now - self.loaded_at >= self.MAX_AGE:
+                self.load(version)
+            self.checked_at = now
+        if not self.prefixes:
+            raise IndexError('No public shortify domains')
+        return next(self.cycle)
+
+
+SHORTIFY_DOMAIN_POOL = ShortifyDomainPool()
+
+
+def invalidate_shortify_domain_pool(sender, **kwargs):
+    # Версию поднимаем после коммита, иначе другой процесс успеет закешировать под ней старые строки
+    transaction.on_commit(SHORTIFY_DOMAIN_POOL.invalidate)
+
+
+post_save.connect(invalidate_shortify_domain_pool, sender=ShortifyDomain)
+post_delete.connect(invalidate_shortify_domain_pool, sender=ShortifyDomain)
+
 
 class PageCategory(models.Model):
     name = models.CharField(max_length=128)
@@ -475,6 +559,15 @@ class Action(models.Model):
     @classmethod
     @transaction.atomic
     def create(cls, action_datetime, verb, actor=None, target_object=None, action_object=None, data=None):
+        action = cls.build(action_datetime, verb, actor, target_object, action_object, data)
+        action.save()
+        return action
+
+    @classmethod
+    def build(cls, action_datetime, verb, actor=None, target_object=None, action_object=None, data=None):
+        """
+        Несохраненный экшн, для записи пачкой через bulk_create
+        """
         action_data = {'action_datetime': action_datetime, 'verb': verb, 'verb_slug': slugify(verb)}
         if target_object is not None:
             action_data['target_object_content_type'] = ContentType.objects.get_for_model(target_object)
@@ -492,7 +585,7 @@ class Action(models.Model):
         if actor is not None:
             action_data['actor_id'] = actor.id
 
-        return cls.objects.create(**action_data)
+        return cls(**action_data)
 
 
 class Account(ConcurrentTransitionMixin, LogChangedMixin):
@@ -746,27 +839,40 @@ class Account(ConcurrentTransitionMixin, LogChangedMixin):
         transaction.on_commit(lambda: set_total_spend_stats.delay(account_id=self.id))
 
     @transaction.atomic
-    def recalc_spends(self):
+    def recalc_spends(self, full: bool = False):
         """
-        Пересчитывает спенд для отображения в табличке - сегодня, вчера, все время
+        Пересчитывает спенд для отображения в табличке - сегодня, вчера, все время.
+        Спенд за все время ведется дельтами в AdAccountDayStat.update, full=True пересчитывает его по всей стате
+        (после удаления статы), расхождения ловит ночная сверка reconcile_account_spends_task
         """
         yesterday = timezone.now().date() - datetime.timedelta(days=1)
         today = timezone.now().date()
 
-        spends_yesterday = Sum(F('spend'), filter=Q(date=yesterday))
-        spends_today = Sum(F('spend'), filter=Q(date=today))
-
-        # TODO: считать по стате юзерской core_useradaccountdaystat
-        total_spend = AdAccountDayStat.objects.filter(account=self).aggregate(
-            total_spends=Sum('spend'), spends_today=spends_today, spends_yesterday=spends_yesterday
+        spends = AdAccountDayStat.objects.filter(account=self).filter(date__gte=yesterday).aggregate(
+            spends_today=Sum(F('spend'), filter=Q(date=today)),
+            spends_yesterday=Sum(F('spend'), filter=Q(date=yesterday)),
         )
-        # Лочим на всякий случай
-        account = Account.objects.select_for_update().get(id=self.id)
+        values = {
+            'fb_spends_today': spends.get('spends_today') or 0,
+            'fb_spends_yesterday': spends.get('spends_yesterday') or 0,
+        }
+        if full:
+            total_spends = (
+                AdAccountDayStat.objects.filter(account=OuterRef('pk'))
+                .values('account')
+                .annotate(total_spends=Sum('spend'))
+                .values('total_spends')
+            )
+            values['fb_spends'] = Coalesce(Subquery(total_spends), Decimal('0.00'))
+        Account.objects.filter(pk=self.id).update(**values)
 
-        account.fb_spends = total_spend.get('total_spends', 0) or 0
-        account.fb_spends_today = total_spend.get('spends_today', 0) or 0
-        account.fb_spends_yesterday = total_spend.get('spends_yesterday', 0) or 0
-        account.save(update_fields=['fb_spends', 'fb_spends_today', 'fb_spends_yesterday'])
+    @classmethod
+    def add_spends_delta(cls, account_id: int, delta: Decimal) -> None:
+        """
+        Атомарно прибавляет изменение сырого спенда к спенду за все время, без чтения и блокировки акка
+        """
+        if delta:
+            cls.objects.filter(pk=account_id).update(fb_spends=F('fb_spends') + delta)
 
     @transaction.atomic
     def add_cart_balance(self, updated_by, card_balance: Decimal, adaccount=None) -> None:
@@ -1179,29 +1285,71 @@ class Account(ConcurrentTransitionMixin, LogChangedMixin):
 
     @property
     def status_duration(self) -> datetime.timedelta:
-        duration = cache.get(f'status_duration_{self.id}')
-        if duration:
-            return datetime.timedelta(seconds=duration)
+        return Account.get_status_durations([self])[self.id]
+
+    @classmethod
+    def get_status_durations(cls, accounts) -> Dict[int, datetime.timedelta]:
+        """
+        Время в текущем статусе для пачки акков: кеш одним get_many, промахи - двумя запросами на всех
+        """
+        accounts = {account.id: account for account in accounts}
+        cached = cache.get_many([f'status_duration_{account_id}' for account_id in accounts])
+
+        durations = {}
+        for account_id in accounts:
+            duration = cached.get(f'status_duration_{account_id}')
+            if duration:
+                durations[account_id] = datetime.timedelta(seconds=duration)
+
+        missed = [account for account_id, account in accounts.items() if account_id not in durations]
+        if not missed:
+            return durations
 
         end_at = Case(
             When(end_at__isnull=True, then=timezone.now()), default=F('end_at'), output_field=DateTimeField()
         )
-
         duration_expression = ExpressionWrapper(end_at - F('start_at'), output_field=DurationField())
-        log_qs = AccountLog.objects.filter(account=self, log_type=AccountLog.STATUS, status=self.status)
-        duration = datetime.timedelta(seconds=0)
-        if self.status in [Account.SURFING, Account.WARMING]:
-            log = log_qs.annotate(duration=duration_expression).aggregate(total_duration=Sum('duration'))
-            if log.get('total_duration'):
-                duration = log['total_duration']
-        else:
-            log = (
-                log_qs.filter(end_at__isnull=True).order_by('-start_at').annotate(duration=duration_expression).first()
+        log_qs = AccountLog.objects.filter(
+            account_id__in=[account.id for account in missed], log_type=AccountLog.STATUS
+        )
+
+        total_durations = {}
+        surfing_ids = [account.id for account in missed if account.status in [Account.SURFING, Account.WARMING]]
+        if surfing_ids:
+            logs = (
+                log_qs.filter(account_id__in=surfing_ids)
+                .annotate(duration=duration_expression)
+                .values('account_id', 'status')
+                .annotate(total_duration=Sum('duration'))
+                .order_by()
             )
-            if log:
-                duration = log.duration
-        cache.set(f'status_duration_{self.id}', duration.total_seconds(), 60 * 5)  # 5 minutes
-        return duration
+            for log in logs:
+                total_durations[(log['account_id'], log['status'])] = log['total_duration']
+
+        current_durations = {}
+        other_ids = [account.id for account in missed if account.status not in [Account.SURFING, Account.WARMING]]
+        if other_ids:
+            logs = (
+                log_qs.filter(account_id__in=other_ids, end_at__isnull=True)
+                .order_by('account_id', 'status', '-start_at')
+                .annotate(duration=duration_expression)
+                .values('account_id', 'status', 'duration')
+            )
+            for log in logs:
+                # Самый поздний открытый лог в статусе
+                current_durations.setdefault((log['account_id'], log['status']), log['duration'])
+
+        to_cache = {}
+        for account in missed:
+            if account.status in [Account.SURFING, Account.WARMING]:
+                duration = total_durations.get((account.id, account.status))
+            else:
+                duration = current_durations.get((account.id, account.status))
+            duration = duration or datetime.timedelta(seconds=0)
+            durations[account.id] = duration
+            to_cache[f'status_duration_{account.id}'] = duration.total_seconds()
+        cache.set_many(to_cache, 60 * 5)  # 5 minutes
+        return durations
 
     def get_proxy_data(self) -> Optional[Dict[str, Any]]:
         if self.proxy_host is not None and self.proxy_port is not None:
@@ -1541,6 +1689,69 @@ class FBPage(LogChangedMixin):
             Action.create(action_datetime=now, verb=action_verb, action_object=page, data=changed_data)
         return page
 
+    @classmethod
+    @transaction.atomic
+    def bulk_sync(
+        cls, account: Account, pages_data: List[Dict[str, Any]], action_verb: str = 'Page updated'
+    ) -> Tuple[int, int, int]:
+        """
+        Страницы акка из Graph пачкой по правилам create/update: существующие грузятся одним запросом,
+        без изменений не пишутся, нотификация о снятии с публикации - только по изменившимся.
+        Возвращает (создано, обновлено, без изменений)
+        """
+        now = timezone.now()
+        pages_data = list({int(data['page_id']): data for data in pages_data}.values())
+        existing = {
+            page.page_id: page
+            for page in cls.objects.select_for_update().filter(
+                account=account, page_id__in=[int(data['page_id']) for data in pages_data]
+            )
+        }
+
+        actions: List[Action] = []
+        to_create: List[FBPage] = []
+        to_update: List[Tuple[FBPage, List[str]]] = []
+        unpublished: List[FBPage] = []
+        for data in pages_data:
+            page = existing.get(int(data['page_id']))
+            if page is None:
+                to_create.append(cls(account=account, **data))
+                continue
+
+            page.account = account
+            if page.is_published and data.get('is_published') is False:
+                unpublished.append(page)
+            for field_name, value in data.items():
+                setattr(page, field_name, value)
+
+            changed_data = page.get_changed_data()
+            if changed_data:
+                to_update.append((page, [x['field'] for x in changed_data]))
+                actions.append(
+                    Action.build(action_datetime=now, verb=action_verb, action_object=page, data=changed_data)
+                )
+
+        cls.bulk_save_changed(to_update)
+        for page in cls.objects.bulk_create(to_create):
+            page_data = {
+                field: getattr(page, field)
+                for field in ('account_id', 'page_id', 'name', 'access_token', 'is_published', 'deleted_at')
+            }
+            actions.append(
+                Action.build(
+                    action_datetime=now,
+                    verb='created FB page',
+                    action_object=page,
+                    target_object=account,
+                    data=page_data,
+                )
+            )
+        Action.objects.bulk_create(actions)
+
+        for page in unpublished:
+            page.unpublished()
+        return len(to_create), len(to_update), len(pages_data) - len(to_create) - len(to_update)
+
     def unpublished(self):
         if self.account.manager:
             # Шлем уведомление про то, что страницу сняли с публикации
@@ -1835,6 +2046,8 @@ class AdAccount(LogChangedMixin):
     cards = models.ManyToManyField('Card', through='AdAccountCreditCard')
 
     bills_load_at = models.DateTimeField(null=True, blank=True)
+    # Время (time из Graph) самой новой загруженной транзакции, следующая загрузка начинается с него
+    transactions_synced_ts = models.PositiveIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(default=timezone.now)
     deleted_at = models.DateTimeField(null=True, blank=True)
@@ -1958,6 +2171,135 @@ class AdAccount(LogChangedMixin):
 
         return adaccount
 
+    @classmethod
+    @transaction.atomic
+    def bulk_reconcile(
+        cls, account: Account, adaccounts_data: List[Dict[str, Any]], action_verb: str = 'updated adaccount'
+    ) -> Tuple[int, int]:
+        """
+        Синхронизация рекламных аккаунтов акка с данными из FB пачкой, по тем же правилам, что create/update:
+        существующие грузятся одним запросом, изменения пишутся через bulk_update/bulk_create, экшны - одним
+        bulk_create. Логи статуса/менеджера, нотификации и алерты - только по реально изменившимся.
+        В adaccounts_data - kwargs для create (с created_at). Возвращает (создано, обновлено)
+        """
+        now = timezone.now()
+        adaccounts_data = list({data['adaccount_id']: data for data in adaccounts_data}.values())
+        existing: Dict[int, AdAccount] = {}
+        queryset = cls.objects.select_for_update().filter(adaccount_id__in=[x['adaccount_id'] for x in adaccounts_data])
+        # Как и раньше через AdAccount.objects.get(adaccount_id=...) ищем по всем акками, свой в приоритете
+        for adaccount in queryset.order_by('id'):
+            if adaccount.adaccount_id not in existing or adaccount.account_id == account.id:
+                existing[adaccount.adaccount_id] = adaccount
+
+        actions: List[Action] = []
+        logs: List[AdAccountLog] = []
+        to_create: List[AdAccount] = []
+        to_update: List[Tuple[AdAccount, List[str]]] = []
+        changed: List[AdAccount] = []
+        status_changed: List[AdAccount] = []
+        for data in adaccounts_data:
+            data = dict(data)
+            adaccount = existing.get(data['adaccount_id'])
+            if adaccount is None:
+                manager = data.pop('manager', None)
+                adaccount = cls(manager_id=manager.id if manager else None, **data)
+                to_create.append(adaccount)
+                continue
+
+            # При обновлении дата создания не меняется
+            data.pop('created_at', None)
+            data['deleted_at'] = None
+            manager = data.pop('manager', None)
+            if (manager.id if manager else None) != adaccount.manager_id:
+                adaccount.manager = manager
+                logs.append(
+                    AdAccountLog(adaccount=adaccount, log_type=AdAccountLog.MANAGER, manager=manager, start_at=now)
+                )
+            if adaccount.balance > data['balance']:
+                redis.srem('sent_billing_alert', adaccount.adaccount_id)
+                redis.srem('sent_overbilling_alert', adaccount.adaccount_id)
+            if adaccount.status != data['status']:
+                status_changed.append(adaccount)
+
+            for field_name, value in data.items():
+                setattr(adaccount, field_name, value)
+
+            changed_data = adaccount.get_changed_data()
+            if not changed_data:
+                continue
+            update_fields = [x['field'] for x in changed_data]
+            # Если только баланс и спенд, то не надо лог записывать
+            if len([x for x in update_fields if x not in ['balance', 'amount_spent']]) > 1:
+                actions.append(
+                    Action.build(
+                        action_datetime=now,
+                        verb=action_verb,
+                        action_object=adaccount,
+                        target_object=account,
+                        data=changed_data,
+                    )
+                )
+            adaccount.updated_at = now
+            to_update.append((adaccount, update_fields + ['updated_at']))
+            changed.append(adaccount)
+
+        cls.bulk_save_changed(to_update)
+        created = cls.objects.bulk_create(to_create)
+        for adaccount in created:
+            adaccount_data = {
+                field: getattr(adaccount, field)
+                for field in (
+                    'account_id',
+                    'manager_id',
+                    'adaccount_id',
+                    'business_id',
+                    'name',
+                    'status',
+                    'disable_reason',
+                    'balance',
+                    'amount_spent',
+                    'payment_cycle',
+                    'limit',
+                    'created_at',
+                    'pixels',
+                    'currency',
+                    'timezone_name',
+                    'timezone_offset_hours_utc',
+                )
+            }
+            actions.append(
+                Action.build(
+                    action_datetime=now,
+                    verb='created adaccount',
+                    action_object=adaccount,
+                    target_object=account,
+                    data=adaccount_data,
+                )
+            )
+            logs.append(
+                AdAccountLog(adaccount=adaccount, log_type=AdAccountLog.STATUS, status=adaccount.status, start_at=now)
+            )
+            logs.append(
+                AdAccountLog(
+                    adaccount=adaccount, log_type=AdAccountLog.MANAGER, manager_id=adaccount.manager_id, start_at=now
+                )
+            )
+
+        # Открытые логи менеджера у изменившихся закрываем, как в AdAccountLog.log_change
+        manager_changed = [log.adaccount_id for log in logs if log.log_type == AdAccountLog.MANAGER]
+        AdAccountLog.objects.filter(
+            adaccount_id__in=manager_changed, log_type=AdAccountLog.MANAGER, end_at__isnull=True
+        ).update(end_at=now)
+        AdAccountLog.objects.bulk_create(logs)
+        Action.objects.bulk_create(actions)
+
+        for adaccount in status_changed:
+            # Пишем лог + нотификация
+            adaccount.change_status(adaccount.status, disable_reason=adaccount.disable_reason, now=now)
+        for adaccount in changed:
+            adaccount.check_threshold()
+        return len(created), len(changed)
+
     def change_status(
         self, new_status: int, now: datetime.datetime, changed_by: Optional[User] = None, disable_reason: int = None
     ) -> None:
@@ -2040,6 +2382,37 @@ class AdAccount(LogChangedMixin):
         return None
 
 
+def recalc_card_totals(table: str, transaction_field: str, scope: str, params: Dict[str, Any]) -> int:
+    """
+    Пересчет fb_spends (payment - refund) и funds (topup - withdraw) по completed транзакциям
+    для карт из table, попавших в scope: все суммы одним GROUP BY с FILTER, запись одним UPDATE ... FROM.
+    Строки, у которых суммы не поменялись, не перезаписываются. Возвращает количество обновленных карт.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {table} card
+            SET fb_spends = totals.fb_spends, funds = totals.funds
+            FROM (
+                SELECT
+                    c.id,
+                    COALESCE(SUM(tx.amount) FILTER (WHERE tx.charge_type = 'payment'), 0)
+                        - COALESCE(SUM(tx.amount) FILTER (WHERE tx.charge_type = 'refund'), 0) AS fb_spends,
+                    COALESCE(SUM(tx.amount) FILTER (WHERE tx.charge_type = 'topup'), 0)
+                        - COALESCE(SUM(tx.amount) FILTER (WHERE tx.charge_type = 'withdraw'), 0) AS funds
+                FROM {table} c
+                LEFT JOIN core_adaccounttransaction tx ON tx.{transaction_field} = c.id AND tx.status = 'completed'
+                WHERE {scope}
+                GROUP BY c.id
+            ) totals
+            WHERE card.id = totals.id
+                AND (card.fb_spends, card.funds) IS DISTINCT FROM (totals.fb_spends, totals.funds)
+            """,
+            params,
+        )
+        return cursor.rowcount
+
+
 class AdAccountCreditCard(LogChangedMixin):
     adaccount = models.ForeignKey('AdAccount', on_delete=models.CASCADE)
     card = models.ForeignKey('Card', on_delete=models.SET_NULL, null=True, blank=True)
@@ -2057,35 +2430,21 @@ class AdAccountCreditCard(LogChangedMixin):
     def __str__(self):
         return self.display_string or str(self.id)
 
-    @transaction.atomic
     def recalc_spends(self):
-        queryset = AdAccountTransaction.objects.filter(adaccount_card=self, status='completed')
-
-        refunds = queryset.filter(adaccount_card=self, charge_type='refund')
-        spends = queryset.filter(adaccount_card=self, charge_type='payment')
-
-        funds = queryset.filter(adaccount_card=self, charge_type='topup')
-        withdraw = queryset.filter(adaccount_card=self, charge_type='withdraw')
-
-        total_refunds = refunds.aggregate(amount=Sum('amount'))
-        total_refunds = total_refunds.get('amount') or Decimal('0.00')
-
-        total_spends = spends.aggregate(amount=Sum('amount'))
-        total_spends = total_spends.get('amount') or Decimal('0.00')
+        AdAccountCreditCard.bulk_recalc_spends(ids=[self.id])
 
-        total_funds = funds.aggregate(amount=Sum('amount'))
-        total_funds = total_funds.get('amount') or Decimal('0.00')
-
-        total_withdraw = withdraw.aggregate(amount=Sum('amount'))
-        total_withdraw = total_withdraw.get('amount') or Decimal('0.00')
-
-        fb_spends = total_spends - total_refunds
-        funds = total_funds - total_withdraw
-
-        adaccount_card = AdAccountCreditCard.objects.select_for_update().get(id=self.id)
-        adaccount_card.fb_spends = fb_spends
-        adaccount_card.funds = funds
-        adaccount_card.save(update_fields=['fb_spends', 'funds'])
+    @classmethod
+    def bulk_recalc_spends(cls, adaccount_id: Optional[int] = None, ids: Optional[List[int]] = None) -> int:
+        """
+        Все карты рекламных аккаунтов, карты одного рекламного аккаунта или карты по id
+        """
+        if ids is not None:
+            return recalc_card_totals(cls._meta.db_table, 'adaccount_card_id', 'c.id = ANY(%(ids)s)', {'ids': ids})
+        if adaccount_id is not None:
+            scope, params = 'c.adaccount_id = %(adaccount_id)s', {'adaccount_id': adaccount_id}
+        else:
+            scope, params = 'TRUE', {}
+        return recalc_card_totals(cls._meta.db_table, 'adaccount_card_id', scope, params)
 
     @classmethod
     @transaction.atomic
@@ -2210,35 +2569,23 @@ class Card(LogChangedMixin):
     class Meta:
         ordering = ('-id',)
 
-    @transaction.atomic
     def recalc_spends(self):
-        queryset = AdAccountTransaction.objects.filter(card=self, status='completed')
-
-        refunds = queryset.filter(card=self, charge_type='refund')
-        spends = queryset.filter(card=self, charge_type='payment')
+        Card.bulk_recalc_spends(ids=[self.id])
 
-        funds = queryset.filter(card=self, charge_type='topup')
-        withdraw = queryset.filter(card=self, charge_type='withdraw')
-
-        total_refunds = refunds.aggregate(amount=Sum('amount'))
-        total_refunds = total_refunds.get('amount') or Decimal('0.00')
-
-        total_spends = spends.aggregate(amount=Sum('amount'))
-        total_spends = total_spends.get('amount') or Decimal('0.00')
-
-        total_funds = funds.aggregate(amount=Sum('amount'))
-        total_funds = total_funds.get('amount') or Decimal('0.00')
-
-        total_withdraw = withdraw.aggregate(amount=Sum('amount'))
-        total_withdraw = total_withdraw.get('amount') or Decimal('0.00')
-
-        fb_spends = total_spends - total_refunds
-        funds = total_funds - total_withdraw
-
-        card = Card.objects.select_for_update().get(id=self.id)
-        card.fb_spends = fb_spends
-        card.funds = funds
-        card.save(update_fields=['fb_spends', 'funds'])
+    @classmethod
+    def bulk_recalc_spends(cls, adaccount_id: Optional[int] = None, ids: Optional[List[int]] = None) -> int:
+        """
+        Все карты, карты, привязанные к одному рекламному аккаунту, или карты по id.
+        Транзакции карты считаются по всем ее рекламным аккаунтам
+        """
+        if ids is not None:
+            return recalc_card_totals(cls._meta.db_table, 'card_id', 'c.id = ANY(%(ids)s)', {'ids': ids})
+        if adaccount_id is not None:
+            scope = 'c.id IN (SELECT card_id FROM core_adaccountcreditcard WHERE adaccount_id = %(adaccount_id)s)'
+            params = {'adaccount_id': adaccount_id}
+        else:
+            scope, params = 'TRUE', {}
+        return recalc_card_totals(cls._meta.db_table, 'card_id', scope, params)
 
     @classmethod
     def get_type_by_display_string(cls, display_string: str) -> Tuple[int, str]:
@@ -2431,6 +2778,57 @@ class AdAccountLog(models.Model):
         cls.objects.create(**log_data)
 
 
+class ManagerTimeline:
+    """
+    Интервалы менеджеров (log_type=MANAGER) для набора аккаунтов, рекламных аккаунтов или кампаний.
+    Логи грузятся одним запросом, get_manager_on_date отвечает так же, как одноименные методы моделей,
+    но без запроса на каждую строку статы/лида.
+    """
+
+    def __init__(self, log_model, field: str, fallback_field: str, objects):
+        objects = list(objects)
+        fallback_ids = {obj.id: getattr(obj, f'{fallback_field}_id') for obj in objects}
+        users = User.objects.in_bulk([user_id for user_id in fallback_ids.values() if user_id])
+        self.fallback = {obj_id: users.get(user_id) for obj_id, user_id in fallback_ids.items()}
+
+        self.starts: Dict[int, List[datetime.date]] = defaultdict(list)
+        self.intervals: Dict[int, List[Tuple[Optional[datetime.date], Optional[User]]]] = defaultdict(list)
+        logs = (
+            log_model.objects.filter(**{f'{field}_id__in': list(fallback_ids)}, log_type=log_model.MANAGER)
+            .select_related('manager')
+            .order_by('start_at', 'id')
+        )
+        for log in logs:
+            obj_id = getattr(log, f'{field}_id')
+            self.starts[obj_id].append(timezone.localdate(log.start_at))
+            self.intervals[obj_id].append((timezone.localdate(log.end_at) if log.end_at else None, log.manager))
+
+    @classmethod
+    def for_accounts(cls, accounts) -> 'ManagerTimeline':
+        return cls(AccountLog, 'account', 'manager', accounts)
+
+    @classmethod
+    def for_adaccounts(cls, adaccounts) -> 'ManagerTimeline':
+        return cls(AdAccountLog, 'adaccount', 'manager', adaccounts)
+
+    @classmethod
+    def for_campaigns(cls, campaigns) -> 'ManagerTimeline':
+        return cls(CampaignLog, 'campaign', 'user', campaigns)
+
+    def get_manager_on_date(self, obj, date: datetime.date) -> Optional[User]:
+        if obj.id not in self.fallback:
+            # Объект не загружен в таймлайн
+            return obj.get_manager_on_date(date)
+
+        starts = self.starts.get(obj.id, [])
+        # Последний начавшийся до даты интервал, который на эту дату еще не закрыт
+        for index in range(bisect_right(starts, date) - 1, -1, -1):
+            end, manager = self.intervals[obj.id][index]
+            if end is None or end >= date:
+                return manager
+        return self.fallback[obj.id]
+
+
 class AdAccountTransaction(models.Model):
     adaccount = models.ForeignKey(AdAccount, on_delete=models.CASCADE, db_index=True, null=True, blank=True)
     transaction_id = models.CharField(max_length=64, db_index=True, default=uuid.uuid4)
@@ -2465,6 +2863,62 @@ class AdAccountTransaction(models.Model):
         unique_together = ('adaccount', 'transaction_id')
         index_together = ('adaccount', 'transaction_id')
 
+    UPSERT_FIELDS = (
+        'adaccount_id',
+        'transaction_id',
+        'adaccount_card_id',
+        'card_id',
+        'tx_type',
+        'amount',
+        'currency',
+        'start_at',
+        'end_at',
+        'start_at_ts',
+        'end_at_ts',
+        'billed_at',
+        'reason',
+        'charge_type',
+        'product_type',
+        'payment_option',
+        'status',
+        'tracking_id',
+        'transaction_type',
+        'vat_invoice_id',
+    )
+
+    @classmethod
+    def bulk_upsert(cls, rows: List[Dict[str, Any]]) -> List[Tuple[int, Optional[int]]]:
+        """
+        Страница транзакций из Graph одним INSERT ... ON CONFLICT (adaccount_id, transaction_id).
+        Возвращает (adaccount_card_id, card_id) созданных и изменившихся транзакций - по ним пересчитываются карты
+        """
+        # Повтор транзакции в одном запросе ON CONFLICT не пропустит, остается последняя
+        rows = list({row['transaction_id']: row for row in rows}.values())
+        if not rows:
+            return []
+
+        columns = list(cls.UPSERT_FIELDS) + ['data', 'created_at']
+        placeholder = f'({", ".join(["%s"] * len(cls.UPSERT_FIELDS))}, %s::jsonb, now())'
+        changed_fields = [field for field in cls.UPSERT_FIELDS if field not in ('adaccount_id', 'transaction_id')]
+        params: List[Any] = []
+        for row in rows:
+            params.extend(row.get(field) for field in cls.UPSERT_FIELDS)
+            params.append(json.dumps(row.get('data'), cls=DjangoJSONEncoder))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO core_adaccounttransaction ({", ".join(columns)})
+                VALUES {", ".join([placeholder] * len(rows))}
+                ON CONFLICT (adaccount_id, transaction_id)
+                DO UPDATE SET {", ".join(f'{field} = EXCLUDED.{field}' for field in changed_fields + ['data'])}
+                WHERE ({", ".join(f'core_adaccounttransaction.{field}' for field in changed_fields)})
+                    IS DISTINCT FROM ({", ".join(f'EXCLUDED.{field}' for field in changed_fields)})
+                RETURNING adaccount_card_id, card_id
+                """,
+                params,
+            )
+            return cursor.fetchall()
+
 
 class Ad(LogChangedMixin):
     AD_STATUS_CHOICES = (('ACTIVE', 'Active'), ('PAUSED', 'Paused'), ('DELETED', 'Deleted'), ('ARCHIVED', 'Archived'))
@@ -2574,6 +3028,81 @@ class Ad(LogChangedMixin):
             )
         return ad
 
+    @classmethod
+    @transaction.atomic
+    def bulk_sync(
+        cls, adaccount: AdAccount, ads_data: List[Dict[str, Any]], action_verb: str = 'updated ad'
+    ) -> Tuple[int, int, int]:
+        """
+        Объявления рекламного аккаунта из Graph пачкой по правилам create/update: существующие грузятся
+        одним запросом, без изменений не пишутся, нотификации по effective_status и проверка ссылки -
+        только по изменившимся. Возвращает (создано, обновлено, без изменений)
+        """
+        now = timezone.now()
+        ads_data = list({int(data['ad_id']): data for data in ads_data}.values())
+        existing: Dict[int, Ad] = {}
+        queryset = cls.objects.select_for_update().filter(
+            adaccount=adaccount, ad_id__in=[int(data['ad_id']) for data in ads_data]
+        )
+        creatives = {int(data['ad_id']): data['creative_id'] for data in ads_data}
+        for ad in queryset.order_by('id'):
+            # Объявление с тем же креативом в приоритете
+            if ad.ad_id not in existing or ad.creative_id == creatives[ad.ad_id]:
+                existing[ad.ad_id] = ad
+
+        actions: List[Action] = []
+        to_create: List[Ad] = []
+        created_data: List[Dict[str, Any]] = []
+        to_update: List[Tuple[Ad, List[str]]] = []
+        status_changed: List[Ad] = []
+        check_urls: List[Ad] = []
+        for data in ads_data:
+            ad = existing.get(int(data['ad_id']))
+            if ad is None:
+                to_create.append(cls(adaccount=adaccount, **data))
+                created_data.append({'adaccount_id': adaccount.id, **data})
+                continue
+
+            ad.adaccount = adaccount
+            if 'effective_status' in data and ad.effective_status != data['effective_status']:
+                status_changed.append(ad)
+            for field_name, value in data.items():
+                setattr(ad, field_name, value)
+
+            changed_data = ad.get_changed_data()
+            if changed_data:
+                update_fields = [x['field'] for x in changed_data]
+                to_update.append((ad, update_fields))
+                if ad.ad_url and 'ad_url' in update_fields:
+                    check_urls.append(ad)
+                actions.append(
+                    Action.build(
+                        action_datetime=now,
+                        verb=action_verb,
+                        action_object=ad,
+                        target_object=adaccount,
+                        data=changed_data,
+                    )
+                )
+
+        cls.bulk_save_changed(to_update)
+        for ad, ad_data in zip(cls.objects.bulk_create(to_create), created_data):
+            actions.append(
+                Action.build(
+                    action_datetime=now, verb='created ad', action_object=ad, target_object=adaccount, data=ad_data
+                )
+            )
+            if ad.ad_url:
+                check_urls.append(ad)
+        Action.objects.bulk_create(actions)
+
+        for ad in status_changed:
+            # Пишем лог + нотификация
+            ad.change_effective_status(ad.effective_status)
+        for ad in check_urls:
+            ad.check_url()
+        return len(to_create), len(to_update), len(ads_data) - len(to_create) - len(to_update)
+
     def check_url(self):
         if self.adaccount.account.manager_id in [38, 39]:
             return
@@ -3185,6 +3714,27 @@ class CampaignDayStat(models.Model):
     class Meta:
         unique_together = ('campaign', 'date')
 
+    @classmethod
+    def bulk_upsert(cls, rows: List[Dict[str, Any]]):
+        """
+        Пачка сырых данных из трекера, перезаписывает стату кампании за день
+        """
+        bulk_upsert_stats(
+            table='core_campaigndaystat',
+            key_fields=['campaign_id', 'date'],
+            value_fields=['visits', 'leads', 'clicks', 'revenue', 'cost', 'profit'],
+            conflict='(campaign_id, date)',
+            updates="""
+                visits = EXCLUDED.visits,
+                leads = EXCLUDED.leads,
+                clicks = EXCLUDED.clicks,
+                revenue = EXCLUDED.revenue,
+                cost = EXCLUDED.cost,
+                profit = EXCLUDED.profit
+            """,
+            rows=rows,
+        )
+
 
 class AdAccountDayStat(models.Model):
     """
@@ -3223,9 +3773,53 @@ class AdAccountDayStat(models.Model):
         current_stats.spend = spend
         current_stats.save()
 
+        Account.add_spends_delta(current_stats.account_id, Decimal(str(spend)) - Decimal(str(prev_stats.spend)))
         return prev_stats, current_stats
 
 
+STAT_UPSERT_BATCH_SIZE = 1000
+
+
+def bulk_upsert_stats(
+    table: str, key_fields: List[str], value_fields: List[str], conflict: str, updates: str, rows: List[Dict[str, Any]]
+) -> None:
+    """
+    Пишет пачку дельт статы через INSERT ... VALUES (...), (...) ON CONFLICT.
+    Postgres не дает обновить одну строку дважды в одном запросе, поэтому повтор ключа
+    уходит в следующий раунд - дельты применяются в том же порядке, что и при построчном upsert.
+    Недостающие поля значений считаются нулевыми.
+    """
+    rounds: List[List[Dict[str, Any]]] = []
+    seen: Dict[Tuple, int] = defaultdict(int)
+    for row in rows:
+        key = tuple(row.get(field) for field in key_fields)
+        index = seen[key]
+        seen[key] += 1
+        if index == len(rounds):
+            rounds.append([])
+        rounds[index].append(row)
+
+    columns = key_fields + value_fields
+    placeholder = f'({", ".join(["%s"] * len(columns))})'
+    with connection.cursor() as cursor:
+        for round_rows in rounds:
+            for offset in range(0, len(round_rows), STAT_UPSERT_BATCH_SIZE):
+                batch = round_rows[offset : offset + STAT_UPSERT_BATCH_SIZE]
+                params: List[Any] = []
+                for row in batch:
+                    params.extend(row.get(field) for field in key_fields)
+                    params.extend(row.get(field, 0) for field in value_fields)
+                cursor.execute(
+                    f"""
+                    INSERT INTO {table} ({", ".join(columns)})
+                    VALUES {", ".join([placeholder] * len(batch))}
+                    ON CONFLICT {conflict}
+                    DO UPDATE SET {updates}
+                    """,
+                    params,
+                )
+
+
 class UserAdAccountDayStat(models.Model):
     """
     Cтата по аккаунту и юзеру по дням
@@ -3277,6 +3871,23 @@ class UserAdAccountDayStat(models.Model):
                 },
             )
 
+    @classmethod
+    def bulk_upsert(cls, rows: List[Dict[str, Any]]):
+        """
+        Пачка дельт в формате kwargs для upsert
+        """
+        bulk_upsert_stats(
+            table='core_useradaccountdaystat',
+            key_fields=['date', 'account_id', 'adaccount_id', 'user_id'],
+            value_fields=['spend', 'clicks'],
+            conflict='(date, account_id, adaccount_id, COALESCE(user_id, -1))',
+            updates="""
+                spend = core_useradaccountdaystat.spend + EXCLUDED.spend,
+                clicks = core_useradaccountdaystat.clicks + EXCLUDED.clicks
+            """,
+            rows=rows,
+        )
+
 
 class UserCampaignDayStat(models.Model):
     """
@@ -3344,6 +3955,27 @@ class UserCampaignDayStat(models.Model):
                 },
             )
 
+    @classmethod
+    def bulk_upsert(cls, rows: List[Dict[str, Any]]):
+        """
+        Пачка дельт в формате kwargs для upsert
+        """
+        bulk_upsert_stats(
+            table='core_usercampaigndaystat',
+            key_fields=['date', 'campaign_id', 'user_id'],
+            value_fields=['clicks', 'visits', 'leads', 'revenue', 'cost', 'profit'],
+            conflict='(date, campaign_id, COALESCE(user_id, -1))',
+            updates="""
+                clicks = core_usercampaigndaystat.clicks + EXCLUDED.clicks,
+                visits = core_usercampaigndaystat.visits + EXCLUDED.visits,
+                leads = core_usercampaigndaystat.leads + EXCLUDED.leads,
+                revenue = core_usercampaigndaystat.revenue + EXCLUDED.revenue,
+                cost = core_usercampaigndaystat.cost + EXCLUDED.cost,
+                profit = core_usercampaigndaystat.profit + EXCLUDED.profit
+            """,
+            rows=rows,
+        )
+
 
 class UserAccountDayStat(models.Model):
     """
@@ -3442,6 +4074,42 @@ class UserAccountDayStat(models.Model):
                 },
             )
 
+    @classmethod
+    def bulk_upsert(cls, rows: List[Dict[str, Any]]):
+        """
+        Пачка дельт в формате kwargs для upsert, profit считается так же, как в upsert
+        """
+        bulk_upsert_stats(
+            table='core_useraccountdaystat',
+            key_fields=['date', 'account_id', 'user_id', 'campaign_id'],
+            value_fields=['clicks', 'visits', 'revenue', 'leads', 'cost', 'spend', 'funds', 'payment', 'profit'],
+            conflict="""(
+                date,
+                COALESCE(account_id, -1),
+                COALESCE(user_id, -1),
+                COALESCE(campaign_id, -1)
+            )""",
+            updates="""
+                clicks = core_useraccountdaystat.clicks + EXCLUDED.clicks,
+                visits = core_useraccountdaystat.visits + EXCLUDED.visits,
+                revenue = core_useraccountdaystat.revenue + EXCLUDED.revenue,
+                leads = core_useraccountdaystat.leads + EXCLUDED.leads,
+                cost = core_useraccountdaystat.cost + EXCLUDED.cost,
+                spend = core_useraccountdaystat.spend + EXCLUDED.spend,
+                funds = core_useraccountdaystat.funds + EXCLUDED.funds,
+                payment = core_useraccountdaystat.payment + EXCLUDED.payment,
+                profit =
+                    CASE
+                      WHEN core_useraccountdaystat.spend = 0
+                        THEN (core_useraccountdaystat.revenue + EXCLUDED.revenue) -
+                             (core_useraccountdaystat.cost + EXCLUDED.cost)
+                      ELSE (core_useraccountdaystat.revenue + EXCLUDED.revenue) -
+                             (core_useraccountdaystat.spend + EXCLUDED.spend)
+                    END
+            """,
+            rows=rows,
+        )
+
 
 class UserDayStat(models.Model):
     """
@@ -3544,6 +4212,164 @@ class UserDayStat(models.Model):
                 },
             )
 
+    @classmethod
+    def bulk_upsert(cls, rows: List[Dict[str, Any]]):
+        """
+        Пачка дельт в формате kwargs для upsert, profit считается так же, как в upsert
+        """
+        bulk_upsert_stats(
+            table='core_userdaystat',
+            key_fields=['date', 'account_id', 'adaccount_id', 'user_id', 'campaign_id'],
+            value_fields=['clicks', 'visits', 'revenue', 'leads', 'cost', 'spend', 'funds', 'payment', 'profit'],
+            conflict="""(
+                date,
+                COALESCE(account_id, -1),
+                COALESCE(adaccount_id, -1),
+                COALESCE(user_id, -1),
+                COALESCE(campaign_id, -1)
+            )""",
+            updates="""
+                clicks = core_userdaystat.clicks + EXCLUDED.clicks,
+                visits = core_userdaystat.visits + EXCLUDED.visits,
+                revenue = core_userdaystat.revenue + EXCLUDED.revenue,
+                leads = core_userdaystat.leads + EXCLUDED.leads,
+                cost = core_userdaystat.cost + EXCLUDED.cost,
+                spend = core_userdaystat.spend + EXCLUDED.spend,
+                funds = core_userdaystat.funds + EXCLUDED.funds,
+                payment = core_userdaystat.payment + EXCLUDED.payment,
+                profit =
+                    CASE
+                      WHEN core_userdaystat.spend = 0
+                        THEN (core_userdaystat.revenue + EXCLUDED.revenue) -
+                             (core_userdaystat.cost + EXCLUDED.cost)
+                      ELSE (core_userdaystat.revenue + EXCLUDED.revenue) -
+                             (core_userdaystat.spend + EXCLUDED.spend)
+                    END
+            """,
+            rows=rows,
+        )
+
+
+class UserAccountMonthStat(models.Model):
+    """
+    Месячный роллап UserAccountDayStat по акку, юзеру, кампании.
+    Ведется триггером на core_useraccountdaystat (миграция 0483_month_stats.py), поэтому любой upsert,
+    bulk_upsert или удаление дневной статы сразу попадает сюда.
+    total_spend - сумма построчного SPEND (spend, а если он 0 - cost), как его считают вьюхи статы.
+    CREATE UNIQUE INDEX month_acc_camp_user_id ON core_useraccountmonthstat
+    (month, COALESCE(account_id, -1), COALESCE(campaign_id, -1), COALESCE(user_id, -1))
+    """
+
+    month = models.DateField(db_index=True)
+    # Без constraint: при удалении акка триггер сам обнулит роллап
+    account = models.ForeignKey(
+        Account, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+'
+    )
+    campaign = models.ForeignKey(
+        Campaign, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+'
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+'
+    )
+    spend = models.DecimalField(_('Spend'), max_digits=12, decimal_places=2, default=0)
+    total_spend = models.DecimalField(_('Total spend'), max_digits=12, decimal_places=2, default=0)
+    payment = models.DecimalField(_('Payment'), max_digits=12, decimal_places=2, default=0)
+    visits = models.IntegerField(_('Visits'), default=0)
+    leads = models.IntegerField(_('Leads'), default=0)
+    clicks = models.IntegerField(_('Clicks'), default=0)
+    revenue = models.DecimalField(_('Revenue'), max_digits=12, decimal_places=2, default=0)
+    cost = models.DecimalField(_('Cost'), max_digits=12, decimal_places=2, default=0)
+
+
+class UserMonthStat(models.Model):
+    """
+    Месячный роллап UserDayStat по акку, юзеру, кампании (рекламные аккаунты схлопнуты).
+    Ведется триггером на core_userdaystat (миграция 0483_month_stats.py)
+    CREATE UNIQUE INDEX month_acc_camp_user_id_v2 ON core_usermonthstat
+    (month, COALESCE(account_id, -1), COALESCE(campaign_id, -1), COALESCE(user_id, -1))
+    """
+
+    month = models.DateField(db_index=True)
+    account = models.ForeignKey(
+        Account, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+'
+    )
+    campaign = models.ForeignKey(
+        Campaign, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+'
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+'
+    )
+    spend = models.DecimalField(_('Spend'), max_digits=12, decimal_places=2, default=0)
+    payment = models.DecimalField(_('Payment'), max_digits=12, decimal_places=2, default=0)
+    visits = models.IntegerField(_('Visits'), default=0)
+    leads = models.IntegerField(_('Leads'), default=0)
+    clicks = models.IntegerField(_('Clicks'), default=0)
+    revenue = models.DecimalField(_('Revenue'), max_digits=12, decimal_places=2, default=0)
+    cost = models.DecimalField(_('Cost'), max_digits=12, decimal_places=2, default=0)
+
+
+class UserAccountPeriodStat(models.Model):
+    """
+    Вьюха: дневные строки UserAccountDayStat + месячные роллапы UserAccountMonthStat
+    (is_month=True, date - первое число месяца). Месяц надо брать либо из роллапа, либо по дням,
+    см. api.v1.utils.period_stat_filter
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    is_month = models.BooleanField()
+    date = models.DateField()
+    account = models.ForeignKey(
+        Account, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+'
+    )
+    campaign = models.ForeignKey(
+        Campaign, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+'
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+'
+    )
+    spend = models.DecimalField(_('Spend'), max_digits=12, decimal_places=2, default=0)
+    total_spend = models.DecimalField(_('Total spend'), max_digits=12, decimal_places=2, default=0)
+    payment = models.DecimalField(_('Payment'), max_digits=12, decimal_places=2, default=0)
+    visits = models.IntegerField(_('Visits'), default=0)
+    leads = models.IntegerField(_('Leads'), default=0)
+    clicks = models.IntegerField(_('Clicks'), default=0)
+    revenue = models.DecimalField(_('Revenue'), max_digits=12, decimal_places=2, default=0)
+    cost = models.DecimalField(_('Cost'), max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        managed = False
+        db_table = 'core_useraccountperiodstat'
+
+
+class UserPeriodStat(models.Model):
+    """
+    Вьюха: дневные строки UserDayStat + месячные роллапы UserMonthStat, аналогично UserAccountPeriodStat
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    is_month = models.BooleanField()
+    date = models.DateField()
+    account = models.ForeignKey(
+        Account, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+'
+    )
+    campaign = models.ForeignKey(
+        Campaign, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+'
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+'
+    )
+    spend = models.DecimalField(_('Spend'), max_digits=12, decimal_places=2, default=0)
+    payment = models.DecimalField(_('Payment'), max_digits=12, decimal_places=2, default=0)
+    visits = models.IntegerField(_('Visits'), default=0)
+    leads = models.IntegerField(_('Leads'), default=0)
+    clicks = models.IntegerField(_('Clicks'), default=0)
+    revenue = models.DecimalField(_('Revenue'), max_digits=12, decimal_places=2, default=0)
+    cost = models.DecimalField(_('Cost'), max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        managed = False
+        db_table = 'core_userperiodstat'
+
 
 def get_upload_path(instance, filename):
     ext = filename.split(".")[-1]
@@ -3567,6 +4393,13 @@ class ProcessCSVTask(models.Model):
     # )
     type = models.CharField(_('CSV Type'), choices=CSV_TYPE_CHOICES, default=PAYMENTS, max_length=16)
     status = models.PositiveSmallIntegerField(_('Status'), choices=STATUS_CHOICES, default=0)
+    # Прогресс импорта
+    processed_rows = models.PositiveIntegerField(default=0)
+    rejected_rows = models.PositiveIntegerField(default=0)
+    imported_rows = models.PositiveIntegerField(default=0)
+    duplicate_rows = models.PositiveIntegerField(default=0)
+    # Ошибки по строкам [{'row': номер строки, 'error': текст}]
+    errors = models.JSONField(default=list, blank=True)
     created = models.DateTimeField(_('Created at'), auto_now_add=True)
 
 
@@ -3668,7 +4501,11 @@ class LeadgenLead(models.Model):
         (0, 'Male'),
         (1, 'Female'),
     )
-    lead_id = models.BigIntegerField(null=True, blank=True)
+    # Поля лидформы, которые пишет bulk_upsert, пустые значения при обновлении не затирают сохраненные
+    FORM_FIELDS = ('email', 'phone', 'first_name', 'last_name', 'name', 'city', 'zip', 'address', 'gender')
+    UPSERT_BATCH_SIZE = 500
+
+    lead_id = models.BigIntegerField(null=True, blank=True, unique=True)
     page = models.ForeignKey(FBPage, on_delete=models.SET_NULL, null=True, blank=True)
     account = models.ForeignKey(Account, on_delete=models.SET_NULL, null=True, blank=True, db_index=True)
     leadgen = models.ForeignKey(Leadgen, on_delete=models.SET_NULL, null=True, blank=True)
@@ -3708,6 +4545,59 @@ class LeadgenLead(models.Model):
     def __str__(self):
         return self.full_name or f'{self.uuid}'
 
+    @classmethod
+    def bulk_upsert(cls, rows: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """
+        Пачка лидов из лидформы через INSERT ... ON CONFLICT (lead_id) DO UPDATE,
+        по запросу на UPSERT_BATCH_SIZE строк. Возвращает (создано, обновлено)
+        """
+        # Повтор lead_id в одном запросе ON CONFLICT не пропустит, остается последний
+        rows = list({row['lead_id']: row for row in rows}.values())
+        base_fields = [
+            'lead_id',
+            'page_id',
+            'account_id',
+            'leadgen_id',
+            'user_id',
+            'leadform_id',
+            'created_at',
+            'country_id',
+            'country_code',
+            'offer',
+        ]
+        columns = ['uuid', 'raw_data'] + base_fields + list(cls.FORM_FIELDS)
+        placeholder = f'(%s, %s::jsonb, {", ".join(["%s"] * (len(columns) - 2))})'
+        updates = ', '.join(
+            ['raw_data = EXCLUDED.raw_data']
+            + [f'{field} = EXCLUDED.{field}' for field in base_fields if field != 'lead_id']
+            + [f'{field} = COALESCE(EXCLUDED.{field}, core_leadgenlead.{field})' for field in cls.FORM_FIELDS]
+        )
+
+        created, updated = 0, 0
+        with connection.cursor() as cursor:
+            for offset in range(0, len(rows), cls.UPSERT_BATCH_SIZE):
+                batch = rows[offset : offset + cls.UPSERT_BATCH_SIZE]
+                params: List[Any] = []
+                for row in batch:
+                    params.append(str(uuid.uuid4()))
+                    params.append(json.dumps(row.get('raw_data'), cls=DjangoJSONEncoder))
+                    params.extend(row.get(field) for field in base_fields)
+                    params.extend(row.get(field) for field in cls.FORM_FIELDS)
+                cursor.execute(
+                    f"""
+                    INSERT INTO core_leadgenlead ({", ".join(columns)})
+                    VALUES {", ".join([placeholder] * len(batch))}
+                    ON CONFLICT (lead_id)
+                    DO UPDATE SET {updates}
+                    RETURNING xmax = 0
+                    """,
+                    params,
+                )
+                inserted = sum(1 for (is_created,) in cursor.fetchall() if is_created)
+                created += inserted
+                updated += len(batch) - inserted
+        return created, updated
+
     def get_full_name(self):
         """
         Return the first_name plus the last_name, with a space in between.
@@ -3720,28 +4610,9 @@ class LeadgenLead(models.Model):
 
     @property
     def clear_phone(self):
-        from core.tasks.helpers import COUNTRY_PHONE
-
-        phone = self.phone
-        if self.phone is not None:
-            prefix = COUNTRY_PHONE[self.country.code]
-            if not self.phone.startswith(prefix):
-                if self.phone.startswith(f'00{prefix[1:]}') or self.phone.startswith(f'0{prefix[1:]}0'):
-                    phone = self.phone[4:]
-                    phone = f'{prefix}{phone}'
-                elif self.phone.startswith('+0'):
-                    phone = self.phone[2:]
-                    phone = f'{prefix}{phone}'
-                elif self.phone.startswith('0') or self.phone.startswith('1'):
-                    phone = self.phone[1:]
-                    phone = f'{prefix}{phone}'
-                elif self.phone.startswith(prefix[1:]):
-                    phone = f'+{self.phone}'
-                elif self.phone.startswith('+'):
-                    phone = self.phone
-                else:
-                    phone = f'{prefix}{self.phone}'
-        return phone
+        from core.phone_normalizer import EXPORT, normalize_phone
+
+        return normalize_phone(self.phone, self.country.code if self.country_id else None, EXPORT)
 
     @property
     def full_name(self):
@@ -3849,6 +4720,8 @@ class LinkGroup(LogChangedMixin):
     uuid = models.UUIDField('Group UUID', default=uuid.uuid4, db_index=True, editable=False)
     user = models.ForeignKey(User, on_delete=models.PROTECT)
     broadcast = models.ForeignKey('LinkGroup', on_delete=models.PROTECT, null=True, blank=True)
+    # Группа, из которой выделена часть при превышении max_links
+    parent = models.ForeignKey('LinkGroup', on_delete=models.SET_NULL, null=True, blank=True, related_name='parts')
     name = models.CharField(max_length=64)
     base_url = models.URLField()
     network = models.CharField(default='default', max_length=32, choices=NETWORK_CHOICES)
@@ -3856,6 +4729,10 @@ class LinkGroup(LogChangedMixin):
     max_links = models.PositiveIntegerField(default=0)
     description = models.CharField(max_length=255, null=True, blank=True)
     total_links = models.PositiveIntegerField(default=0)
+    # Прогресс генерации ссылок, id последнего обработанного лида
+    last_lead_id = models.PositiveIntegerField(default=0)
+    # Прогресс выгрузки csv
+    exported_links = models.PositiveIntegerField(default=0)
     total_clicks = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(default=timezone.now, db_index=True, editable=False)
     status = models.PositiveSmallIntegerField(choices=STATUS_CHOICES, default=WAITING)
@@ -3880,6 +4757,14 @@ class LinkGroup(LogChangedMixin):
     def clicked_links(self):
         return self.get_clicked_links().count()
 
+    def reset_links_progress(self):
+        """
+        Следующий create_links сгенерирует ссылки заново, а не продолжит с last_lead_id
+        """
+        with transaction.atomic():
+            LinkGroup.objects.filter(parent=self).update(parent=None)
+            LinkGroup.objects.filter(pk=self.pk).update(last_lead_id=0, total_links=0, exported_links=0)
+
     class Meta:
         ordering = ('-created_at',)
 
@@ -3902,11 +4787,7 @@ class Link(LogChangedMixin):
     @property
     def short_url(self):
         # shortify_domain = self.group.domain
-        shortify_domains = ShortifyDomain.objects.filter(is_banned=False, is_public=True).values_list(
-            'domain', flat=True
-        )
-        domain = choice(list(shortify_domains))
-        return f'https://{domain}/{self.key}'
+        return SHORTIFY_DOMAIN_POOL.next_prefix() + self.key
 
     @classmethod
     @transaction.atomic
@@ -3915,6 +4796,33 @@ class Link(LogChangedMixin):
         link = cls.objects.create(user=user, group=group, leadgen_lead=leadgen_lead, url=url)
         return link
 
+    @classmethod
+    def copy_create(cls, links: List['Link']) -> None:
+        """
+        Вставка пачки ссылок через COPY, без возврата id
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for link in links:
+            writer.writerow([link.user_id, link.group_id, link.leadgen_lead_id, link.url, link.clicks, link.created_at])
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                'COPY core_link (user_id, group_id, leadgen_lead_id, url, clicks, created_at) '
+                'FROM STDIN WITH (FORMAT csv)',
+                buffer,
+            )
+
+
+
+class LinkClicksFlush(models.Model):
+    """
+    Примененные пачки кликов flush_click_stats: пишется в одной транзакции с UPDATE кликов,
+    повтор той же пачки после сбоя между базой и redis пропускается
+    """
+
+    flush_id = models.CharField(max_length=32, unique=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
 
 class CampaignTemplate(LogChangedMixin):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
@@ -0,0 +1,129 @@
+import datetime
+import logging
+from typing import List, Optional, Tuple
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from dateutil.relativedelta import relativedelta
+
+logger = logging.getLogger(__name__)
+
+# Дневная стата, партиционированная по месяцам по полю date (миграция 0484_partition_day_stats.py).
+# Нативное партиционирование Postgres, а не architect: architect раскладывает строки триггером по
+# наследуемым таблицам, и ON CONFLICT по COALESCE индексам родителя перестает находить конфликты.
+PARTITIONED_STAT_TABLES = (
+    'core_userdaystat',
+    'core_useraccountdaystat',
+    'core_useradaccountdaystat',
+    'core_adaccountdaystat',
+    'core_campaigndaystat',
+)
+
+
+def month_start(date: datetime.date) -> datetime.date:
+    return date.replace(day=1)
+
+
+def partition_name(table: str, month: datetime.date) -> str:
+    return f'{table}_y{month.year}m{month.month:02d}'
+
+
+def default_partition_name(table: str) -> str:
+    return f'{table}_default'
+
+
+def get_partitions(table: str) -> List[Tuple[str, str]]:
+    """
+    Список (имя, границы) партиций таблицы
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits
+            JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+            JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+            WHERE parent.relname = %s
+            ORDER BY child.relname
+            """,
+            [table],
+        )
+        return cursor.fetchall()
+
+
+def create_default_partition(table: str) -> None:
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {default_partition_name(table)} PARTITION OF {table} DEFAULT')
+
+
+@transaction.atomic
+def create_month_partition(table: str, month: datetime.date) -> bool:
+    """
+    Создает партицию на месяц, если ее еще нет. Строки этого месяца, попавшие в default партицию,
+    переносятся через родителя, чтобы триггеры роллапов отработали удаление и вставку
+    """
+    month = month_start(month)
+    name = partition_name(table, month)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s)', [name])
+        if cursor.fetchone()[0] is not None:
+            return False
+
+        params = {'start': month, 'end': month + relativedelta(months=1)}
+        default = default_partition_name(table)
+        cursor.execute('SELECT to_regclass(%s)', [default])
+        has_default = cursor.fetchone()[0] is not None
+        if has_default:
+            cursor.execute(f'CREATE TEMP TABLE {name}_moved (LIKE {table}) ON COMMIT DROP')
+            cursor.execute(
+                f"""
+                WITH moved AS (
+                    DELETE FROM {table} WHERE date >= %(start)s AND date < %(end)s RETURNING *
+                )
+                INSERT INTO {name}_moved SELECT * FROM moved
+                """,
+                params,
+            )
+
+        cursor.execute(
+            f"CREATE TABLE {name} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{params['start'].isoformat()}') TO ('{params['end'].isoformat()}')"
+        )
+
+        if has_default:
+            cursor.execute(f'INSERT INTO {table} SELECT * FROM {name}_moved')
+    logger.info(f'Created partition {name}')
+    return True
+
+
+def create_month_partitions(
+    table: str, start: datetime.date, months_ahead: int = 3, today: Optional[datetime.date] = None
+) -> List[str]:
+    """
+    Партиции с месяца start по текущий месяц + months_ahead
+    """
+    today = today or timezone.now().date()
+    month = month_start(start)
+    end = month_start(today) + relativedelta(months=months_ahead)
+    created = []
+    while month <= end:
+        if create_month_partition(table, month):
+            created.append(partition_name(table, month))
+        month += relativedelta(months=1)
+    return created
+
+
+def detach_month_partition(table: str, month: datetime.date) -> bool:
+    """
+    Отключает партицию месяца от таблицы, данные остаются в отдельной таблице для архивации.
+    Месячные роллапы при этом не меняются.
+    """
+    name = partition_name(table, month_start(month))
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s)', [name])
+        if cursor.fetchone()[0] is None:
+            return False
+        cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {name}')
+    logger.info(f'Detached partition {name}')
+    return True
@@ -0,0 +1,234 @@
+import csv
+import datetime
+import io
+import logging
+import time
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from dateutil.parser import parse
+
+from core.models.core import AccountLog, ProcessCSVTask
+
+logger = logging.getLogger(__name__)
+
+PAYMENTS_IMPORT_CHUNK_SIZE = 10000
+# Больше ошибок в ProcessCSVTask.errors не сохраняем, остальные только считаются
+PAYMENTS_IMPORT_MAX_ERRORS = 1000
+# AccountPayment.amount - max_digits=10, decimal_places=2
+MAX_AMOUNT = Decimal('99999999.99')
+
+# Повтор (account_id, date) в файле - побеждает последняя строка, как при построчном update_or_create
+PAYMENTS_SQL = """
+SELECT DISTINCT ON (account_id, date) account_id, date, amount
+FROM {staging}
+ORDER BY account_id, date, row_num DESC
+"""
+
+# Одним запросом: обновляем существующие платежи за дату, отсутствующие создаем.
+# Повторная загрузка того же файла только перезаписывает те же суммы.
+MERGE_PAYMENTS_SQL = f"""
+WITH payments AS ({PAYMENTS_SQL}),
+updated AS (
+    UPDATE core_accountpayment payment
+    SET amount = payments.amount, user_id = %(user_id)s
+    FROM payments
+    WHERE payment.account_id = payments.account_id AND payment.date = payments.date
+    RETURNING payment.account_id, payment.date
+)
+INSERT INTO core_accountpayment (user_id, account_id, date, amount, created_at)
+SELECT %(user_id)s, payments.account_id, payments.date, payments.amount, now()
+FROM payments
+WHERE NOT EXISTS (
+    SELECT 1 FROM updated WHERE updated.account_id = payments.account_id AND updated.date = payments.date
+)
+"""
+
+# Менеджер на дату и первая кампания аккаунта так же, как Account.get_manager_on_date и get_all_campaigns().first()
+UPSERT_PAYMENT_STATS_SQL = f"""
+INSERT INTO core_useraccountdaystat (
+    date, account_id, user_id, campaign_id, clicks, visits, revenue, leads, cost, spend, funds, payment, profit
+)
+SELECT
+    payments.date,
+    payments.account_id,
+    CASE WHEN account_log.found THEN account_log.manager_id ELSE account.manager_id END,
+    COALESCE(
+        account.campaign_id,
+        (SELECT MIN(adaccount.campaign_id) FROM core_adaccount adaccount WHERE adaccount.account_id = account.id)
+    ),
+    0, 0, 0, 0, 0, 0, 0, payments.amount, 0
+FROM ({PAYMENTS_SQL}) payments
+JOIN core_account account ON account.id = payments.account_id
+LEFT JOIN LATERAL (
+    SELECT TRUE AS found, log.manager_id
+    FROM core_accountlog log
+    WHERE log.account_id = payments.account_id
+        AND log.log_type = %(account_manager_log)s
+        AND (log.start_at AT TIME ZONE %(tz)s)::date <= payments.date
+        AND (log.end_at IS NULL OR (log.end_at AT TIME ZONE %(tz)s)::date >= payments.date)
+    ORDER BY log.start_at DESC, log.id DESC
+    LIMIT 1
+) account_log ON TRUE
+ON CONFLICT (
+    date,
+    COALESCE(account_id, -1),
+    COALESCE(user_id, -1),
+    COALESCE(campaign_id, -1)
+)
+DO UPDATE SET payment = EXCLUDED.payment
+"""
+
+UPDATE_TOTAL_PAID_SQL = """
+UPDATE core_account SET total_paid = totals.total_paid
+FROM (
+    SELECT account_id, SUM(amount) AS total_paid
+    FROM core_accountpayment
+    WHERE account_id IN (SELECT DISTINCT account_id FROM {staging})
+    GROUP BY account_id
+) totals
+WHERE core_account.id = totals.account_id
+"""
+
+
+class PaymentsImporter:
+    """
+    Импорт платежей из csv (account_id, date, amount): строки валидируются пачками и через COPY пишутся
+    в staging таблицу, аккаунты проверяются джойном, платежи и payment в UserAccountDayStat пишутся
+    по запросу на таблицу, total_paid пересчитывается один раз на аккаунт.
+    Ошибки по строкам пишутся в ProcessCSVTask.errors.
+    """
+
+    def __init__(self, import_task: ProcessCSVTask, chunk_size: int = PAYMENTS_IMPORT_CHUNK_SIZE):
+        self.import_task = import_task
+        self.chunk_size = chunk_size
+        self.staging = f'core_paymentimport_{import_task.id}'
+        self.errors: List[Dict[str, Any]] = []
+        self.processed_rows = 0
+        self.rejected_rows = 0
+        self.imported_rows = 0
+        self.total_accounts = 0
+        self.total_paid = Decimal('0.00')
+
+    def add_error(self, row_num: int, error: str) -> None:
+        self.rejected_rows += 1
+        if len(self.errors) < PAYMENTS_IMPORT_MAX_ERRORS:
+            self.errors.append({'row': row_num, 'error': error})
+
+    def read_chunks(self, f) -> Iterator[List[Dict[str, str]]]:
+        chunk = []
+        for line in csv.DictReader(f, delimiter=','):
+            chunk.append(line)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def parse_line(self, line: Dict[str, str]) -> Tuple[int, datetime.date, Decimal]:
+        try:
+            account_id = int(line.get('account_id') or '')
+        except ValueError:
+            raise ValueError(f'Invalid account_id {line.get("account_id")!r}')
+        try:
+            date = parse(line.get('date') or '', dayfirst=True).date()
+        except (ValueError, OverflowError):
+            raise ValueError(f'Invalid date {line.get("date")!r}')
+        try:
+            amount = Decimal(line.get('amount') or '').quantize(Decimal('0.01'))
+        except InvalidOperation:
+            raise ValueError(f'Invalid amount {line.get("amount")!r}')
+        if not amount.is_finite() or abs(amount) > MAX_AMOUNT:
+            raise ValueError(f'Invalid amount {line.get("amount")!r}')
+        return account_id, date, amount
+
+    def prepare_chunk(self, lines: List[Dict[str, str]]) -> List[List[Any]]:
+        rows = []
+        for i, line in enumerate(lines):
+            row_num = self.processed_rows + i + 1
+            try:
+                rows.append([row_num, *self.parse_line(line)])
+            except ValueError as e:
+                self.add_error(row_num, str(e))
+        return rows
+
+    def copy_rows(self, cursor, rows: List[List[Any]]) -> None:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows(rows)
+        buffer.seek(0)
+        cursor.copy_expert(
+            f'COPY {self.staging} (row_num, account_id, date, amount) FROM STDIN WITH (FORMAT csv)', buffer
+        )
+
+    def save_progress(self, errors: Optional[List[Dict[str, Any]]] = None) -> None:
+        values = {
+            'processed_rows': self.processed_rows,
+            'rejected_rows': self.rejected_rows,
+            'imported_rows': self.imported_rows,
+        }
+        if errors is not None:
+            values['errors'] = errors
+        ProcessCSVTask.objects.filter(pk=self.import_task.id).update(**values)
+
+    def run(self) -> None:
+        started = time.monotonic()
+        with connection.cursor() as cursor:
+            # UNLOGGED таблица вместо временной - переживает транзакции pgbouncer между пачками
+            cursor.execute(f'DROP TABLE IF EXISTS {self.staging}')
+            cursor.execute(
+                f"""
+                CREATE UNLOGGED TABLE {self.staging} (
+                    row_num bigint NOT NULL,
+                    account_id bigint NOT NULL,
+                    date date NOT NULL,
+                    amount numeric(10, 2) NOT NULL
+                )
+                """
+            )
+            try:
+                with open(self.import_task.file.path) as f:
+                    for lines in self.read_chunks(f):
+                        rows = self.prepare_chunk(lines)
+                        if rows:
+                            self.copy_rows(cursor, rows)
+                        self.processed_rows += len(lines)
+                        self.save_progress()
+
+                cursor.execute(
+                    f"""
+                    DELETE FROM {self.staging} s
+                    WHERE NOT EXISTS (SELECT 1 FROM core_account account WHERE account.id = s.account_id)
+                    RETURNING s.row_num, s.account_id
+                    """
+                )
+                for row_num, account_id in sorted(cursor.fetchall()):
+                    self.add_error(row_num, f'Account {account_id} not found')
+
+                params = {
+                    'user_id': self.import_task.user_id,
+                    'account_manager_log': AccountLog.MANAGER,
+                    'tz': settings.TIME_ZONE,
+                }
+                with transaction.atomic():
+                    cursor.execute(MERGE_PAYMENTS_SQL.format(staging=self.staging), params)
+                    cursor.execute(UPSERT_PAYMENT_STATS_SQL.format(staging=self.staging), params)
+                    cursor.execute(UPDATE_TOTAL_PAID_SQL.format(staging=self.staging))
+
+                cursor.execute(
+                    f'SELECT COUNT(DISTINCT account_id), COALESCE(SUM(amount), 0), COUNT(*) '
+                    f'FROM ({PAYMENTS_SQL.format(staging=self.staging)}) payments'
+                )
+                self.total_accounts, self.total_paid, self.imported_rows = cursor.fetchone()
+                self.save_progress(errors=sorted(self.errors, key=lambda error: error['row']))
+            finally:
+                cursor.execute(f'DROP TABLE IF EXISTS {self.staging}')
+
+        elapsed = time.monotonic() - started
+        logger.info(
+            f'Payments import {self.import_task.id}: {self.processed_rows} rows in {elapsed:.1f}s, '
+            f'imported {self.imported_rows}, rejected {self.rejected_rows}'
+        )
@@ -0,0 +1,116 @@
+import re
+import time
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Pattern, Sequence, Tuple, Union
+
+from core.models.core import Country
+
+PHONE_CACHE_SIZE = 65536
+
+# Источники лидов, у каждого свои правила чистки (как было в исходных реализациях)
+CSV = 'csv'
+FACEBOOK = 'facebook'
+EXPORT = 'export'
+
+
+class PhoneRules(NamedTuple):
+    # Что вырезается из номера до применения правил префикса
+    strip: Optional[Pattern]
+    # FB сам дописывает 0 после кода страны: +330... -> +33...
+    facebook_zero: bool
+    # Лишний 0 после правильного кода страны
+    trailing_zero: bool
+
+
+RULES = {
+    CSV: PhoneRules(strip=re.compile(r'[ -]'), facebook_zero=False, trailing_zero=True),
+    FACEBOOK: PhoneRules(strip=re.compile(' '), facebook_zero=True, trailing_zero=True),
+    EXPORT: PhoneRules(strip=None, facebook_zero=False, trailing_zero=False),
+}
+
+
+class CountryPhonePrefixes:
+    """
+    Телефонные коды стран из Country.phone_prefix, перечитываются не чаще раза в MAX_AGE секунд
+    """
+
+    MAX_AGE = 300
+
+    def __init__(self):
+        self.prefixes: Optional[Dict[str, str]] = None
+        self.loaded_at = 0.0
+
+    def reload(self) -> None:
+        self.prefixes = dict(Country.objects.filter(phone_prefix__isnull=False).values_list('code', 'phone_prefix'))
+        self.loaded_at = time.monotonic()
+
+    def get(self, country_code: Optional[str]) -> Optional[str]:
+        if self.prefixes is None or time.monotonic() - self.loaded_at > self.MAX_AGE:
+            self.reload()
+        if not country_code:
+            return None
+        return self.prefixes.get(country_code.upper())
+
+
+PHONE_PREFIXES = CountryPhonePrefixes()
+
+
+@lru_cache(maxsize=256)
+def prefix_patterns(prefix: str) -> Tuple[str, str, str, str]:
+    """
+    Начала номера, которые заменяются на код страны: 00CC, 0CC0, код без плюса, код с лишним 0
+    """
+    return f'00{prefix[1:]}', f'0{prefix[1:]}0', prefix[1:], f'{prefix}0'
+
+
+@lru_cache(maxsize=PHONE_CACHE_SIZE)
+def normalize(phone: str, prefix: Optional[str], source: str = CSV) -> str:
+    rules = RULES[source]
+    if rules.strip is not None:
+        phone = rules.strip.sub('', phone)
+    if not phone or not prefix:
+        return phone
+
+    international, local_zero, bare, extra_zero = prefix_patterns(prefix)
+    if rules.facebook_zero and phone.startswith(extra_zero):
+        phone = phone.replace(extra_zero, prefix)
+
+    if not phone.startswith(prefix):
+        if phone.startswith(international) or phone.startswith(local_zero):
+            phone = f'{prefix}{phone[4:]}'
+        elif phone.startswith('+0'):
+            phone = f'{prefix}{phone[2:]}'
+        elif phone.startswith('0') or phone.startswith('1'):
+            phone = f'{prefix}{phone[1:]}'
+        elif phone.startswith(bare):
+            phone = f'+{phone}'
+        elif not phone.startswith('+'):
+            phone = f'{prefix}{phone}'
+    elif rules.trailing_zero and phone.startswith(extra_zero):
+        phone = phone.replace(extra_zero, prefix)
+    return phone
+
+
+def normalize_phone(phone: Optional[str], country_code: Optional[str], source: str = CSV) -> Optional[str]:
+    if phone is None:
+        return None
+    return normalize(phone, PHONE_PREFIXES.get(country_code), source)
+
+
+def normalize_phones(
+    phones: Sequence[Optional[str]],
+    country_codes: Union[Optional[str], Sequence[Optional[str]]],
+    source: str = CSV,
+) -> List[Optional[str]]:
+    """
+    Пачка номеров одним вызовом, country_codes - один код на всю пачку или по коду на номер
+    """
+    if country_codes is None or isinstance(country_codes, str):
+        prefix = PHONE_PREFIXES.get(country_codes)
+        return [normalize(phone, prefix, source) if phone is not None else None for phone in phones]
+
+    prefixes = {code: PHONE_PREFIXES.get(code) for code in set(country_codes)}
+    return [
+        normalize(phone, prefixes[code], source) if phone is not None else None
+        for phone, code in zip(phones, country_codes)
+    ]
@@ -0,0 +1,89 @@
+import datetime
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from redis import Redis
+
+redis = Redis(host='redis', db=0, decode_responses=True)
+
+SNAPSHOTS_PREFIX = 'stat_snapshots'
+
+
+class StatSnapshotStore:
+    """
+    Снапшоты статы с предыдущей загрузки для подсчета дельт.
+    Один hash на дату, поле - id объекта, значение - JSON массив значений в порядке fields
+    (типы те же, что были в старых JSON ключах {namespace}_day_stats_{id}_{date}).
+    Hash живет retention дней с последней записи.
+    """
+
+    def __init__(self, namespace: str, fields: Tuple[str, ...]):
+        self.namespace = namespace
+        self.fields = fields
+
+    @property
+    def retention(self) -> datetime.timedelta:
+        return datetime.timedelta(days=settings.STAT_SNAPSHOTS_RETENTION_DAYS)
+
+    @property
+    def legacy_pattern(self) -> str:
+        return f'{self.namespace}_day_stats_*'
+
+    @property
+    def pattern(self) -> str:
+        return f'{SNAPSHOTS_PREFIX}:{self.namespace}:*'
+
+    def key(self, date: datetime.date) -> str:
+        return f'{SNAPSHOTS_PREFIX}:{self.namespace}:{date}'
+
+    def pack(self, data: Dict[str, Any]) -> str:
+        return json.dumps([data[field] for field in self.fields], cls=DjangoJSONEncoder, separators=(',', ':'))
+
+    def unpack(self, value: Optional[str]) -> Optional[Dict[str, Any]]:
+        if value is None:
+            return None
+        return dict(zip(self.fields, json.loads(value)))
+
+    def get(self, obj_id: int, date: datetime.date) -> Optional[Dict[str, Any]]:
+        return self.unpack(redis.hget(self.key(date), obj_id))
+
+    def get_many(self, date: datetime.date, ids: List[int]) -> Dict[int, Optional[Dict[str, Any]]]:
+        if not ids:
+            return {}
+        return {obj_id: self.unpack(value) for obj_id, value in zip(ids, redis.hmget(self.key(date), ids))}
+
+    def set(self, obj_id: int, date: datetime.date, data: Dict[str, Any]):
+        self.set_many({(obj_id, date): data})
+
+    def set_many(self, snapshots: Dict[Tuple[int, datetime.date], Dict[str, Any]], pipe=None):
+        """
+        Пишет снапшоты одним pipeline, {(id, date): data}
+        """
+        by_date = {}
+        for (obj_id, date), data in snapshots.items():
+            by_date.setdefault(date, {})[obj_id] = self.pack(data)
+
+        execute = pipe is None
+        pipe = pipe if pipe is not None else redis.pipeline(transaction=False)
+        for date, mapping in by_date.items():
+            pipe.hset(self.key(date), mapping=mapping)
+            pipe.expire(self.key(date), self.retention)
+        if execute:
+            pipe.execute()
+
+    def scan_legacy(self) -> Iterable[Tuple[str, int, datetime.date]]:
+        """
+        Старые ключи {namespace}_day_stats_{id}_{date}
+        """
+        prefix = self.legacy_pattern[:-1]
+        for key in redis.scan_iter(match=self.legacy_pattern, count=1000):
+            obj_id, date = key[len(prefix) :].split('_', 1)
+            yield key, int(obj_id), datetime.date.fromisoformat(date)
+
+
+CAMPAIGN_SNAPSHOTS = StatSnapshotStore('campaign', ('leads', 'clicks', 'visits', 'revenue', 'cost', 'profit'))
+ADACCOUNT_SNAPSHOTS = StatSnapshotStore('adaccount', ('clicks', 'spend'))
+SNAPSHOT_STORES = (CAMPAIGN_SNAPSHOTS, ADACCOUNT_SNAPSHOTS)
@@ -0,0 +1,267 @@
+import datetime
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from core.models.core import AccountLog, AdAccountLog, CampaignLog
+
+logger = logging.getLogger(__name__)
+
+# Сырые данные с менеджером на дату так же, как в process_adaccount_stat_v2 и process_campaign_stat:
+# менеджер - последний начавшийся к дате и еще не закрытый интервал из логов, иначе текущий менеджер объекта
+RAW_STATS_SQL = """
+fb AS (
+    SELECT
+        s.date, s.account_id, s.adaccount_id, s.clicks, s.spend,
+        adaccount.account_id AS adaccount_account_id,
+        adaccount.campaign_id AS adaccount_campaign_id,
+        COALESCE(
+            CASE WHEN adaccount_log.found THEN adaccount_log.manager_id ELSE adaccount.manager_id END,
+            account.manager_id
+        ) AS adaccount_user_id,
+        CASE WHEN account_log.found THEN account_log.manager_id ELSE account.manager_id END AS account_user_id
+    FROM core_adaccountdaystat s
+    JOIN core_adaccount adaccount ON adaccount.id = s.adaccount_id
+    JOIN core_account account ON account.id = s.account_id
+    LEFT JOIN LATERAL (
+        SELECT TRUE AS found, log.manager_id
+        FROM core_adaccountlog log
+        WHERE log.adaccount_id = s.adaccount_id
+            AND log.log_type = %(adaccount_manager_log)s
+            AND (log.start_at AT TIME ZONE %(tz)s)::date <= s.date
+            AND (log.end_at IS NULL OR (log.end_at AT TIME ZONE %(tz)s)::date >= s.date)
+        ORDER BY log.start_at DESC, log.id DESC
+        LIMIT 1
+    ) adaccount_log ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT TRUE AS found, log.manager_id
+        FROM core_accountlog log
+        WHERE log.account_id = s.account_id
+            AND log.log_type = %(account_manager_log)s
+            AND (log.start_at AT TIME ZONE %(tz)s)::date <= s.date
+            AND (log.end_at IS NULL OR (log.end_at AT TIME ZONE %(tz)s)::date >= s.date)
+        ORDER BY log.start_at DESC, log.id DESC
+        LIMIT 1
+    ) account_log ON TRUE
+    WHERE s.date BETWEEN %(start)s AND %(end)s
+        AND (%(account_id)s IS NULL OR s.account_id = %(account_id)s OR adaccount.account_id = %(account_id)s)
+),
+tracker AS (
+    SELECT
+        s.date, s.campaign_id, s.clicks, s.visits, s.leads, s.revenue, s.cost, s.profit,
+        CASE WHEN campaign_log.found THEN campaign_log.manager_id ELSE campaign.user_id END AS user_id,
+        first_adaccount.account_id AS adaccount_account_id,
+        COALESCE(first_adaccount.account_id, first_account.id) AS stat_account_id
+    FROM core_campaigndaystat s
+    JOIN core_campaign campaign ON campaign.id = s.campaign_id
+    LEFT JOIN LATERAL (
+        SELECT TRUE AS found, log.manager_id
+        FROM core_campaignlog log
+        WHERE log.campaign_id = s.campaign_id
+            AND log.log_type = %(campaign_manager_log)s
+            AND (log.start_at AT TIME ZONE %(tz)s)::date <= s.date
+            AND (log.end_at IS NULL OR (log.end_at AT TIME ZONE %(tz)s)::date >= s.date)
+        ORDER BY log.start_at DESC, log.id DESC
+        LIMIT 1
+    ) campaign_log ON TRUE
+    -- Как Campaign.get_account()
+    LEFT JOIN LATERAL (
+        SELECT adaccount.account_id FROM core_adaccount adaccount
+        WHERE adaccount.campaign_id = s.campaign_id ORDER BY adaccount.id LIMIT 1
+    ) first_adaccount ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT account.id FROM core_account account
+        WHERE account.campaign_id = s.campaign_id ORDER BY account.created_at DESC LIMIT 1
+    ) first_account ON TRUE
+    WHERE s.date BETWEEN %(start)s AND %(end)s
+)
+"""
+
+# funds и payment в сырых данных нет, их переносим из текущих строк
+USER_ACCOUNT_DAY_STAT_SQL = """
+SELECT
+    date, account_id, user_id, campaign_id,
+    SUM(clicks) AS clicks, SUM(visits) AS visits, SUM(leads) AS leads, SUM(revenue) AS revenue, SUM(cost) AS cost,
+    SUM(spend) AS spend, SUM(funds) AS funds, SUM(payment) AS payment,
+    CASE WHEN SUM(spend) = 0 THEN SUM(revenue) - SUM(cost) ELSE SUM(revenue) - SUM(spend) END AS profit
+FROM (
+    SELECT
+        date, account_id, account_user_id AS user_id, adaccount_campaign_id AS campaign_id,
+        0 AS clicks, 0 AS visits, 0 AS leads, 0 AS revenue, 0 AS cost, spend, 0 AS funds, 0 AS payment
+    FROM fb
+    UNION ALL
+    SELECT date, stat_account_id, user_id, campaign_id, clicks, visits, leads, revenue, cost, 0, 0, 0
+    FROM tracker
+    UNION ALL
+    SELECT date, account_id, user_id, campaign_id, 0, 0, 0, 0, 0, 0, funds, payment
+    FROM existing
+    WHERE funds <> 0 OR payment <> 0
+) stats
+GROUP BY date, account_id, user_id, campaign_id
+"""
+
+USER_DAY_STAT_SQL = """
+SELECT
+    date, account_id, adaccount_id, user_id, campaign_id,
+    SUM(clicks) AS clicks, SUM(visits) AS visits, SUM(leads) AS leads, SUM(revenue) AS revenue, SUM(cost) AS cost,
+    SUM(spend) AS spend, SUM(funds) AS funds, SUM(payment) AS payment,
+    CASE WHEN SUM(spend) = 0 THEN SUM(revenue) - SUM(cost) ELSE SUM(revenue) - SUM(spend) END AS profit
+FROM (
+    SELECT
+        date, adaccount_account_id AS account_id, adaccount_id, adaccount_user_id AS user_id,
+        NULL::integer AS campaign_id,
+        0 AS clicks, 0 AS visits, 0 AS leads, 0 AS revenue, 0 AS cost, spend, 0 AS funds, 0 AS payment
+    FROM fb
+    UNION ALL
+    SELECT date, adaccount_account_id, NULL, user_id, campaign_id, clicks, visits, leads, revenue, cost, 0, 0, 0
+    FROM tracker
+    UNION ALL
+    SELECT date, account_id, adaccount_id, user_id, campaign_id, 0, 0, 0, 0, 0, 0, funds, payment
+    FROM existing
+    WHERE funds <> 0 OR payment <> 0
+) stats
+GROUP BY date, account_id, adaccount_id, user_id, campaign_id
+"""
+
+USER_ADACCOUNT_DAY_STAT_SQL = """
+SELECT date, account_id, adaccount_id, adaccount_user_id AS user_id, SUM(clicks) AS clicks, SUM(spend) AS spend
+FROM fb
+GROUP BY date, account_id, adaccount_id, adaccount_user_id
+"""
+
+USER_CAMPAIGN_DAY_STAT_SQL = """
+SELECT
+    date, campaign_id, user_id,
+    SUM(clicks) AS clicks, SUM(visits) AS visits, SUM(leads) AS leads,
+    SUM(revenue) AS revenue, SUM(cost) AS cost, SUM(profit) AS profit
+FROM tracker
+GROUP BY date, campaign_id, user_id
+"""
+
+ACCOUNT_MEASURES = ('clicks', 'visits', 'leads', 'revenue', 'cost', 'spend', 'funds', 'payment', 'profit')
+
+# таблица: (ключ, значения, ожидаемые строки)
+REBUILD_TABLES: Dict[str, Tuple[Tuple[str, ...], Tuple[str, ...], str]] = {
+    'core_useradaccountdaystat': (
+        ('date', 'account_id', 'adaccount_id', 'user_id'),
+        ('clicks', 'spend'),
+        USER_ADACCOUNT_DAY_STAT_SQL,
+    ),
+    'core_usercampaigndaystat': (
+        ('date', 'campaign_id', 'user_id'),
+        ('clicks', 'visits', 'leads', 'revenue', 'cost', 'profit'),
+        USER_CAMPAIGN_DAY_STAT_SQL,
+    ),
+    'core_useraccountdaystat': (
+        ('date', 'account_id', 'user_id', 'campaign_id'),
+        ACCOUNT_MEASURES,
+        USER_ACCOUNT_DAY_STAT_SQL,
+    ),
+    'core_userdaystat': (
+        ('date', 'account_id', 'adaccount_id', 'user_id', 'campaign_id'),
+        ACCOUNT_MEASURES,
+        USER_DAY_STAT_SQL,
+    ),
+}
+
+
+def get_scope(keys: Tuple[str, ...], account_id: Optional[int], user_id: Optional[int]) -> Optional[str]:
+    """
+    Условие на строки таблицы. None - таблица в этот скоуп не входит
+    """
+    scope = ''
+    if account_id is not None:
+        if 'account_id' not in keys:
+            return None
+        scope += ' AND account_id = %(account_id)s'
+    if user_id is not None:
+        scope += ' AND user_id = %(user_id)s'
+    return scope
+
+
+def rebuild_table(
+    cursor, table: str, params: Dict[str, Any], account_id: Optional[int], user_id: Optional[int], dry_run: bool
+) -> Optional[Dict[str, Any]]:
+    keys, measures, expected_sql = REBUILD_TABLES[table]
+    scope = get_scope(keys, account_id, user_id)
+    if scope is None:
+        return None
+
+    existing_sql = f'SELECT * FROM {table} WHERE date BETWEEN %(start)s AND %(end)s{scope}'
+    nonzero = ' OR '.join(f'{measure} <> 0' for measure in measures)
+    cursor.execute(
+        f"""
+        CREATE TEMP TABLE {table}_rebuild ON COMMIT DROP AS
+        WITH {RAW_STATS_SQL}, existing AS ({existing_sql})
+        SELECT * FROM ({expected_sql}) expected WHERE ({nonzero}){scope}
+        """,
+        params,
+    )
+
+    key_join = ' AND '.join(
+        f'new.{key} = old.{key}' if key == 'date' else f'COALESCE(new.{key}, -1) = COALESCE(old.{key}, -1)'
+        for key in keys
+    )
+    changed = ' OR '.join(f'new.{measure} <> old.{measure}' for measure in measures)
+    cursor.execute(
+        f"""
+        SELECT
+            COUNT(*) FILTER (WHERE old.date IS NULL),
+            COUNT(*) FILTER (WHERE new.date IS NULL),
+            COUNT(*) FILTER (WHERE new.date IS NOT NULL AND old.date IS NOT NULL AND ({changed})),
+            {', '.join(f'SUM(COALESCE(new.{m}, 0) - COALESCE(old.{m}, 0))' for m in measures)}
+        FROM {table}_rebuild new
+        FULL JOIN (
+            SELECT {', '.join(keys)}, {', '.join(f'SUM({m}) AS {m}' for m in measures)}
+            FROM ({existing_sql}) existing
+            GROUP BY {', '.join(keys)}
+        ) old ON {key_join}
+        """,
+        params,
+    )
+    row = cursor.fetchone()
+    result = {'added': row[0], 'removed': row[1], 'changed': row[2], 'diff': dict(zip(measures, row[3:]))}
+
+    if not dry_run:
+        cursor.execute(f'DELETE FROM {table} WHERE date BETWEEN %(start)s AND %(end)s{scope}', params)
+        result['deleted'] = cursor.rowcount
+        columns = ', '.join(keys + measures)
+        cursor.execute(f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {table}_rebuild', params)
+        result['inserted'] = cursor.rowcount
+    cursor.execute(f'DROP TABLE {table}_rebuild')
+    return result
+
+
+def rebuild_user_stats(
+    start: datetime.date,
+    end: datetime.date,
+    account_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    dry_run: bool = False,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Пересчитывает User*DayStat за период из сырых AdAccountDayStat/CampaignDayStat и логов менеджеров.
+    Скоуп по аккаунту/юзеру ограничивает заменяемые строки, UserCampaignDayStat без аккаунта в скоуп аккаунта
+    не входит. Корректировки спенда вне сырых данных (set_total_spend_stats) не сохраняются.
+    dry_run - только разница с текущими строками.
+    """
+    params = {
+        'start': start,
+        'end': end,
+        'tz': settings.TIME_ZONE,
+        'account_id': account_id,
+        'user_id': user_id,
+        'account_manager_log': AccountLog.MANAGER,
+        'adaccount_manager_log': AdAccountLog.MANAGER,
+        'campaign_manager_log': CampaignLog.MANAGER,
+    }
+    results = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        for table in REBUILD_TABLES:
+            result = rebuild_table(cursor, table, params, account_id, user_id, dry_run)
+            if result is not None:
+                results[table] = result
+                logger.info(f'Rebuild {table} {start} - {end}: {result}')
+    return results
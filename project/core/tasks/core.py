@@ -5,7 +5,7 @@ import logging
 import random
 import time
 from decimal import Decimal
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 from django.conf import settings
 from django.db import transaction
@@ -22,6 +22,7 @@ from haproxystats import HAProxyServer
 from redis import Redis
 from requests.exceptions import HTTPError
 
+from core import fanout
 from core.models.contacts import UserEmail
 from core.models.core import (
     Account,
@@ -329,12 +330,14 @@ def share_mla_profile(self, account_id: int, shareto_id: int, proxy_data: Dict[s
 
 
 @app.task
-def recalc_cards_spends() -> None:
-    for adaccount_card in AdAccountCreditCard.objects.all():
-        with transaction.atomic():
-            adaccount_card.recalc_spends()
-            if adaccount_card.card:
-                adaccount_card.card.recalc_spends()
+def recalc_cards_spends(adaccount_id: Optional[int] = None) -> None:
+    """
+    Суммы по транзакциям для всех карт (или карт одного рекламного аккаунта) - два запроса вместо 4 на карту
+    """
+    with transaction.atomic():
+        adaccount_cards = AdAccountCreditCard.bulk_recalc_spends(adaccount_id=adaccount_id)
+        cards = Card.bulk_recalc_spends(adaccount_id=adaccount_id)
+    logger.info(f'Recalc cards spends: {adaccount_cards} adaccount cards, {cards} cards updated')
 
 
 @app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3, 'countdown': 600})
@@ -438,6 +441,14 @@ def process_csv_file(task_id: int):
     getattr(helpers, f'import_{import_task.type}_csv')(import_task)
 
 
+@app.task
+def fanout_item_done_task(*args, run_id: str, failed: bool = False) -> None:
+    """
+    link/link_error задач fan_out: args - результат задачи или (request, exc, traceback) при ошибке
+    """
+    fanout.item_done(run_id, failed)
+
+
 @app.task
 def proxy_check():
     haproxy = HAProxyServer(
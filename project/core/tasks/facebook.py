@@ -23,6 +23,8 @@ from redis import Redis
 
 from project.celery_app import app
 
+from ..fanout import fan_out
+from ..fb_governor import init_fb_api
 from ..models.core import (
     Account,
     AdAccount,
@@ -54,6 +56,7 @@ from .helpers import (
     process_ad_comments,
     process_adaccount_stat,
 )
+from .stats import reconcile_account_spends_task
 
 redis = Redis(host='redis', db=0, decode_responses=True)
 logger = logging.getLogger('celery.task')
@@ -64,6 +67,20 @@ FacebookAdsApi.HTTP_DEFAULT_HEADERS = {
 }
 
 
+def fan_out_accounts(name: str, task: Task, account_id: int = None, args: List[Any] = None, **kwargs) -> None:
+    """
+    Ставит task(account_id, *args) по всем живым аккам одним fan_out, список акков - одним запросом
+    """
+    accounts = Account.objects.filter(fb_access_token__isnull=False).exclude(
+        Q(status__in=[Account.LOGOUT, Account.BANNED]) | Q(fb_access_token='')
+    )
+    if account_id is not None:
+        accounts = accounts.filter(id=account_id)
+        name = f'{name}_{account_id}'
+    account_ids = accounts.order_by('id').values_list('id', flat=True)
+    fan_out(name, task.name, ([pk, *(args or [])] for pk in account_ids), **kwargs)
+
+
 @app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 5, 'countdown': 2})
 def load_account_fb_data(self, account_id: int) -> None:
     get_fb_pages.delay(account_id=account_id)
@@ -79,23 +96,7 @@ def load_account_businesses_task(self, account_id: int):
 
 @app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 5, 'countdown': 2})
 def get_fb_businesses(self, account_id: int = None) -> None:
-    accounts = Account.objects.filter(fb_access_token__isnull=False).exclude(
-        Q(status__in=[Account.LOGOUT, Account.BANNED]) | Q(fb_access_token='')
-    )
-    if account_id is not None:
-        accounts = accounts.filter(id=account_id)
-
-    for account in accounts:
-        load_account_businesses_task.delay(account.id)
-        # Делаем небольшую паузу, чтобы разгрузить RabbitMQ
-        time.sleep(0.1)
-        # load_account_businesses_task(account.id)
-        # pool.spawn(func_attempts, load_account_businesses, account).link_exception(exception_callback)
-        # try:
-        #     func_attempts(load_account_businesses, account)
-        # # pool.join()
-        # except Exception as e:
-        #     logger.error(e, exc_info=True)
+    fan_out_accounts('fb_businesses', load_account_businesses_task, account_id)
 
 
 @app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 5, 'countdown': 1})
@@ -150,8 +151,6 @@ def check_ad_comments(account_id: int = None) -> None:
         for page in account.fbpage_set.filter(is_published=True, deleted_at__isnull=True):
             if not cache.get(f'comments_blocked_{account.id}_{page.id}'):
                 check_account_page_comments.delay(account.id, page.id)
-                # Делаем небольшую паузу, чтобы разгрузить RabbitMQ
-                time.sleep(0.2)
         #     try:
         #         func_attempts(process_ad_comments, account, page)
         #     except Exception as e:
@@ -167,14 +166,7 @@ def check_account_page_comments(self, account_id, page_id) -> None:
 
 @app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 1, 'countdown': 5})
 def get_fb_ads_task(self, account_id: int = None) -> None:
-    accounts = Account.objects.filter(fb_access_token__isnull=False).exclude(
-        Q(status__in=[Account.LOGOUT, Account.BANNED]) | Q(fb_access_token='')
-    )
-    if account_id is not None:
-        accounts = accounts.filter(id=account_id)
-
-    for account in accounts:
-        get_accounts_ads_task.delay(account.id)
+    fan_out_accounts('fb_ads', get_accounts_ads_task, account_id)
 
 
 @app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 1, 'countdown': 5})
@@ -185,14 +177,7 @@ def get_accounts_ads_task(self, account_id: int = None) -> None:
 
 @app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 1, 'countdown': 5})
 def get_fb_adaccounts_task(self, account_id: int = None) -> None:
-    accounts = Account.objects.filter(fb_access_token__isnull=False).exclude(
-        Q(status__in=[Account.LOGOUT, Account.BANNED]) | Q(fb_access_token='')
-    )
-    if account_id is not None:
-        accounts = accounts.filter(id=account_id)
-
-    for account in accounts:
-        get_account_adaccounts_task.delay(account.id)
+    fan_out_accounts('fb_adaccounts', get_account_adaccounts_task, account_id)
 
 
 @app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 1, 'countdown': 5})
@@ -202,28 +187,17 @@ def get_account_adaccounts_task(self, account_id):
 
 
 @app.task
-def get_fb_day_stats_task(account_id: int = None, days: int = 1) -> None:
-    accounts = Account.objects.filter(fb_access_token__isnull=False).exclude(
-        Q(status__in=[Account.LOGOUT, Account.BANNED]) | Q(fb_access_token='')
+def get_fb_day_stats_task(account_id: int = None, days: int = 1, reconcile: bool = False) -> None:
+    """
+    reconcile - после загрузки всех акков сверить Account.fb_spends (для перезагрузки за несколько дней)
+    """
+    fan_out_accounts(
+        'fb_day_stats',
+        get_fb_account_day_stats_task,
+        account_id,
+        args=[days],
+        callback=reconcile_account_spends_task.si() if reconcile else None,
     )
-    if account_id is not None:
-        accounts = accounts.filter(id=account_id)
-
-    # range_start = timezone.now().date() - datetime.timedelta(days=days)
-    # range_end = timezone.now().date()
-
-    for account in accounts:
-        get_fb_account_day_stats_task.delay(account.id, days)
-        # Делаем небольшую паузу, чтобы разгрузить RabbitMQ
-        time.sleep(0.1)
-        # if range_start < account.created_at.date():
-        #     range_start = account.created_at.date()
-        # try:
-        #     load_account_day_stats(account, range_start, range_end)
-        #     # Пересчитываем стату
-        #     account.recalc_spends()
-        # except Exception as e:
-        #     logger.error(e, exc_info=True)
 
 
 @app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3, 'countdown': 5})
@@ -256,7 +230,7 @@ def reload_account_fb_stats_task(self, account_id, days) -> None:
         if range_start < account.created_at.date():
             range_start = account.created_at.date()
 
-        FacebookAdsApi.init(access_token=account.fb_access_token, proxies=account.proxy_config)
+        init_fb_api(account)
         adaccounts = AdAccount.objects.filter(account=account)
         for adaccount_obj in adaccounts:
             try:
@@ -295,7 +269,7 @@ def clear_account_stats_task(self, account_id) -> None:
     UserAccountDayStat.objects.filter(account=account).delete()
     UserCampaignDayStat.objects.filter(campaign__in=campaigns).delete()
     # Пересчитываем стату
-    account.recalc_spends()
+    account.recalc_spends(full=True)
 
 
 @app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 5, 'countdown': 2})
@@ -311,22 +285,7 @@ def load_account_payment_methods_task(self, account_id: int):
 
 @app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 5, 'countdown': 2})
 def load_payment_methods(self, account_id: int = None) -> None:
-    accounts = Account.objects.filter(fb_access_token__isnull=False).exclude(
-        Q(status__in=[Account.LOGOUT, Account.BANNED]) | Q(fb_access_token='')
-    )
-    if account_id is not None:
-        accounts = accounts.filter(id=account_id)
-    # pool = Pool(20)
-    for account in accounts:
-        load_account_payment_methods_task.delay(account.id)
-        time.sleep(0.1)
-
-        # try:
-        #     # pool.spawn(func_attempts, load_account_payment_methods, account).link_exception(exception_callback)
-        #     func_attempts(load_account_payment_methods, account)
-        # #     pool.join()
-        # except Exception as e:
-        #     logger.error(e, exc_info=True)
+    fan_out_accounts('fb_payment_methods', load_account_payment_methods_task, account_id)
 
 
 @app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 5, 'countdown': 2})
@@ -342,22 +301,7 @@ def load_account_transactions_task(self, account_id: int):
 
 @app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 5, 'countdown': 2})
 def load_bills(self, account_id: int = None) -> None:
-    accounts = Account.objects.filter(fb_access_token__isnull=False).exclude(
-        Q(status__in=[Account.LOGOUT, Account.BANNED]) | Q(fb_access_token='')
-    )
-    if account_id is not None:
-        accounts = accounts.filter(id=account_id)
-
-    # pool = Pool(20)
-    for account in accounts:
-        load_account_transactions_task.delay(account.id)
-        time.sleep(0.1)
-        # pool.spawn(func_attempts, load_account_transactions, account).link_exception(exception_callback)
-        # try:
-        #     func_attempts(load_account_transactions, account)
-        # # pool.join()
-        # except Exception as e:
-        #     logger.error(e, exc_info=True)
+    fan_out_accounts('fb_bills', load_account_transactions_task, account_id)
 
 
 @app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 5, 'countdown': 2})
@@ -387,7 +331,9 @@ def load_fb_leads(self, page_leadgen_id: int = None, is_full=False):
         try:
             if leadgen.last_load is not None and not is_full:
                 since = int(leadgen.last_load.timestamp())
-            func_attempts(load_leadgen_leads, leadgen, since)
+            created, updated = func_attempts(load_leadgen_leads, leadgen, since)
+            if created or updated:
+                logger.info(f'Leadgen {leadgen.id}: {created} leads created, {updated} updated')
         except Exception as e:
             print(e)
             logger.error(e, exc_info=True)
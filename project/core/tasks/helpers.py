@@ -4,16 +4,19 @@ import json
 import logging
 import os
 import random
+import time
 from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from decimal import Decimal
+from itertools import islice
 from pathlib import Path
-from typing import Any, Dict, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from django.conf import settings
 from django.core.cache import cache
-from django.core.serializers.json import DjangoJSONEncoder
 from django.db import transaction
-from django.db.models.aggregates import Sum
+from django.db.models import OuterRef, QuerySet, Subquery
+from django.db.models.functions import Coalesce
 from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.text import capfirst, slugify
@@ -30,17 +33,15 @@ from facebook_business.adobjects.user import User as FBUser
 from facebook_business.exceptions import FacebookRequestError
 from faker import Faker
 from redis import Redis
+from requests.adapters import HTTPAdapter
 from unidecode import unidecode
 
-from api.v1.serializers.leads import LeadgenLeadValidateSerializer
 from core.models.core import (
     Account,
-    AccountPayment,
     Ad,
     AdAccount,
     AdAccountCreditCard,
     AdAccountDayStat,
-    AdAccountTransaction,
     BusinessManager,
     BusinessShareUrl,
     Campaign,
@@ -51,6 +52,7 @@ from core.models.core import (
     LeadgenLead,
     Link,
     LinkGroup,
+    ManagerTimeline,
     Notification,
     ShortifyDomain,
     User,
@@ -59,6 +61,13 @@ from core.models.core import (
     UserCampaignDayStat,
     UserDayStat,
 )
+from core.fb_governor import init_fb_api
+from core.leads_import import LeadsImporter
+from core.metrics import record_metrics
+from core.payments_import import PaymentsImporter
+from core.phone_normalizer import FACEBOOK, normalize_phones
+from core.snapshots import ADACCOUNT_SNAPSHOTS, CAMPAIGN_SNAPSHOTS, StatSnapshotStore
+from core.transactions_sync import TransactionsSync
 from core.utils import func_attempts
 from XCardAPI.api import XCardAPI
 
@@ -96,33 +105,65 @@ FB_LEADGEN_FIELD_MAP = {
 
 FB_LEADGEN_GENDER_MAP = {'male': 1, 'female': 0, 'männlich': 1, 'weiblich': 0}
 
-# Маппинг стран-кодов телефонов, которые фб неправильно добавляет
-FB_COUNTRY_PHONE_MAP = {
-    'FR': '+330',
-    'IT': '+390',
-    'DK': '+450',
-    'BE': '+320',
-    'CZ': '+420',
-    'GB': '+440',
-    'ES': '+340',
-    'SE': '+460',
-    'US': '+10',
-    'FI': '+3580',
-    'PT': '+3510',
-}
-COUNTRY_PHONE = {
-    'FR': '+33',
-    'IT': '+39',
-    'DK': '+45',
-    'BE': '+32',
-    'ES': '+34',
-    'GB': '+44',
-    'SE': '+46',
-    'FI': '+358',
-    'CZ': '+420',
-    'US': '+1',
-    'PT': '+351',
-}
+
+class StatDeltaBuffer:
+    """
+    Копит дельты статы и пишет их одним bulk_upsert на таблицу.
+    Снапшоты для redis пишутся только после записи дельт, чтобы при падении не потерять разницу.
+    """
+
+    MODELS = (CampaignDayStat, UserAdAccountDayStat, UserCampaignDayStat, UserAccountDayStat, UserDayStat)
+
+    def __init__(self):
+        self.rows = defaultdict(list)
+        # (store, id, date) -> снапшот
+        self.snapshots: Dict[Tuple[StatSnapshotStore, int, datetime.date], Dict[str, Any]] = {}
+        self.prefetched: Dict[Tuple[StatSnapshotStore, int, datetime.date], Optional[Dict[str, Any]]] = {}
+
+    def __len__(self):
+        return sum(len(rows) for rows in self.rows.values())
+
+    def add(self, model, **row):
+        self.rows[model].append(row)
+
+    def prefetch_snapshots(self, store: StatSnapshotStore, date: datetime.date, ids: List[int]):
+        """
+        Читает снапшоты страницы одним HMGET
+        """
+        ids = [obj_id for obj_id in dict.fromkeys(ids) if (store, obj_id, date) not in self.prefetched]
+        for obj_id, data in store.get_many(date, ids).items():
+            self.prefetched[(store, obj_id, date)] = data
+
+    def get_snapshot(self, store: StatSnapshotStore, obj_id: int, date: datetime.date) -> Optional[Dict[str, Any]]:
+        key = (store, obj_id, date)
+        if key in self.snapshots:
+            return self.snapshots[key]
+        if key in self.prefetched:
+            return self.prefetched[key]
+        return store.get(obj_id, date)
+
+    def set_snapshot(self, store: StatSnapshotStore, obj_id: int, date: datetime.date, data: Dict[str, Any]):
+        self.snapshots[(store, obj_id, date)] = data
+
+    @staticmethod
+    def write_snapshots(snapshots: Dict[Tuple[StatSnapshotStore, int, datetime.date], Dict[str, Any]]):
+        by_store = defaultdict(dict)
+        for (store, obj_id, date), data in snapshots.items():
+            by_store[store][(obj_id, date)] = data
+        pipe = redis.pipeline(transaction=False)
+        for store, store_snapshots in by_store.items():
+            store.set_many(store_snapshots, pipe=pipe)
+        pipe.execute()
+
+    def flush(self):
+        with transaction.atomic():
+            for model in self.MODELS:
+                rows = self.rows.pop(model, None)
+                if rows:
+                    model.bulk_upsert(rows)
+            if self.snapshots:
+                snapshots, self.snapshots = self.snapshots, {}
+                transaction.on_commit(lambda: self.write_snapshots(snapshots))
 
 
 def fb_login(session, email, password):
@@ -211,7 +252,7 @@ def load_account_adaccounts(account):
     try:
         crm_adaccounts = account.adaccounts.filter(deleted_at__isnull=True)
 
-        FacebookAdsApi.init(access_token=account.fb_access_token, proxies=account.proxy_config)
+        init_fb_api(account)
         user = FBUser(fbid='me')
         adaccounts = user.get_ad_accounts(
             fields=[
@@ -231,9 +272,16 @@ def load_account_adaccounts(account):
                 'adspaymentcycle{threshold_amount}',
             ]
         )
+        adaccounts = list(adaccounts)
+        # Все БМы рекламных аккаунтов одним запросом
+        business_ids = {int(adaccount['business']['id']) for adaccount in adaccounts if adaccount.get('business')}
+        businesses = dict(
+            BusinessManager.objects.filter(business_id__in=business_ids).values_list('business_id', 'id')
+        )
+
         fb_adaccounts = []
+        adaccounts_data = []
         for adaccount in adaccounts:
-            # print(adaccount)
             fb_adaccounts.append(int(adaccount['account_id']))
 
             if adaccount['age']:
@@ -243,12 +291,11 @@ def load_account_adaccounts(account):
                 created_at = timezone.now()
 
             pixels = adaccount.get('adspixels', {}).get('data')
-            business: Optional[BusinessManager] = None
+            business_id: Optional[int] = None
             if adaccount.get('business'):
-                business = BusinessManager.objects.filter(business_id=adaccount['business']['id']).first()
-                if not business:
+                business_id = businesses.get(int(adaccount['business']['id']))
+                if business_id is None:
                     continue
-            # не через update_or_create и подобное, потому что недостаточно контроля
             payment_cycle = None
             if 'adspaymentcycle' in adaccount:
                 payment_cycle = Decimal(adaccount['adspaymentcycle']['data'][0]['threshold_amount']) / Decimal('100')
@@ -269,16 +316,14 @@ def load_account_adaccounts(account):
                 'currency': adaccount['currency'],
                 'timezone_name': adaccount['timezone_name'],
                 'timezone_offset_hours_utc': adaccount['timezone_offset_hours_utc'],
+                'created_at': created_at,
             }
+            if business_id is not None:
+                adaccount_data['business_id'] = business_id
+            adaccounts_data.append(adaccount_data)
 
-            if business is not None:
-                adaccount_data['business_id'] = business.id
-            try:
-                adaccount_obj = AdAccount.objects.get(adaccount_id=int(adaccount['account_id']))
-                adaccount_data['deleted_at'] = None
-                AdAccount.update(pk=adaccount_obj.id, action_verb='updated adaccount', **adaccount_data)
-            except AdAccount.DoesNotExist:
-                AdAccount.create(created_at=created_at, **adaccount_data)
+        created, updated = AdAccount.bulk_reconcile(account, adaccounts_data)
+        logger.info(f'Account {account.id} adaccounts: {created} created, {updated} updated')
 
         removed_adaccounts = crm_adaccounts.exclude(adaccount_id__in=fb_adaccounts)
         if removed_adaccounts.exists():
@@ -305,7 +350,9 @@ def load_account_adaccounts(account):
 
 
 def load_account_ads(account):
-    FacebookAdsApi.init(access_token=account.fb_access_token, proxies=account.proxy_config, api_version='v9.0')
+    init_fb_api(account, api_version='v9.0')
+    started = time.monotonic()
+    inserted_total, updated_total, unchanged_total = 0, 0, 0
     for adaccount_obj in account.adaccounts.filter(status=AdAccount.FB_ACTIVE, deleted_at__isnull=True):
         try:
             adaccount = FBAdAccount(fbid=f'act_{adaccount_obj.adaccount_id}')
@@ -321,17 +368,32 @@ def load_account_ads(account):
                     'creative.fields(effective_object_story_id,object_story_spec)',
                 ]
             }
-            ads = adaccount.get_ads(params=params)
+            ads = list(adaccount.get_ads(params=params))
+            page_ids = {
+                int(ad['creative']['effective_object_story_id'].split('_')[0])
+                for ad in ads
+                if ad.get('creative', {}).get('effective_object_story_id')
+            }
+            # Как FBPage.objects.filter(page_id=...).first() - страница с меньшим id
+            pages: Dict[int, int] = {}
+            for page_pk, page_id in FBPage.objects.filter(page_id__in=page_ids).order_by('-id').values_list(
+                'id', 'page_id'
+            ):
+                pages[page_id] = page_pk
+
+            ads_data = []
             for ad in ads:
                 ad_url = ad.get('creative_link_url')
                 ad_data = {
+                    'ad_id': int(ad['id']),
                     'story_id': ad.get('creative', {}).get('effective_object_story_id'),
                     'name': ad['name'].replace('"', ''),
                     'status': ad['status'],
                     'effective_status': ad['effective_status'],
                     'creative_id': int(ad['creative']['id']),
                     'ad_url': ad_url,
-                    'created_at': ad['created_time'],
+                    # datetime, а не строка - иначе трекер считает created_at измененным при каждой загрузке
+                    'created_at': parse(ad['created_time']),
                 }
 
                 if 'ad_review_feedback' in ad:
@@ -347,22 +409,31 @@ def load_account_ads(account):
                     ad_data['ad_review_feedback_code'] = None
                     ad_data['ad_review_feedback_text'] = None
 
-                if ad.get('creative', {}).get('effective_object_story_id'):
-                    page_id = int(ad['creative']['effective_object_story_id'].split('_')[0])
-                    page = FBPage.objects.filter(page_id=page_id).first()
-                    if page:
-                        ad_data['page_id'] = page.id
-                try:
-                    ad_obj = Ad.objects.get(adaccount=adaccount_obj, ad_id=ad['id'])
-                    Ad.update(pk=ad_obj.id, action_verb='updated ad', **ad_data)
-                except Ad.DoesNotExist:
-                    Ad.create(adaccount=adaccount_obj, ad_id=ad['id'], **ad_data)
+                if ad_data['story_id']:
+                    page_pk = pages.get(int(ad_data['story_id'].split('_')[0]))
+                    if page_pk:
+                        ad_data['page_id'] = page_pk
+                ads_data.append(ad_data)
+
+            created, updated, unchanged = Ad.bulk_sync(adaccount_obj, ads_data)
+            inserted_total += created
+            updated_total += updated
+            unchanged_total += unchanged
 
         except FacebookRequestError as e:
             logger.error(e, exc_info=True)
             if e.api_error_code() == 190:
                 Account.update(pk=account.id, action_verb='cleared token', fb_access_token=None)
 
+    # Отдельный hash на акк: иначе запуски по разным аккам перезаписывают друг друга
+    record_metrics(
+        f'load_account_ads_{account.id}',
+        inserted=inserted_total,
+        updated=updated_total,
+        unchanged=unchanged_total,
+        duration=round(time.monotonic() - started, 2),
+    )
+
 
 def process_ad_comments(account, page):
     graph = facebook.GraphAPI(access_token=page.access_token, version="8.0", proxies=account.proxy_config)
@@ -459,9 +530,7 @@ def process_ad_comments(account, page):
 
 def load_share_urls(business):
     try:
-        FacebookAdsApi.init(
-            access_token=business.account.fb_access_token, proxies=business.account.proxy_config, api_version='v8.0'
-        )
+        init_fb_api(business.account, api_version='v8.0')
         bm = Business(fbid=business.business_id)
         pending_users = bm.get_pending_users(
             fields=['email', 'invite_link', 'status', 'role', 'created_time', 'expiration_time']
@@ -489,7 +558,7 @@ def load_share_urls(business):
 def load_account_businesses(account):
     try:
         crm_businesses = account.businesses.filter(deleted_at__isnull=True)
-        FacebookAdsApi.init(access_token=account.fb_access_token, proxies=account.proxy_config)
+        init_fb_api(account)
         user = FBUser(fbid='me')
 
         businesses = user.get_businesses(fields=['created_time', 'name', 'id', 'can_create_ad_account'])
@@ -550,7 +619,46 @@ def load_account_businesses(account):
         #     logger.error(e, exc_info=True)
 
 
-def load_leadgen_leads(leadgen, since=None):
+def save_leadgen_leads(leadgen, leads, manager_timeline, country, country_code, offer) -> Tuple[int, int]:
+    """
+    Страница лидов из лидформы: телефоны нормализуются пачкой, менеджеры берутся из таймлайна,
+    запись одним LeadgenLead.bulk_upsert
+    """
+    rows = []
+    for lead in leads:
+        data = {}
+        for field in lead['field_data']:
+            data[FB_LEADGEN_FIELD_MAP.get(field['name'], field['name'])] = field['values'][0]
+
+        if 'gender' in data:
+            data['gender'] = FB_LEADGEN_GENDER_MAP.get(data['gender'].lower())
+
+        lead_created_time = parse(lead['created_time']).astimezone(tz=settings.TZ)
+        manager = manager_timeline.get_manager_on_date(leadgen.page.account, lead_created_time.date())
+        rows.append(
+            {
+                'lead_id': lead['id'],
+                'page_id': leadgen.page_id,
+                'account_id': leadgen.page.account_id,
+                'leadgen_id': leadgen.leadgen_id,
+                'user_id': manager.id if manager else None,
+                'leadform_id': lead['form_id'],
+                'created_at': lead_created_time,
+                'raw_data': lead.export_all_data(),
+                'country_id': country.id if country else None,
+                'country_code': country_code,
+                'offer': offer,
+                **{field: data.get(field) for field in LeadgenLead.FORM_FIELDS},
+            }
+        )
+
+    phones = normalize_phones([row['phone'] or None for row in rows], country.code if country else None, FACEBOOK)
+    for row, phone in zip(rows, phones):
+        row['phone'] = phone
+    return LeadgenLead.bulk_upsert(rows)
+
+
+def load_leadgen_leads(leadgen, since=None) -> Tuple[int, int]:
     # int(leadgen.last_load.timestamp())
     try:
         country_code = leadgen.leadgen.name.split('|')[0].strip()
@@ -566,13 +674,10 @@ def load_leadgen_leads(leadgen, since=None):
         country = None
         offer = None
 
+    total_created, total_updated = 0, 0
     if leadgen.page.account.fb_access_token:
         # 9.0 не работает - отдает пустой ответ
-        FacebookAdsApi.init(
-            api_version='v8.0',
-            access_token=leadgen.page.account.fb_access_token,
-            proxies=leadgen.page.account.proxy_config,
-        )
+        init_fb_api(leadgen.page.account, api_version='v8.0')
         form = LeadgenForm(fbid=leadgen.leadform_id)
         last_load = timezone.now()
         if since is not None:
@@ -582,7 +687,6 @@ def load_leadgen_leads(leadgen, since=None):
         else:
             params = {}
         try:
-            print(params)
             leads = form.get_leads(
                 params=params,
                 fields=[
@@ -602,88 +706,24 @@ def load_leadgen_leads(leadgen, since=None):
                     'platform',
                 ],
             )
-            print(leads)
             if leads:
-                for lead in leads:
-                    data = {}
-                    for field in lead['field_data']:
-                        data[FB_LEADGEN_FIELD_MAP.get(field['name'], field['name'])] = field['values'][0]
-
-                    if data.get('phone'):
-                        data['phone'] = data['phone'].replace(' ', '')
-
-                    if 'gender' in data:
-                        data['gender'] = FB_LEADGEN_GENDER_MAP.get(data['gender'].lower())
-
-                    # FB сам дописывает номера телефонов, надо заменить лишнее
-                    fb_country_phone = FB_COUNTRY_PHONE_MAP.get(country_code)
-                    if fb_country_phone:
-                        if data.get('phone', '').startswith(fb_country_phone):
-                            country_phone = COUNTRY_PHONE.get(country_code)
-                            data['phone'] = data['phone'].replace(fb_country_phone, country_phone)
-
-                    if data.get('phone'):
-                        prefix = COUNTRY_PHONE[country.code]
-                        if not data['phone'].startswith(prefix):
-                            if data['phone'].startswith(f'00{prefix[1:]}') or data['phone'].startswith(
-                                f'0{prefix[1:]}0'
-                            ):
-                                data['phone'] = data['phone'][4:]
-                                data['phone'] = f"{prefix}{data['phone']}"
-                            elif data['phone'].startswith('+0'):
-                                data['phone'] = data['phone'][2:]
-                                data['phone'] = f"{prefix}{data['phone']}"
-                            elif data['phone'].startswith('0') or data['phone'].startswith('1'):
-                                data['phone'] = data['phone'][1:]
-                                data['phone'] = f"{prefix}{data['phone']}"
-                            elif data['phone'].startswith(prefix[1:]):
-                                data['phone'] = f"+{data['phone']}"
-                            elif data['phone'].startswith('+'):
-                                pass
-                            else:
-                                data['phone'] = f"{prefix}{data['phone']}"
-                        elif data['phone'].startswith(f'{prefix}0'):
-                            data['phone'] = data['phone'].replace(f'{prefix}0', f'{prefix}')
-
-                    # if data.get('phone', '').startswith('0'):
-                    #     country_phone = COUNTRY_PHONE.get(country_code)
-                    #     data['phone'] = data['phone'].replace(data['phone'][0], country_phone, 1)
-
-                    lead_created_time = parse(lead['created_time']).astimezone(tz=settings.TZ)
-
-                    defaults = {
-                        'created_at': lead_created_time,
-                        'raw_data': lead.export_all_data(),
-                        'country': country,
-                        'country_code': country_code,
-                        'offer': offer,
-                        **data,
-                    }
-                    updated = LeadgenLead.objects.filter(
-                        lead_id=lead['id'],
-                        page=leadgen.page,
-                        account=leadgen.page.account,
-                        leadgen=leadgen.leadgen,
-                        user=leadgen.page.account.get_manager_on_date(lead_created_time.date()),
-                        leadform_id=lead['form_id'],
-                    ).update(**defaults)
-
-                    if not updated:
-                        LeadgenLead.objects.create(
-                            lead_id=lead['id'],
-                            page=leadgen.page,
-                            account=leadgen.page.account,
-                            leadgen=leadgen.leadgen,
-                            user=leadgen.page.account.get_manager_on_date(lead_created_time.date()),
-                            leadform_id=lead['form_id'],
-                            **defaults,
-                        )
+                manager_timeline = ManagerTimeline.for_accounts([leadgen.page.account])
+                # Курсор подгружает страницы сам, пишем пачками по UPSERT_BATCH_SIZE
+                leads = iter(leads)
+                while True:
+                    page = list(islice(leads, LeadgenLead.UPSERT_BATCH_SIZE))
+                    if not page:
+                        break
+                    created, updated = save_leadgen_leads(leadgen, page, manager_timeline, country, country_code, offer)
+                    total_created += created
+                    total_updated += updated
                 leadgen.last_load = last_load
                 leadgen.save(update_fields=['last_load'])
 
         except FacebookRequestError as e:
             if e.api_error_code() == 190:
                 Account.update(pk=leadgen.page.account.id, action_verb='cleared token', fb_access_token=None)
+    return total_created, total_updated
 
 
 def load_account_pages(account):
@@ -694,19 +734,22 @@ def load_account_pages(account):
         fb_pages = []
         if pages and pages.get('accounts'):
             pages_list = pages["accounts"]["data"]
+            pages_data = []
             for page in pages_list:
                 fb_pages.append(page['id'])
-                page_data = {
-                    "access_token": page["access_token"],
-                    "name": page["name"],
-                    'is_published': page['is_published'],
-                    'deleted_at': None,
-                }
-                try:
-                    page_obj = FBPage.objects.get(account=account, page_id=page['id'])
-                    FBPage.update(pk=page_obj.id, action_verb='Page updated', **page_data)
-                except FBPage.DoesNotExist:
-                    FBPage.create(account=account, page_id=page['id'], **page_data)
+                pages_data.append(
+                    {
+                        'page_id': int(page['id']),
+                        "access_token": page["access_token"],
+                        "name": page["name"],
+                        'is_published': page['is_published'],
+                        'deleted_at': None,
+                    }
+                )
+            created, updated, unchanged = FBPage.bulk_sync(account, pages_data)
+            record_metrics(
+                f'load_account_pages_{account.id}', inserted=created, updated=updated, unchanged=unchanged
+            )
 
         removed_pages = crm_pages.exclude(page_id__in=fb_pages)
         if removed_pages.exists():
@@ -717,25 +760,112 @@ def load_account_pages(account):
             Account.update(pk=account.id, action_verb='cleared token', fb_access_token=None)
 
 
+# Graph API принимает не больше 50 запросов в одном batch вызове
+INSIGHTS_BATCH_SIZE = 50
+INSIGHTS_BATCH_RETRIES = 3
+
+
+def load_adaccounts_insights(
+    api: FacebookAdsApi, adaccount_ids: List[str], params: Dict[str, Any]
+) -> Tuple[Dict[str, List[Dict]], Dict[str, FacebookRequestError]]:
+    """
+    Грузит инсайты рекламных аккаунтов batch запросами по INSIGHTS_BATCH_SIZE штук.
+    Следующие страницы каждого аккаунта уходят в следующий batch.
+    Возвращает стату и ошибки по рекламным аккаунтам, аккаунты с ошибкой в стату не попадают.
+    """
+    stats = defaultdict(list)
+    errors = {}
+    # (id рекламного аккаунта, курсор следующей страницы)
+    pending = [(adaccount_id, None) for adaccount_id in adaccount_ids]
+
+    def on_success(adaccount_id):
+        def callback(response):
+            data = response.json()
+            stats[adaccount_id].extend(data.get('data', []))
+            paging = data.get('paging', {})
+            if paging.get('next'):
+                pending.append((adaccount_id, paging['cursors']['after']))
+
+        return callback
+
+    def on_failure(adaccount_id):
+        def callback(response):
+            errors[adaccount_id] = response.error()
+
+        return callback
+
+    while pending:
+        chunk, pending = pending[:INSIGHTS_BATCH_SIZE], pending[INSIGHTS_BATCH_SIZE:]
+        batch = api.new_batch()
+        for adaccount_id, after in chunk:
+            request_params = dict(params, after=after) if after else params
+            batch.add(
+                'GET',
+                f'act_{adaccount_id}/insights',
+                params=request_params,
+                success=on_success(adaccount_id),
+                failure=on_failure(adaccount_id),
+            )
+
+        # execute возвращает batch из запросов, на которые Graph не ответил (таймаут внутри батча)
+        attempts = 0
+        while batch is not None and attempts < INSIGHTS_BATCH_RETRIES:
+            batch = batch.execute()
+            attempts += 1
+        if batch is not None:
+            for adaccount_id, _ in chunk:
+                if adaccount_id not in stats and adaccount_id not in errors:
+                    logger.warning(f'No insights response for adaccount {adaccount_id}')
+
+    for adaccount_id in errors:
+        stats.pop(adaccount_id, None)
+    return stats, errors
+
+
 def load_account_day_stats(account, range_start, range_end, reload=False):
-    FacebookAdsApi.init(access_token=account.fb_access_token, proxies=account.proxy_config)
-    adaccounts = AdAccount.objects.filter(account=account, deleted_at__isnull=True)
+    api = init_fb_api(account)
+    adaccounts = list(AdAccount.objects.filter(account=account, deleted_at__isnull=True))
+    account_timeline = ManagerTimeline.for_accounts([account])
+    adaccount_timeline = ManagerTimeline.for_adaccounts(adaccounts)
+    params = {
+        'time_range': {'since': range_start.strftime('%Y-%m-%d'), 'until': range_end.strftime('%Y-%m-%d')},
+        'limit': 100,
+        'level': 'account',
+        'fields': ['spend', 'clicks'],
+        'time_increment': 1,
+    }
+    try:
+        # Сначала выкачиваем все страницы по всем рекламным аккаунтам, потом пишем дельты пачкой на рекламный аккаунт
+        stats, errors = load_adaccounts_insights(api, [str(obj.adaccount_id) for obj in adaccounts], params)
+    except FacebookRequestError as e:
+        if e.api_error_code() == 190:
+            Account.update(pk=account.id, action_verb='cleared token', fb_access_token=None)
+            return
+        raise
+
+    for adaccount_id, error in errors.items():
+        if error.api_error_code() == 190:
+            Account.update(pk=account.id, action_verb='cleared token', fb_access_token=None)
+            return
+        logger.warning(f'Insights error for adaccount {adaccount_id}: {error.api_error_message()}')
+
     for adaccount_obj in adaccounts:
-        try:
-            adaccount = FBAdAccount(fbid=f'act_{adaccount_obj.adaccount_id}')
-            params = {
-                'time_range': {'since': range_start.strftime('%Y-%m-%d'), 'until': range_end.strftime('%Y-%m-%d')},
-                'limit': 100,
-                'level': 'account',
-                'fields': ['spend', 'clicks'],
-                'time_increment': 1,
-            }
-            stats = adaccount.get_insights(params=params)
-            for stat in stats:
-                process_adaccount_stat_v2(account, adaccount_obj, stat, reload)
-        except FacebookRequestError as e:
-            if e.api_error_code() == 190:
-                Account.update(pk=account.id, action_verb='cleared token', fb_access_token=None)
+        adaccount_stats = stats.get(str(adaccount_obj.adaccount_id))
+        if not adaccount_stats:
+            continue
+        buffer = StatDeltaBuffer()
+        with transaction.atomic():
+            for stat in adaccount_stats:
+                process_adaccount_stat_v2(
+                    account,
+                    adaccount_obj,
+                    stat,
+                    reload,
+                    buffer=buffer,
+                    account_timeline=account_timeline,
+                    adaccount_timeline=adaccount_timeline,
+                )
+            buffer.flush()
 
 
 def create_fan_page(account: Account, data):
@@ -799,7 +929,7 @@ def create_fan_page(account: Account, data):
 
 
 def load_adaccount_payment_methods(adaccount: AdAccount):
-    FacebookAdsApi.init(access_token=adaccount.account.fb_access_token, proxies=adaccount.account.proxy_config)
+    init_fb_api(adaccount.account)
     try:
         fb_adaccount = FBAdAccount(fbid=f'act_{adaccount.adaccount_id}').api_get(
             fields=[
@@ -836,7 +966,7 @@ def load_adaccount_payment_methods(adaccount: AdAccount):
 
 
 def load_account_payment_methods(account):
-    FacebookAdsApi.init(access_token=account.fb_access_token, proxies=account.proxy_config)
+    init_fb_api(account)
     for adaccount_obj in account.adaccounts.filter(deleted_at__isnull=True):
         try:
             adaccount = FBAdAccount(fbid=f'act_{adaccount_obj.adaccount_id}').api_get(
@@ -871,76 +1001,38 @@ def load_account_payment_methods(account):
 
 
 def load_account_transactions(account):
-    FacebookAdsApi.init(access_token=account.fb_access_token, proxies=account.proxy_config)
-    adaccounts = account.adaccounts.filter(deleted_at__isnull=True)
-
-    for adaccount_obj in adaccounts:
-        try:
-            bills_load_at = timezone.now()
-            adaccount = FBAdAccount(fbid=f'act_{adaccount_obj.adaccount_id}')
-            params = {}
-            if adaccount_obj.billed_to is not None:
-                params['time_start'] = adaccount_obj.billed_to
-
-            for fb_transaction in adaccount.get_transactions(params=params):
-                details = adaccount.get_transaction_details(
-                    fields=['metadata'],
-                    params={'transaction_keys': [f'{fb_transaction["id"]}_{fb_transaction["tx_type"]}']},
-                )[0]['metadata']
-                # print(details)
-                adaccount_card = AdAccountCreditCard.objects.filter(
-                    adaccount=adaccount_obj, credential_id=details.get('payment_method_id')
-                ).first()
-                # print(adaccount_card)
-                if adaccount_card:
-                    _, created = AdAccountTransaction.objects.update_or_create(
-                        adaccount=adaccount_obj,
-                        transaction_id=fb_transaction['id'],
-                        defaults={
-                            'adaccount_card': adaccount_card,
-                            'card': adaccount_card.card,
-                            'tx_type': fb_transaction['tx_type'],
-                            'amount': Decimal(fb_transaction['amount']['total_amount_in_hundredths']) / Decimal('100'),
-                            'currency': fb_transaction['amount']['currency'],
-                            'start_at': datetime.datetime.fromtimestamp(
-                                fb_transaction['billing_start_time'], tz=settings.TZ
-                            ),
-                            'end_at': datetime.datetime.fromtimestamp(
-                                fb_transaction['billing_end_time'], tz=settings.TZ
-                            ),
-                            'start_at_ts': fb_transaction['billing_start_time'],
-                            'end_at_ts': fb_transaction['billing_end_time'],
-                            'billed_at': datetime.datetime.fromtimestamp(fb_transaction['time'], tz=settings.TZ),
-                            'reason': fb_transaction.get('billing_reason'),
-                            'charge_type': fb_transaction['charge_type'],
-                            'product_type': fb_transaction.get('product_type'),
-                            'payment_option': fb_transaction['payment_option'],
-                            'status': fb_transaction['status'],
-                            'tracking_id': fb_transaction.get('tracking_id'),
-                            'transaction_type': fb_transaction.get('transaction_type'),
-                            'vat_invoice_id': fb_transaction.get('vat_invoice_id'),
-                            'data': fb_transaction.export_all_data(),
-                        },
-                    )
-
-                    if created:
-                        adaccount_card.recalc_spends()
-                        if adaccount_card.card is not None:
-                            adaccount_card.card.recalc_spends()
-
-            AdAccount.update(pk=adaccount_obj.id, action_verb='Success load bills', bills_load_at=bills_load_at)
-        except FacebookRequestError as e:
-            if e.api_error_code() == 190:
-                Account.update(pk=account.id, action_verb='cleared token', fb_access_token=None)
-            # elif e.api_error_code() == 100 and e.api_error_subcode() == 33:
-            #     pass
-            # else:
-            #     logger.error(e, exc_info=True)
-
-
-def process_campaign_stat(stats_data: Dict[str, Any], date: datetime.date, reload=False):
-    campaign = Campaign.objects.filter(campaign_id=stats_data['id']).first()
-    print(campaign)
+    TransactionsSync(account).run()
+
+
+def get_tracker_campaigns(tracker_campaign_ids: List[int]) -> Dict[int, Campaign]:
+    """
+    Кампании по id в трекере одним запросом, вместе с аккаунтами для статы:
+    stat_account_id - как Campaign.get_account(), adaccount_account_id - аккаунт первого рекламного аккаунта
+    """
+    adaccount_account = AdAccount.objects.filter(campaign=OuterRef('pk')).order_by('pk').values('account_id')[:1]
+    account = Account.objects.filter(campaign=OuterRef('pk')).order_by(*Account._meta.ordering).values('pk')[:1]
+    campaigns = Campaign.objects.filter(campaign_id__in=tracker_campaign_ids).annotate(
+        adaccount_account_id=Subquery(adaccount_account),
+        stat_account_id=Coalesce(Subquery(adaccount_account), Subquery(account)),
+    )
+    return {campaign.campaign_id: campaign for campaign in campaigns}
+
+
+def process_campaign_stat(
+    stats_data: Dict[str, Any],
+    date: datetime.date,
+    reload=False,
+    buffer: Optional[StatDeltaBuffer] = None,
+    timeline: Optional[ManagerTimeline] = None,
+    campaigns: Optional[Dict[int, Campaign]] = None,
+):
+    """
+    Если передан buffer - дельты копятся в нем, запись делает вызывающий через buffer.flush()
+    campaigns - результат get_tracker_campaigns для всей страницы
+    """
+    if campaigns is None:
+        campaigns = get_tracker_campaigns([stats_data['id']])
+    campaign = campaigns.get(int(stats_data['id']))
     if campaign:
         stats = {
             'leads': stats_data['conversions'],
@@ -950,14 +1042,14 @@ def process_campaign_stat(stats_data: Dict[str, Any], date: datetime.date, reloa
             'cost': stats_data['cost'],
             'profit': stats_data['profit'],
         }
+        prev_stats = None
         if not reload:
             # Получаем стату с предыдущей проверки
-            prev_stats = redis.get(f'campaign_day_stats_{campaign.id}_{date}')
-            if prev_stats is None:
-                prev_stats = defaultdict(lambda: '0')
+            if buffer:
+                prev_stats = buffer.get_snapshot(CAMPAIGN_SNAPSHOTS, campaign.id, date)
             else:
-                prev_stats = json.loads(prev_stats)
-        else:
+                prev_stats = CAMPAIGN_SNAPSHOTS.get(campaign.id, date)
+        if prev_stats is None:
             prev_stats = defaultdict(lambda: '0')
 
         # считаем разницу статы для записи в базу
@@ -969,14 +1061,21 @@ def process_campaign_stat(stats_data: Dict[str, Any], date: datetime.date, reloa
             'cost': Decimal(stats['cost']) - Decimal(prev_stats['cost']),
             'profit': Decimal(stats['profit']) - Decimal(prev_stats['profit']),
         }
-        print(diff)
         if any(diff.values()):
-            manager = campaign.get_manager_on_date(date)
+            if timeline is not None:
+                manager = timeline.get_manager_on_date(campaign, date)
+            else:
+                manager = campaign.get_manager_on_date(date)
+            flush = buffer is None
+            if flush:
+                buffer = StatDeltaBuffer()
+
             with transaction.atomic():
                 # Записываем сырые данные из трекера
-                CampaignDayStat.objects.update_or_create(campaign=campaign, date=date, defaults=stats)
+                buffer.add(CampaignDayStat, campaign_id=campaign.id, date=date, **stats)
 
-                UserCampaignDayStat.upsert(
+                buffer.add(
+                    UserCampaignDayStat,
                     date=date,
                     campaign_id=campaign.id,
                     user_id=manager.id if manager else None,
@@ -988,9 +1087,10 @@ def process_campaign_stat(stats_data: Dict[str, Any], date: datetime.date, reloa
                     profit=diff['profit'],
                 )
 
-                UserAccountDayStat.upsert(
+                buffer.add(
+                    UserAccountDayStat,
                     date=date,
-                    account_id=campaign.get_account().id if campaign.get_account() else None,
+                    account_id=campaign.stat_account_id,
                     user_id=manager.id if manager else None,
                     campaign_id=campaign.id,
                     clicks=diff['clicks'],
@@ -1003,11 +1103,10 @@ def process_campaign_stat(stats_data: Dict[str, Any], date: datetime.date, reloa
                     spend=Decimal('0.00'),
                     payment=Decimal('0.00'),
                 )
-                UserDayStat.upsert(
+                buffer.add(
+                    UserDayStat,
                     date=date,
-                    account_id=campaign.adaccounts.all().first().account_id
-                    if campaign.adaccounts.all().exists()
-                    else None,
+                    account_id=campaign.adaccount_account_id,
                     adaccount_id=None,
                     user_id=manager.id if manager else None,
                     campaign_id=campaign.id,
@@ -1021,20 +1120,41 @@ def process_campaign_stat(stats_data: Dict[str, Any], date: datetime.date, reloa
                     spend=Decimal('0.00'),
                     payment=Decimal('0.00'),
                 )
-            # Обновляем предыдущую стату в кеше
-            redis.set(f'campaign_day_stats_{campaign.id}_{date}', json.dumps(stats, cls=DjangoJSONEncoder))
+                # Обновляем предыдущую стату в кеше после записи дельт
+                buffer.set_snapshot(CAMPAIGN_SNAPSHOTS, campaign.id, date, stats)
+
+                if flush:
+                    buffer.flush()
+
+
+def process_campaign_stats(
+    stats_list: List[Dict[str, Any]],
+    date: datetime.date,
+    reload=False,
+    campaigns: Optional[Dict[int, Campaign]] = None,
+):
+    """
+    Обработка страницы статы из трекера: кампании с аккаунтами одним запросом, снапшоты одним MGET,
+    дельты всех кампаний одной пачкой, новые снапшоты одним MSET после коммита
+    """
+    if campaigns is None:
+        campaigns = get_tracker_campaigns([int(stats_data['id']) for stats_data in stats_list])
+    buffer = StatDeltaBuffer()
+    timeline = ManagerTimeline.for_campaigns(list(campaigns.values()))
+    if not reload:
+        buffer.prefetch_snapshots(CAMPAIGN_SNAPSHOTS, date, [campaign.id for campaign in campaigns.values()])
+    with transaction.atomic():
+        for stats_data in stats_list:
+            process_campaign_stat(
+                stats_data, date, reload=reload, buffer=buffer, timeline=timeline, campaigns=campaigns
+            )
+        buffer.flush()
 
 
 def process_adaccount_stat(account: Account, adaccount: AdAccount, stat: AdsInsights, reload=False):
     date = datetime.datetime.strptime(stat['date_start'], '%Y-%m-%d').date()
-    if not reload:
-        prev_stats = redis.get(f'adaccount_day_stats_{adaccount.id}_{date}')
-
-        if prev_stats is None:
-            prev_stats = defaultdict(lambda: '0')
-        else:
-            prev_stats = json.loads(prev_stats)
-    else:
+    prev_stats = ADACCOUNT_SNAPSHOTS.get(adaccount.id, date) if not reload else None
+    if prev_stats is None:
         prev_stats = defaultdict(lambda: '0')
 
     clicks = int(stat.get('clicks', '0')) - int(prev_stats['clicks'])
@@ -1069,11 +1189,12 @@ def process_adaccount_stat(account: Account, adaccount: AdAccount, stat: AdsInsi
         account_manager = account.get_manager_on_date(date)
         with transaction.atomic():
             # Храним сырые данные
-            AdAccountDayStat.objects.update_or_create(
-                account=account,
-                adaccount=adaccount,
-                date=date,
-                defaults={'clicks': stat.get('clicks', 0), 'spend': stat.get('spend', 0.0)},
+            # Через update, чтобы изменение спенда попало в Account.fb_spends
+            stats, _ = AdAccountDayStat.objects.get_or_create(
+                account=account, adaccount=adaccount, date=date, defaults={'clicks': 0, 'spend': 0}
+            )
+            AdAccountDayStat.update(
+                pk=stats.pk, clicks=int(stat.get('clicks', '0')), spend=Decimal(stat.get('spend', '0.00'))
             )
 
             UserAdAccountDayStat.upsert(
@@ -1102,13 +1223,29 @@ def process_adaccount_stat(account: Account, adaccount: AdAccount, stat: AdsInsi
             )
 
     stat_data = {'clicks': int(stat.get('clicks', '0')), 'spend': Decimal(stat.get('spend', '0.00'))}
-    redis.set(f'adaccount_day_stats_{adaccount.id}_{date}', json.dumps(stat_data, cls=DjangoJSONEncoder))
-
-
-def process_adaccount_stat_v2(account: Account, adaccount: AdAccount, stat: AdsInsights, reload=False):
+    ADACCOUNT_SNAPSHOTS.set(adaccount.id, date, stat_data)
+
+
+def process_adaccount_stat_v2(
+    account: Account,
+    adaccount: AdAccount,
+    stat: AdsInsights,
+    reload=False,
+    buffer: Optional[StatDeltaBuffer] = None,
+    account_timeline: Optional[ManagerTimeline] = None,
+    adaccount_timeline: Optional[ManagerTimeline] = None,
+):
+    """
+    Если передан buffer - дельты копятся в нем, запись делает вызывающий через buffer.flush()
+    Таймлайны менеджеров лучше грузить заранее на все рекламные аккаунты
+    """
     date = datetime.datetime.strptime(stat['date_start'], '%Y-%m-%d').date()
-    adaccount_manager = adaccount.get_manager_on_date(date) or account.manager
-    account_manager = account.get_manager_on_date(date)
+    if account_timeline is None:
+        account_timeline = ManagerTimeline.for_accounts([account])
+    if adaccount_timeline is None:
+        adaccount_timeline = ManagerTimeline.for_adaccounts([adaccount])
+    adaccount_manager = adaccount_timeline.get_manager_on_date(adaccount, date) or account.manager
+    account_manager = account_timeline.get_manager_on_date(account, date)
     with transaction.atomic():
         stats, _ = AdAccountDayStat.objects.get_or_create(
             account=account, adaccount=adaccount, date=date, defaults={'clicks': 0, 'spend': 0}
@@ -1147,7 +1284,12 @@ def process_adaccount_stat_v2(account: Account, adaccount: AdAccount, stat: AdsI
                     )
 
         if any([clicks, spend]):
-            UserAdAccountDayStat.upsert(
+            flush = buffer is None
+            if flush:
+                buffer = StatDeltaBuffer()
+
+            buffer.add(
+                UserAdAccountDayStat,
                 date=date,
                 account_id=account.id,
                 adaccount_id=adaccount.id,
@@ -1156,7 +1298,8 @@ def process_adaccount_stat_v2(account: Account, adaccount: AdAccount, stat: AdsI
                 clicks=clicks,
             )
 
-            UserAccountDayStat.upsert(
+            buffer.add(
+                UserAccountDayStat,
                 date=date,
                 account_id=account.id,
                 user_id=account_manager.id if account_manager else None,
@@ -1172,7 +1315,8 @@ def process_adaccount_stat_v2(account: Account, adaccount: AdAccount, stat: AdsI
                 payment=Decimal('0.00'),
             )
 
-            UserDayStat.upsert(
+            buffer.add(
+                UserDayStat,
                 date=date,
                 account_id=adaccount.account.id,
                 adaccount_id=adaccount.id,
@@ -1189,170 +1333,50 @@ def process_adaccount_stat_v2(account: Account, adaccount: AdAccount, stat: AdsI
                 payment=Decimal('0.00'),
             )
 
+            if flush:
+                buffer.flush()
 
-def import_leads_csv(import_task):
-    total_leads = 0
-    invalid_leads = 0
-    batch_size = 5000
-    with open(import_task.file.path) as f:
-        data = csv.DictReader(f, delimiter=',')
-        try:
-            batch = []
-            for line in data:
-                lead_data = {
-                    'email': line.get('email'),
-                    'first_name': line.get("first_name"),
-                    'last_name': line.get("last_name"),
-                    'name': line.get('name'),
-                    'city': line.get('city'),
-                    'zip': line.get('zip'),
-                    'address': line.get('address'),
-                    'offer': line.get('offer'),
-                }
-                if not lead_data['name'] and line.get("first_name") and line.get("last_name"):
-                    lead_data['name'] = f'{line.get("first_name")} {line.get("last_name")}'
-
-                if 'date' in line:
-                    try:
-                        lead_data['created_at'] = parse(line.get('date'))  # dayfirst=True
-                    except Exception as e:
-                        logger.error(e, exc_info=True)
-
-                phone = line.get('phone')
-                if phone:
-                    phone = phone.replace(' ', '')
-                    phone = phone.replace('-', '')
-
-                if 'country' in line:
-                    try:
-                        country_id = cache.get(f'country_id_{line["country"].upper()}')
-                        country_code = cache.get(f'country_code_{line["country"].upper()}')
-                        if not country_id or not country_code:
-                            country, _ = Country.objects.get_or_create(
-                                code=line['country'].upper(), defaults={'name': line['country']}
-                            )
-                            cache.set(f'country_id_{line["country"].upper()}', country.id)
-                            cache.set(f'country_code_{line["country"].upper()}', country.code)
-
-                            lead_data['country'] = country.id
-                            lead_data['country_code'] = country.code
-                        else:
-                            lead_data['country'] = country_id
-                            lead_data['country_code'] = country_code
-
-                        if phone:
-                            prefix = COUNTRY_PHONE[lead_data['country_code']]
-                            if not phone.startswith(prefix):
-                                if phone.startswith(f'00{prefix[1:]}') or phone.startswith(f'0{prefix[1:]}0'):
-                                    phone = phone[4:]
-                                    phone = f"{prefix}{phone}"
-                                elif phone.startswith('+0'):
-                                    phone = phone[2:]
-                                    phone = f"{prefix}{phone}"
-                                elif phone.startswith('0') or phone.startswith('1'):
-                                    phone = phone[1:]
-                                    phone = f"{prefix}{phone}"
-                                elif phone.startswith(prefix[1:]):
-                                    phone = f"+{phone}"
-                                elif phone.startswith('+'):
-                                    pass
-                                else:
-                                    phone = f"{prefix}{phone}"
-                            elif phone.startswith(f'{prefix}0'):
-                                phone = phone.replace(f'{prefix}0', f'{prefix}')
-
-                    except Exception as e:
-                        logger.error(e, exc_info=True)
-
-                lead_data['phone'] = str(phone)
-
-                serializer = LeadgenLeadValidateSerializer(data=lead_data)
-
-                if serializer.is_valid():
-                    if any(list(lead_data.values())):
-                        # if not LeadgenLead.objects.filter(**serializer.validated_data).exists():
-                        lead = LeadgenLead(**serializer.validated_data, raw_data=line)
-                        batch.append(lead)
-                        total_leads += 1
-                        if len(batch) >= batch_size:
-                            LeadgenLead.objects.bulk_create(batch)
-                            batch = []
-                        # else:
-                        #     invalid_leads += 1
-                else:
-                    logger.error(
-                        'Invalid lead data', extra={'lead_data': lead_data, 'errors': serializer.errors}, exc_info=True
-                    )
-                    invalid_leads += 1
-            if batch:
-                LeadgenLead.objects.bulk_create(batch)
 
-            import_task.status = 2
-            import_task.save(update_fields=['status'])
+def import_leads_csv(import_task):
+    importer = LeadsImporter(import_task)
+    try:
+        importer.run()
+        import_task.status = 2
+        import_task.save(update_fields=['status'])
 
-            message = render_to_string(
-                'tools/leads_import_success.html', {'total_leads': total_leads, 'invalid_leads': invalid_leads},
-            )
-            data = {'message': message}
-            recipient = import_task.user
-            Notification.create(
-                recipient=recipient, level=Notification.WARNING, category=Notification.ACCOUNT, data=data, sender=None,
-            )
+        message = render_to_string(
+            'tools/leads_import_success.html',
+            {'total_leads': importer.imported_rows, 'invalid_leads': importer.rejected_rows},
+        )
+        data = {'message': message}
+        recipient = import_task.user
+        Notification.create(
+            recipient=recipient, level=Notification.WARNING, category=Notification.ACCOUNT, data=data, sender=None,
+        )
 
-        except Exception as e:
-            message = render_to_string('tools/leads_import_error.html', {'error': repr(e)[:256]})
-            data = {'message': message}
+    except Exception as e:
+        message = render_to_string('tools/leads_import_error.html', {'error': repr(e)[:256]})
+        data = {'message': message}
 
-            recipient = import_task.user
-            Notification.create(
-                recipient=recipient, level=Notification.WARNING, category=Notification.ACCOUNT, data=data, sender=None,
-            )
-            logger.error('Import leads error', extra={'e': e}, exc_info=True)
-            import_task.status = 3
-            import_task.save(update_fields=['status'])
+        recipient = import_task.user
+        Notification.create(
+            recipient=recipient, level=Notification.WARNING, category=Notification.ACCOUNT, data=data, sender=None,
+        )
+        logger.error('Import leads error', extra={'e': e}, exc_info=True)
+        import_task.status = 3
+        import_task.save(update_fields=['status'])
 
 
 def import_payments_csv(import_task):
-    total_accounts = 0
-    total_paid_amount = Decimal('0.00')
-
+    importer = PaymentsImporter(import_task)
     try:
-        with open(import_task.file.path) as f:
-            data = csv.DictReader(f, delimiter=',')
-            for line in data:
-                account_id = line.get('account_id')
-                account = Account.objects.filter(id=account_id).first()
-                if account:
-                    total_accounts += 1
-                    with transaction.atomic():
-                        date = parse(line.get('date'), dayfirst=True).date()
-                        amount = line.get('amount')
-                        AccountPayment.objects.update_or_create(
-                            account=account, date=date, defaults={'amount': amount, 'user': import_task.user,}
-                        )
-                        total_paid_amount += Decimal(amount)
-                        total_paid = AccountPayment.objects.filter(account=account).aggregate(total_paid=Sum('amount'))
-                        account = Account.objects.select_for_update().get(pk=account.id)
-                        account.total_paid = total_paid['total_paid']
-                        account.save()
-
-                        account_manager = account.get_manager_on_date(date)
-                        campaign = account.get_all_campaigns().first()
-
-                        UserAccountDayStat.objects.update_or_create(
-                            date=date,
-                            account_id=account.id,
-                            user_id=account_manager.id if account_manager else None,
-                            campaign_id=campaign.id if campaign else None,
-                            defaults={'payment': amount,},
-                        )
-
+        importer.run()
         import_task.status = 2
         import_task.save(update_fields=['status'])
 
         message = render_to_string(
             'accounts/payments_import_success.html',
-            {'total_accounts': total_accounts, 'total_paid': total_paid_amount},
+            {'total_accounts': importer.total_accounts, 'total_paid': importer.total_paid},
         )
         data = {'message': message}
 
@@ -1374,11 +1398,28 @@ def import_payments_csv(import_task):
         import_task.save(update_fields=['status'])
 
 
+# Ссылки читаются кусками по id (серверные курсоры на проде выключены из-за pgbouncer),
+# кеш в SHORTIFY заливается параллельно, но не больше BROADCAST_CACHE_WORKERS запросов в полете
+BROADCAST_CHUNK_SIZE = 1000
+BROADCAST_CACHE_WORKERS = 4
+
+
+def iter_link_chunks(links: QuerySet, chunk_size: int = BROADCAST_CHUNK_SIZE):
+    last_id = 0
+    while True:
+        chunk = list(links.filter(id__gt=last_id).order_by('id')[:chunk_size].iterator())
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1].id
+
+
 def create_broadcast_file(group):
-    batch_size = 1000
-    links = Link.objects.filter(group=group).prefetch_related('leadgen_lead')
-    if links.exists():
+    links = Link.objects.filter(group=group).select_related('leadgen_lead')
+    total_links = links.count()
+    if total_links:
         headers = {'X-API-Key': settings.SHORTIFY_API_KEY}
+        cache_url = f'{settings.SHORTIFY_URL}/update_cache'
         filename = slugify(group.name, allow_unicode=True)
         filename = f'{filename}_{group.created_at.strftime("%d.%m.%Y_%H:%M:%S")}.csv'
 
@@ -1386,44 +1427,48 @@ def create_broadcast_file(group):
         Path(base_directory).mkdir(parents=True, exist_ok=True)
         full_path = os.path.join(base_directory, filename)
 
-        with open(full_path, 'w', newline='') as csvfile:
+        session = requests.Session()
+        session.mount('https://', HTTPAdapter(pool_maxsize=BROADCAST_CACHE_WORKERS))
+        session.mount('http://', HTTPAdapter(pool_maxsize=BROADCAST_CACHE_WORKERS))
+        with open(full_path, 'w', newline='') as csvfile, ThreadPoolExecutor(BROADCAST_CACHE_WORKERS) as executor:
             writer = csv.writer(csvfile, delimiter=';', quoting=csv.QUOTE_ALL)
             writer.writerow(['name', 'email', 'phone', 'url', 'zip', 'city'])
-            data = []
-            csv_rows = []
-            for link in links:
-                cleared_name = unidecode(link.leadgen_lead.full_name)
-                csv_rows.append(
+            pending = set()
+            exported = 0
+            for chunk in iter_link_chunks(links):
+                writer.writerows(
                     [
-                        cleared_name,
+                        unidecode(link.leadgen_lead.full_name),
                         link.leadgen_lead.email,
                         link.leadgen_lead.phone,
                         link.short_url,
                         link.leadgen_lead.zip,
                         link.leadgen_lead.city,
                     ]
+                    for link in chunk
                 )
-                data.append({'key': link.key, 'url': link.url})
-                if len(data) >= batch_size:
-                    writer.writerows(csv_rows)
-                    func_attempts(requests.post, f'{settings.SHORTIFY_URL}/update_cache', headers=headers, json=data)
-                    data = []
-                    csv_rows = []
+                data = [{'key': link.key, 'url': link.url} for link in chunk]
+                pending.add(executor.submit(func_attempts, session.post, cache_url, headers=headers, json=data))
+                if len(pending) >= BROADCAST_CACHE_WORKERS:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
 
-            if data or csv_rows:
-                writer.writerows(csv_rows)
-                func_attempts(requests.post, f'{settings.SHORTIFY_URL}/update_cache', headers=headers, json=data)
+                exported += len(chunk)
+                LinkGroup.objects.filter(pk=group.id).update(exported_links=exported)
+
+            for future in wait(pending).done:
+                future.result()
 
         LinkGroup.objects.filter(pk=group.id).update(
             status=LinkGroup.SUCCESS,
             status_comment=None,
-            total_links=links.count(),
+            total_links=total_links,
+            exported_links=exported,
             csv=os.path.join('broadcasts', str(group.user_id), filename),
         )
     else:
-        LinkGroup.objects.filter(pk=group.id).update(
-            status=LinkGroup.SUCCESS, status_comment=None, total_links=links.count()
-        )
+        LinkGroup.objects.filter(pk=group.id).update(status=LinkGroup.SUCCESS, status_comment=None, total_links=0)
 
 
 def check_banned_urls(urls, type='tracker'):
@@ -1457,6 +1502,7 @@ def check_banned_urls(urls, type='tracker'):
                     Domain.objects.filter(name__in=domains).update(is_banned=True)
                 elif type == 'shortify':
                     ShortifyDomain.objects.filter(domain__in=domains).update(is_banned=True)
+                    ShortifyDomain.invalidate_pool()
                 # Шлем админу и тимлиду сообщение
                 message = render_to_string('core/domain_banned.html', {'domains': domains})
                 data = {'message': message}
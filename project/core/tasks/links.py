@@ -1,89 +1,125 @@
 import csv
+import datetime
 import logging
 import os
+import uuid
 from pathlib import Path
 
 from django.conf import settings
-from django.db.models import F
+from django.db import connection, transaction
+from django.db.models import F, Q
 from django.http.request import QueryDict
 from django.utils import timezone
 from django.utils.text import slugify
 
 import requests
 import short_url
+from redis import Redis
+from redis.exceptions import LockError
 
 from api.v1.filters import LeadgenLeadFilter
 from project.celery_app import app
 
-from ..models.core import LeadgenLead, Link, LinkGroup
+from ..models.core import LeadgenLead, Link, LinkClicksFlush, LinkGroup
 from ..utils import ALPHABET, func_attempts
 from .helpers import create_broadcast_file
 
+redis = Redis(host='redis', db=0, decode_responses=True)
 logger = logging.getLogger(__name__)
 
+# Клики с постбеков копятся в hash {id ссылки: клики} и пишутся в базу flush_click_stats
+LINK_CLICKS_KEY = 'link_clicks'
+LINK_CLICKS_FLUSHING_KEY = 'link_clicks:flushing'
+LINK_CLICKS_FLUSH_ID_KEY = 'link_clicks:flush_id'
+LINK_CLICKS_LOCK_KEY = 'link_clicks:lock'
+LINK_CLICKS_LOCK_TIMEOUT = 300
+# Каждый запрос flush короче блокировки в сумме: пока flush идет, второй его не начнет
+LINK_CLICKS_STATEMENT_TIMEOUT = '60s'
+LINK_CLICKS_FLUSHES_KEEP = datetime.timedelta(days=7)
+
+LINKS_CHUNK_SIZE = 5000
+
+
+def get_group_leads(group):
+    # Если есть бродкаст - создаем из кликнутых
+    if group.broadcast is not None:
+        clicked_links = group.broadcast.get_clicked_links().values_list('leadgen_lead_id', flat=True)
+        return LeadgenLead.objects.filter(id__in=clicked_links)
+
+    filter_params = QueryDict('', mutable=True)
+    filter_params.update(group.filter_data)
+    return LeadgenLeadFilter(
+        filter_params, queryset=LeadgenLead.objects.filter(phone__isnull=False).exclude(phone='')
+    ).qs
+
+
+def create_links_part(group, number, base_name):
+    if number == 2:
+        LinkGroup.objects.filter(pk=group.id).update(name=f'{base_name} 1')
+    return LinkGroup.objects.create(
+        user=group.user,
+        parent=group,
+        broadcast=group.broadcast,
+        name=f'{base_name} {number}',
+        base_url=group.base_url,
+        network=group.network,
+        domain=group.domain,
+        max_links=group.max_links,
+        description=group.description,
+        filter_data=group.filter_data,
+        status=LinkGroup.PROCESSING,
+    )
+
 
 @app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3, 'countdown': 2})
 def create_links(self, group_id):
+    """
+    Генерирует ссылки пачками по id лидов, каждая пачка пишется через COPY в своей транзакции
+    вместе с прогрессом group.last_lead_id. При повторной доставке задачи после рестарта воркера
+    генерация продолжается с последней закоммиченной пачки.
+    Если лидов больше max_links, ссылки раскладываются по частям - группам с parent=group.
+    """
     group = LinkGroup.objects.get(id=group_id)
-    batch_size = 1000
-    group_links = 0
-    groups = 1
-    base_name = group.name
-    created_groups = [group.pk]
     try:
-        # Если есть бродкаст - создаем из кликнутых
-        if group.broadcast is not None:
-            clicked_links = group.broadcast.get_clicked_links().values_list('leadgen_lead_id', flat=True)
-            leads = LeadgenLead.objects.filter(id__in=clicked_links)
-        else:
-            filter_params = QueryDict('', mutable=True)
-            filter_params.update(group.filter_data)
-            leads = LeadgenLeadFilter(
-                filter_params, queryset=LeadgenLead.objects.filter(phone__isnull=False).exclude(phone='')
-            ).qs
-
-        if leads.count() > group.max_links:
-            name = f'{base_name} {groups}'
-            LinkGroup.objects.filter(pk=group.id).update(status=LinkGroup.PROCESSING, status_comment=None, name=name)
-        else:
-            LinkGroup.objects.filter(pk=group.id).update(status=LinkGroup.PROCESSING, status_comment=None)
-
-        if leads.exists():
-            batch = []
-            data = []
-            exported_leads = []
-            for lead in leads:
-                exported_leads.append(lead.id)
-                url = lead.create_link(base_url=group.base_url, keyword=group.name, network=group.network)
-                link = Link(user=group.user, group=group, leadgen_lead=lead, url=url)
-                group_links += 1
-                if group.max_links and group_links > group.max_links:
-                    groups += 1
-                    group.pk = None
-                    group.name = f'{base_name} {groups}'
-                    group.status = LinkGroup.PROCESSING
-                    group.created_at = timezone.now()
-                    group.save()
-                    created_groups.append(group.pk)
-                    group_links = 0
-
-                batch.append(link)
-                if len(batch) >= batch_size:
-                    Link.objects.bulk_create(batch)
-                    LeadgenLead.objects.filter(id__in=exported_leads).update(exported_at=timezone.now())
-                    exported_leads = []
-                    data = []
-                    batch = []
-
-            if data or batch:
-                Link.objects.bulk_create(batch)
-                LeadgenLead.objects.filter(id__in=exported_leads).update(exported_at=timezone.now())
-
-        for group in LinkGroup.objects.filter(id__in=created_groups):
-            create_broadcast_file(group)
+        leads = get_group_leads(group)
+        LinkGroup.objects.filter(pk=group.id).update(status=LinkGroup.PROCESSING, status_comment=None)
+
+        part = group.parts.order_by('-id').first() or group
+        parts = group.parts.count() + 1
+        # Первая группа переименовывается в "{name} 1" вместе с созданием второй
+        base_name = group.name[: -len(' 1')] if parts > 1 else group.name
+        last_lead_id = group.last_lead_id
+        while True:
+            chunk = list(leads.filter(id__gt=last_lead_id).order_by('id')[:LINKS_CHUNK_SIZE])
+            if not chunk:
+                break
+
+            with transaction.atomic():
+                links = []
+                touched_parts = {part.id: part}
+                for lead in chunk:
+                    if group.max_links and part.total_links >= group.max_links:
+                        parts += 1
+                        part = create_links_part(group, parts, base_name)
+                        touched_parts[part.id] = part
+                    # utm_term - имя части; у исходной группы - базовое, как до переименования в "{name} 1"
+                    keyword = base_name if part.id == group.id else part.name
+                    url = lead.create_link(base_url=group.base_url, keyword=keyword, network=group.network)
+                    links.append(Link(user_id=group.user_id, group_id=part.id, leadgen_lead_id=lead.id, url=url))
+                    part.total_links += 1
+
+                Link.copy_create(links)
+                LeadgenLead.objects.filter(id__in=[lead.id for lead in chunk]).update(exported_at=timezone.now())
+                for touched in touched_parts.values():
+                    LinkGroup.objects.filter(pk=touched.id).update(total_links=touched.total_links)
+                last_lead_id = chunk[-1].id
+                LinkGroup.objects.filter(pk=group.id).update(last_lead_id=last_lead_id)
+
+        for link_group in LinkGroup.objects.filter(Q(id=group.id) | Q(parent_id=group.id)):
+            create_broadcast_file(link_group)
 
     except Exception as e:
-        print(e)
+        logger.error(e, exc_info=True)
         LinkGroup.objects.filter(pk=group.id).update(status=LinkGroup.ERROR, status_comment=e)
 
 
@@ -102,6 +138,100 @@ def process_click_stats(self, data):
             logger.error(e, exc_info=True)
 
 
+def buffer_click_stats(data) -> int:
+    """
+    HINCRBY кликов постбека в redis одним pipeline, возвращает количество принятых записей
+    """
+    encoder = short_url.UrlEncoder(alphabet=ALPHABET)
+    pipe = redis.pipeline(transaction=False)
+    accepted = 0
+    for stat in data:
+        try:
+            link_id = encoder.decode_url(stat['key'])
+            clicks = int(stat['clicks'])
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f'Bad click stat {stat}: {e}')
+            continue
+        if clicks:
+            pipe.hincrby(LINK_CLICKS_KEY, link_id, clicks)
+            accepted += 1
+    if accepted:
+        pipe.execute()
+    return accepted
+
+
+@app.task
+def flush_click_stats() -> int:
+    """
+    Переносит накопленные клики в Link и LinkGroup, по одному UPDATE ... FROM (VALUES ...) на таблицу.
+    Запускается периодически, клики доезжают в базу в пределах интервала запуска.
+    Пачка с flush_id пишется в LinkClicksFlush в той же транзакции, что и клики: если после коммита
+    не удалось убрать пачку из redis, следующий запуск ее не применит повторно. Без autoretry -
+    упавший flush повторит следующий запуск beat.
+    """
+    lock = redis.lock(LINK_CLICKS_LOCK_KEY, timeout=LINK_CLICKS_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        return 0
+    try:
+        # Если прошлый flush упал, сначала дописываем его счетчики
+        if not redis.exists(LINK_CLICKS_FLUSHING_KEY):
+            if not redis.exists(LINK_CLICKS_KEY):
+                return 0
+            pipe = redis.pipeline(transaction=True)
+            pipe.rename(LINK_CLICKS_KEY, LINK_CLICKS_FLUSHING_KEY)
+            pipe.set(LINK_CLICKS_FLUSH_ID_KEY, uuid.uuid4().hex)
+            pipe.execute()
+        redis.set(LINK_CLICKS_FLUSH_ID_KEY, uuid.uuid4().hex, nx=True)
+        flush_id = redis.get(LINK_CLICKS_FLUSH_ID_KEY)
+
+        rows = [(int(link_id), int(clicks)) for link_id, clicks in redis.hgetall(LINK_CLICKS_FLUSHING_KEY).items()]
+        rows = [row for row in rows if row[1]]
+        # Полный таймаут блокировки на запись: три запроса по LINK_CLICKS_STATEMENT_TIMEOUT в него укладываются
+        lock.reacquire()
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"SET LOCAL statement_timeout = '{LINK_CLICKS_STATEMENT_TIMEOUT}'")
+            # Параллельный flush той же пачки ждет здесь коммита первого и пропускает ее
+            cursor.execute(
+                'INSERT INTO core_linkclicksflush (flush_id, created_at) VALUES (%s, now()) '
+                'ON CONFLICT (flush_id) DO NOTHING RETURNING id',
+                [flush_id],
+            )
+            if cursor.fetchone() is None:
+                logger.warning(f'Link clicks flush {flush_id} is already applied')
+                rows = []
+            if rows:
+                values = ', '.join(['(%s, %s)'] * len(rows))
+                params = [value for row in rows for value in row]
+                cursor.execute(
+                    f"""
+                    UPDATE core_link SET clicks = core_link.clicks + stats.clicks
+                    FROM (VALUES {values}) AS stats (id, clicks)
+                    WHERE core_link.id = stats.id
+                    """,
+                    params,
+                )
+                cursor.execute(
+                    f"""
+                    UPDATE core_linkgroup SET total_clicks = core_linkgroup.total_clicks + stats.clicks
+                    FROM (
+                        SELECT link.group_id, SUM(stats.clicks) AS clicks
+                        FROM (VALUES {values}) AS stats (id, clicks)
+                        JOIN core_link link ON link.id = stats.id
+                        GROUP BY link.group_id
+                    ) AS stats
+                    WHERE core_linkgroup.id = stats.group_id
+                    """,
+                    params,
+                )
+        redis.delete(LINK_CLICKS_FLUSHING_KEY, LINK_CLICKS_FLUSH_ID_KEY)
+        LinkClicksFlush.objects.filter(created_at__lt=timezone.now() - LINK_CLICKS_FLUSHES_KEEP).delete()
+        return len(rows)
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            logger.warning('Link clicks lock expired before flush finished')
+
 @app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3, 'countdown': 2})
 def process_lander_data(self, data):
     lead = LeadgenLead.objects.filter(uuid=data['uuid']).first()
@@ -1,14 +1,41 @@
+import logging
+import time
 from decimal import Decimal
 
+from django.db import connection
 from django.db.models.aggregates import Sum
+from django.template.loader import render_to_string
 from django.utils import timezone
 
 from redis import Redis
 
-from core.models.core import Account, UserAccountDayStat
+from core.metrics import record_metrics
+from core.models.core import Account, Notification, User, UserAccountDayStat
+from core.partitions import PARTITIONED_STAT_TABLES, create_month_partitions
+from core.stats_rebuild import rebuild_user_stats
 from project.celery_app import app
 
 redis = Redis(host='redis', db=0, decode_responses=True)
+logger = logging.getLogger(__name__)
+
+# Сколько расхождений по спенду писать в лог поименно
+SPEND_MISMATCHES_LOG_LIMIT = 50
+
+# Чиним относительной поправкой, а не присваиванием суммы: дельты из AdAccountDayStat.update,
+# закоммиченные во время сверки, не теряются
+RECONCILE_ACCOUNT_SPENDS_SQL = """
+WITH totals AS (
+    SELECT account.id AS account_id, account.fb_spends AS stored, COALESCE(SUM(stat.spend), 0) AS actual
+    FROM core_account account
+    LEFT JOIN core_adaccountdaystat stat ON stat.account_id = account.id
+    GROUP BY account.id, account.fb_spends
+)
+UPDATE core_account
+SET fb_spends = core_account.fb_spends + (totals.actual - totals.stored)
+FROM totals
+WHERE core_account.id = totals.account_id AND totals.actual <> totals.stored
+RETURNING core_account.id, totals.stored, totals.actual
+"""
 
 
 @app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 5, 'countdown': 2})
@@ -40,3 +67,71 @@ def set_total_spend_stats(self, account_id: int) -> None:
             cost=Decimal('0.00'),
             payment=Decimal('0.00'),
         )
+
+
+@app.task
+def create_stat_partitions_task(months_ahead: int = 3) -> None:
+    today = timezone.now().date()
+    for table in PARTITIONED_STAT_TABLES:
+        create_month_partitions(table, today, months_ahead=months_ahead, today=today)
+
+
+@app.task
+def rebuild_account_stats_task(account_id: int) -> None:
+    """
+    Пересчет статы акка за все время из сырых данных, запускается из админки
+    """
+    account = Account.objects.get(id=account_id)
+    rebuild_user_stats(account.created_at.date(), timezone.now().date(), account_id=account.id)
+
+
+@app.task
+def preview_rebuild_account_stats_task(account_id: int, user_id: int) -> None:
+    """
+    Dry run пересчета статы акка за все время, разница уходит уведомлением запустившему из админки
+    """
+    account = Account.objects.get(id=account_id)
+    results = rebuild_user_stats(account.created_at.date(), timezone.now().date(), account_id=account.id, dry_run=True)
+    tables = [
+        {
+            'table': table,
+            'added': result['added'],
+            'removed': result['removed'],
+            'changed': result['changed'],
+            'diff': ', '.join(f'{name}: {value}' for name, value in result['diff'].items() if value),
+        }
+        for table, result in results.items()
+    ]
+    message = render_to_string('accounts/stats_rebuild_preview.html', {'account': account, 'tables': tables})
+    Notification.create(
+        recipient=User.objects.get(id=user_id),
+        level=Notification.INFO,
+        category=Notification.ACCOUNT,
+        data={'message': message},
+        sender=None,
+    )
+
+
+@app.task
+def reconcile_account_spends_task() -> None:
+    """
+    Ночная сверка Account.fb_spends, который ведется дельтами, с суммой по AdAccountDayStat
+    """
+    started = time.monotonic()
+    with connection.cursor() as cursor:
+        cursor.execute(RECONCILE_ACCOUNT_SPENDS_SQL)
+        mismatches = cursor.fetchall()
+    accounts = Account.objects.count()
+
+    drifts = [actual - stored for _, stored, actual in mismatches]
+    for account_id, stored, actual in mismatches[:SPEND_MISMATCHES_LOG_LIMIT]:
+        logger.warning(f'Account {account_id} spends drift: stored {stored}, actual {actual}')
+
+    record_metrics(
+        'spend_reconciliation',
+        accounts=accounts,
+        mismatches=len(mismatches),
+        total_drift=float(sum(drifts, Decimal('0.00'))),
+        max_drift=float(max((abs(drift) for drift in drifts), default=Decimal('0.00'))),
+        duration=round(time.monotonic() - started, 2),
+    )
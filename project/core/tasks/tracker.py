@@ -24,7 +24,7 @@ from core.models.core import (
     User,
     UserAccountDayStat,
 )
-from core.tasks.helpers import process_campaign_stat
+from core.tasks.helpers import get_tracker_campaigns, process_campaign_stats
 from core.utils import dateperiod, get_tracker_auth
 from project.celery_app import app
 
@@ -374,8 +374,7 @@ def load_tracker_campaign_stats(self, days=1):
                     if not stats.get('data'):
                         break
                     page += 1
-                    for stats_data in stats['data']:
-                        process_campaign_stat(stats_data, date)
+                    process_campaign_stats(stats['data'], date)
             except Exception as e:
                 logger.error(e, exc_info=True)
 
@@ -433,12 +432,14 @@ def reload_tracker_campaign_stats(self, account_id, days):
                     if not stats.get('data'):
                         break
                     page += 1
-                    for stats_data in stats['data']:
-                        campaign = Campaign.objects.filter(campaign_id=stats_data['id']).first()
-                        if campaign:
-                            account = campaign.get_account()
-                            if account and account.id == account_id:
-                                process_campaign_stat(stats_data, date, reload=True)
+                    campaigns = get_tracker_campaigns([int(stats_data['id']) for stats_data in stats['data']])
+                    campaigns = {
+                        tracker_id: campaign
+                        for tracker_id, campaign in campaigns.items()
+                        if campaign.stat_account_id == account_id
+                    }
+                    account_stats = [stats_data for stats_data in stats['data'] if int(stats_data['id']) in campaigns]
+                    process_campaign_stats(account_stats, date, reload=True, campaigns=campaigns)
             except Exception as e:
                 logger.error(e, exc_info=True)
 
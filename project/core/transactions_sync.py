@@ -0,0 +1,199 @@
+import datetime
+import logging
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from facebook_business import FacebookAdsApi
+from facebook_business.adobjects.adaccount import AdAccount as FBAdAccount
+from facebook_business.exceptions import FacebookRequestError
+
+from core.fb_governor import init_fb_api
+from core.models.core import Account, AdAccount, AdAccountCreditCard, AdAccountTransaction, Card
+
+logger = logging.getLogger(__name__)
+
+TRANSACTIONS_PAGE_SIZE = 100
+# Graph принимает не больше 50 запросов в одном batch
+DETAILS_BATCH_SIZE = 50
+DETAILS_BATCH_RETRIES = 3
+
+
+def transaction_key(fb_transaction) -> str:
+    return f'{fb_transaction["id"]}_{fb_transaction["tx_type"]}'
+
+
+def transaction_row(
+    adaccount_obj: AdAccount, fb_transaction, adaccount_card: Tuple[int, Optional[int]]
+) -> Dict[str, Any]:
+    adaccount_card_id, card_id = adaccount_card
+    return {
+        'adaccount_id': adaccount_obj.id,
+        'transaction_id': fb_transaction['id'],
+        'adaccount_card_id': adaccount_card_id,
+        'card_id': card_id,
+        'tx_type': fb_transaction['tx_type'],
+        'amount': Decimal(fb_transaction['amount']['total_amount_in_hundredths']) / Decimal('100'),
+        'currency': fb_transaction['amount']['currency'],
+        'start_at': datetime.datetime.fromtimestamp(fb_transaction['billing_start_time'], tz=settings.TZ),
+        'end_at': datetime.datetime.fromtimestamp(fb_transaction['billing_end_time'], tz=settings.TZ),
+        'start_at_ts': fb_transaction['billing_start_time'],
+        'end_at_ts': fb_transaction['billing_end_time'],
+        'billed_at': datetime.datetime.fromtimestamp(fb_transaction['time'], tz=settings.TZ),
+        'reason': fb_transaction.get('billing_reason'),
+        'charge_type': fb_transaction['charge_type'],
+        'product_type': fb_transaction.get('product_type'),
+        'payment_option': fb_transaction['payment_option'],
+        'status': fb_transaction['status'],
+        'tracking_id': fb_transaction.get('tracking_id'),
+        'transaction_type': fb_transaction.get('transaction_type'),
+        'vat_invoice_id': fb_transaction.get('vat_invoice_id'),
+        'data': fb_transaction.export_all_data(),
+    }
+
+
+class TransactionsSync:
+    """
+    Загрузка транзакций рекламных аккаунтов акка: детали (карта оплаты) запрашиваются batch запросами
+    по DETAILS_BATCH_SIZE транзакций, страница транзакций пишется одним upsert,
+    затронутые карты пересчитываются один раз в конце рекламного аккаунта.
+    Грузятся только транзакции начиная с AdAccount.transactions_synced_ts.
+    """
+
+    def __init__(self, account: Account, page_size: int = TRANSACTIONS_PAGE_SIZE):
+        self.account = account
+        self.page_size = page_size
+        self.api: Optional[FacebookAdsApi] = None
+
+    def load_details(self, adaccount_id: int, transactions: List) -> Tuple[Dict[str, Dict], int]:
+        """
+        metadata транзакций по ключу. Транзакции, по которым Graph вернул ошибку или не ответил,
+        в результат не попадают, возвращается их количество. Невалидный токен пробрасывается сразу
+        """
+        details: Dict[str, Dict] = {}
+        errors: Dict[str, FacebookRequestError] = {}
+
+        def on_success(key):
+            def callback(response):
+                data = response.json().get('data') or [{}]
+                details[key] = data[0].get('metadata') or {}
+
+            return callback
+
+        def on_failure(key):
+            def callback(response):
+                errors[key] = response.error()
+
+            return callback
+
+        keys = [transaction_key(fb_transaction) for fb_transaction in transactions]
+        for offset in range(0, len(keys), DETAILS_BATCH_SIZE):
+            batch = self.api.new_batch()
+            for key in keys[offset : offset + DETAILS_BATCH_SIZE]:
+                batch.add(
+                    'GET',
+                    f'act_{adaccount_id}/transaction_details',
+                    params={'fields': 'metadata', 'transaction_keys': [key]},
+                    success=on_success(key),
+                    failure=on_failure(key),
+                )
+            # execute возвращает batch из запросов, на которые Graph не ответил
+            attempts = 0
+            while batch is not None and attempts < DETAILS_BATCH_RETRIES:
+                batch = batch.execute()
+                attempts += 1
+
+            for error in errors.values():
+                if error.api_error_code() == 190:
+                    raise error
+
+        return details, len(keys) - len(details)
+
+    def sync_page(
+        self,
+        adaccount_obj: AdAccount,
+        transactions: List,
+        cards: Dict[int, Tuple[int, Optional[int]]],
+        changed_cards: Set[Tuple[int, Optional[int]]],
+    ) -> int:
+        """
+        Пишет страницу транзакций, возвращает количество транзакций, которые не удалось загрузить
+        """
+        details, failed = self.load_details(adaccount_obj.adaccount_id, transactions)
+        rows = []
+        for fb_transaction in transactions:
+            metadata = details.get(transaction_key(fb_transaction))
+            if metadata is None:
+                continue
+            try:
+                payment_method_id = int(metadata.get('payment_method_id'))
+            except (TypeError, ValueError):
+                continue
+            # Транзакции по картам, которых нет в рекламном аккаунте, не сохраняем
+            if payment_method_id in cards:
+                rows.append(transaction_row(adaccount_obj, fb_transaction, cards[payment_method_id]))
+
+        with transaction.atomic():
+            changed_cards.update(AdAccountTransaction.bulk_upsert(rows))
+        return failed
+
+    def sync_adaccount(self, adaccount_obj: AdAccount) -> None:
+        bills_load_at = timezone.now()
+        params: Dict[str, Any] = {'limit': self.page_size}
+        if adaccount_obj.transactions_synced_ts is not None:
+            params['time_start'] = adaccount_obj.transactions_synced_ts
+
+        # credential_id -> (id, card_id), при повторе как раньше берется первая карта
+        cards: Dict[int, Tuple[int, Optional[int]]] = {}
+        adaccount_cards = AdAccountCreditCard.objects.filter(adaccount=adaccount_obj, credential_id__isnull=False)
+        for adaccount_card_id, credential_id, card_id in adaccount_cards.order_by('-id').values_list(
+            'id', 'credential_id', 'card_id'
+        ):
+            cards[credential_id] = (adaccount_card_id, card_id)
+
+        changed_cards: Set[Tuple[int, Optional[int]]] = set()
+        synced_ts = adaccount_obj.transactions_synced_ts
+        failed = 0
+        page: List = []
+        total = 0
+        for fb_transaction in FBAdAccount(fbid=f'act_{adaccount_obj.adaccount_id}').get_transactions(params=params):
+            page.append(fb_transaction)
+            synced_ts = max(synced_ts or 0, fb_transaction['time'])
+            if len(page) >= self.page_size:
+                failed += self.sync_page(adaccount_obj, page, cards, changed_cards)
+                total += len(page)
+                page = []
+        if page:
+            failed += self.sync_page(adaccount_obj, page, cards, changed_cards)
+            total += len(page)
+
+        if changed_cards:
+            adaccount_card_ids = [adaccount_card_id for adaccount_card_id, _ in changed_cards]
+            with transaction.atomic():
+                AdAccountCreditCard.bulk_recalc_spends(ids=adaccount_card_ids)
+                card_ids = {card_id for _, card_id in changed_cards if card_id is not None}
+                if card_ids:
+                    Card.bulk_recalc_spends(ids=list(card_ids))
+
+        update_data: Dict[str, Any] = {'bills_load_at': bills_load_at}
+        # Если часть деталей не загрузилась, отметку не двигаем - в следующий раз страницы загрузятся заново
+        if not failed:
+            update_data['transactions_synced_ts'] = synced_ts
+        AdAccount.update(pk=adaccount_obj.id, action_verb='Success load bills', **update_data)
+        logger.info(
+            f'Adaccount {adaccount_obj.adaccount_id} transactions: {total} loaded, {failed} failed, '
+            f'{len(changed_cards)} cards changed'
+        )
+
+    def run(self) -> None:
+        self.api = init_fb_api(self.account)
+        for adaccount_obj in self.account.adaccounts.filter(deleted_at__isnull=True):
+            try:
+                self.sync_adaccount(adaccount_obj)
+            except FacebookRequestError as e:
+                if e.api_error_code() == 190:
+                    Account.update(pk=self.account.id, action_verb='cleared token', fb_access_token=None)
+                    return
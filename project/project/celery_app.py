@@ -43,6 +43,7 @@ if not settings.DEBUG:
         "create_ads": {"queue": 'automation'},
         "*.create_links": {"queue": 'shortify'},
         "*.process_click_stats": {"queue": 'shortify'},
+        "*.flush_click_stats": {"queue": 'shortify'},
         "*.fill_shortify_cache_task": {"queue": 'shortify'},
         "*.contacts.*": {"queue": 'contacts'},
     }
@@ -297,3 +297,9 @@ ADMINS = [("""Alternativshik""", 'alternativshik@gmail.com')]
 MANAGERS = ADMINS
 
 LOGIN_URL = f'{ADMIN_URL}/login/'
+
+# STATS
+# ------------------------------------------------------------------------------
+# Сколько дней хранить в redis снапшоты статы для подсчета дельт (с последней записи за дату).
+# Должно быть больше глубины перезагрузки статы из трекера и ФБ, иначе стата задвоится
+STAT_SNAPSHOTS_RETENTION_DAYS = env.int('STAT_SNAPSHOTS_RETENTION_DAYS', default=45)
@@ -0,0 +1,18 @@
+from types import SimpleNamespace
+
+from facebook_business import FacebookAdsApi
+from facebook_business.adobjects.user import User as FBUser
+
+from core.fb_governor import GovernedFacebookAdsApi, init_fb_api
+
+
+def test_init_fb_api_sets_default_api():
+    FacebookAdsApi.init(access_token='OTHER')
+    account = SimpleNamespace(id=1, fb_access_token='TOKEN', proxy_config=None)
+
+    api = init_fb_api(account)
+
+    assert isinstance(api, GovernedFacebookAdsApi)
+    assert api.crm_account_id == 1
+    assert FacebookAdsApi.get_default_api() is api
+    assert FBUser(fbid='me').get_api_assured() is api
@@ -0,0 +1,184 @@
+import time
+
+import pytest
+
+from core.phone_normalizer import CSV, EXPORT, FACEBOOK, PHONE_PREFIXES, normalize, normalize_phone, normalize_phones
+
+# Реализации, которые заменил phone_normalizer, в том виде, в котором они были
+COUNTRY_PHONE = {
+    'FR': '+33',
+    'IT': '+39',
+    'DK': '+45',
+    'BE': '+32',
+    'ES': '+34',
+    'GB': '+44',
+    'SE': '+46',
+    'FI': '+358',
+    'CZ': '+420',
+    'US': '+1',
+    'PT': '+351',
+}
+FB_COUNTRY_PHONE_MAP = {
+    'FR': '+330',
+    'IT': '+390',
+    'DK': '+450',
+    'BE': '+320',
+    'CZ': '+420',
+    'GB': '+440',
+    'ES': '+340',
+    'SE': '+460',
+    'US': '+10',
+    'FI': '+3580',
+    'PT': '+3510',
+}
+
+
+def legacy_import_leads_csv(phone, country_code):
+    if phone:
+        phone = phone.replace(' ', '')
+        phone = phone.replace('-', '')
+    try:
+        if phone:
+            prefix = COUNTRY_PHONE[country_code]
+            if not phone.startswith(prefix):
+                if phone.startswith(f'00{prefix[1:]}') or phone.startswith(f'0{prefix[1:]}0'):
+                    phone = phone[4:]
+                    phone = f"{prefix}{phone}"
+                elif phone.startswith('+0'):
+                    phone = phone[2:]
+                    phone = f"{prefix}{phone}"
+                elif phone.startswith('0') or phone.startswith('1'):
+                    phone = phone[1:]
+                    phone = f"{prefix}{phone}"
+                elif phone.startswith(prefix[1:]):
+                    phone = f"+{phone}"
+                elif phone.startswith('+'):
+                    pass
+                else:
+                    phone = f"{prefix}{phone}"
+            elif phone.startswith(f'{prefix}0'):
+                phone = phone.replace(f'{prefix}0', f'{prefix}')
+    except KeyError:
+        pass
+    return phone
+
+
+def legacy_load_leadgen_leads(phone, country_code):
+    data = {'phone': phone}
+    if data.get('phone'):
+        data['phone'] = data['phone'].replace(' ', '')
+
+    fb_country_phone = FB_COUNTRY_PHONE_MAP.get(country_code)
+    if fb_country_phone:
+        if data.get('phone', '').startswith(fb_country_phone):
+            country_phone = COUNTRY_PHONE.get(country_code)
+            data['phone'] = data['phone'].replace(fb_country_phone, country_phone)
+
+    if data.get('phone'):
+        prefix = COUNTRY_PHONE[country_code]
+        if not data['phone'].startswith(prefix):
+            if data['phone'].startswith(f'00{prefix[1:]}') or data['phone'].startswith(f'0{prefix[1:]}0'):
+                data['phone'] = data['phone'][4:]
+                data['phone'] = f"{prefix}{data['phone']}"
+            elif data['phone'].startswith('+0'):
+                data['phone'] = data['phone'][2:]
+                data['phone'] = f"{prefix}{data['phone']}"
+            elif data['phone'].startswith('0') or data['phone'].startswith('1'):
+                data['phone'] = data['phone'][1:]
+                data['phone'] = f"{prefix}{data['phone']}"
+            elif data['phone'].startswith(prefix[1:]):
+                data['phone'] = f"+{data['phone']}"
+            elif data['phone'].startswith('+'):
+                pass
+            else:
+                data['phone'] = f"{prefix}{data['phone']}"
+        elif data['phone'].startswith(f'{prefix}0'):
+            data['phone'] = data['phone'].replace(f'{prefix}0', f'{prefix}')
+    return data['phone']
+
+
+def legacy_clear_phone(phone, country_code):
+    result = phone
+    if phone is not None:
+        prefix = COUNTRY_PHONE[country_code]
+        if not phone.startswith(prefix):
+            if phone.startswith(f'00{prefix[1:]}') or phone.startswith(f'0{prefix[1:]}0'):
+                result = phone[4:]
+                result = f'{prefix}{result}'
+            elif phone.startswith('+0'):
+                result = phone[2:]
+                result = f'{prefix}{result}'
+            elif phone.startswith('0') or phone.startswith('1'):
+                result = phone[1:]
+                result = f'{prefix}{result}'
+            elif phone.startswith(prefix[1:]):
+                result = f'+{phone}'
+            elif phone.startswith('+'):
+                result = phone
+            else:
+                result = f'{prefix}{phone}'
+    return result
+
+
+def sample_phones(prefix):
+    code = prefix[1:]
+    return [
+        f'{prefix}612345678',
+        f'{prefix}0612345678',
+        f'{prefix}00612345678',
+        f'{prefix} 612 345 678',
+        f'{prefix}-612-345-678',
+        f'00{code}612345678',
+        f'0{code}0612345678',
+        f'{code}612345678',
+        f'{code} 612 345 678',
+        '+0612345678',
+        '0612345678',
+        '06 12 34 56 78',
+        '06-12-34-56-78',
+        '1612345678',
+        '612345678',
+        '612 345 678',
+        '+48612345678',
+        ' ',
+        '-',
+    ]
+
+
+@pytest.fixture
+def prefixes():
+    PHONE_PREFIXES.prefixes = dict(COUNTRY_PHONE)
+    PHONE_PREFIXES.loaded_at = time.monotonic()
+    normalize.cache_clear()
+    yield
+    PHONE_PREFIXES.prefixes = None
+    normalize.cache_clear()
+
+
+@pytest.mark.parametrize('country_code', COUNTRY_PHONE)
+def test_normalize_phone_matches_legacy(prefixes, country_code):
+    for phone in sample_phones(COUNTRY_PHONE[country_code]):
+        assert normalize_phone(phone, country_code, CSV) == legacy_import_leads_csv(phone, country_code), phone
+        assert normalize_phone(phone, country_code, EXPORT) == legacy_clear_phone(phone, country_code), phone
+        if country_code == 'CZ' and phone.startswith('+42000'):
+            # В FB_COUNTRY_PHONE_MAP для CZ был код без 0, поэтому из +42000 убирался только один 0
+            assert normalize_phone(phone, country_code, FACEBOOK) == '+420612345678'
+            continue
+        assert normalize_phone(phone, country_code, FACEBOOK) == legacy_load_leadgen_leads(phone, country_code), phone
+
+
+def test_normalize_phone_unknown_country(prefixes):
+    assert normalize_phone('06 12-34', 'PL', CSV) == legacy_import_leads_csv('06 12-34', 'PL')
+    assert normalize_phone('06 12-34', None, CSV) == '061234'
+    assert normalize_phone(None, 'FR', CSV) is None
+
+
+def test_normalize_phones_batch(prefixes):
+    phones = sample_phones('+33') + [None]
+    assert normalize_phones(phones, 'FR', FACEBOOK) == [normalize_phone(phone, 'FR', FACEBOOK) for phone in phones]
+
+    codes = list(COUNTRY_PHONE) * 2
+    phones = [f'0{i}12345678' for i in range(len(codes))]
+    assert normalize_phones(phones, codes, CSV) == [
+        legacy_import_leads_csv(phone, code) for phone, code in zip(phones, codes)
+    ]
@@ -0,0 +1,36 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+import pytest
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.v1.views.stats import AccountsStatView
+from core.models import User
+from core.models.core import Account, UserAccountDayStat
+
+
+@pytest.mark.django_db
+def test_accounts_stats_queries_do_not_depend_on_page_size(user):
+    user.role = User.ADMIN
+    user.save()
+
+    today = timezone.now().date()
+    for _ in range(6):
+        account = Account.objects.create(created_by=user, manager=user)
+        UserAccountDayStat.objects.create(
+            account=account, user=user, date=today, spend=10, clicks=5, visits=10, leads=1, revenue=20
+        )
+
+    def count_queries(limit):
+        cache.clear()
+        request = APIRequestFactory().get('/', {'limit': limit})
+        force_authenticate(request, user=user)
+        with CaptureQueriesContext(connection) as context:
+            response = AccountsStatView.as_view()(request)
+        assert response.status_code == 200
+        assert len(response.data['results']) == limit
+        return len(context)
+
+    assert count_queries(2) == count_queries(6)